@@ -0,0 +1,246 @@
+import configparser
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import traceback
+from logging import Logger
+
+import pandas as pd
+
+from CORE.Error_Handling import ErrorHandling
+
+
+class CandleCache(ErrorHandling):
+    def __init__(self, config_object: configparser.ConfigParser, logger: Logger):
+        """
+        On-disk Parquet cache of raw candles in front of the broker API.
+        Partitions are keyed by instrument / granularity / price type / month and recorded in a manifest with
+        their checksum, coverage and last access, which drives the integrity check and the LRU eviction.
+        :param config_object: ConfigManager object
+        :param logger: Logger object
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.config = config_object
+
+        self.cache_path: str = self.config.get('system', 'candle_cache_path', fallback='CandleCache')
+        self.max_bytes: int = self.config.getint('system', 'candle_cache_max_mb', fallback=2048) * 1024 * 1024
+        self.fresh_seconds: int = self.config.getint('system', 'candle_cache_fresh_minutes', fallback=60) * 60
+        self.manifest_path: str = os.path.join(self.cache_path, 'manifest.json')
+        self.lock = threading.RLock()
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        self.manifest: dict = self.read_manifest()
+
+    def read_manifest(self) -> dict:
+        """
+        :return: manifest of cached partitions, empty if missing or unreadable
+        """
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write_manifest(self) -> None:
+        """
+        Atomically replace the manifest on disk.
+        :return:
+        """
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(temp_path, self.manifest_path)
+
+    def partition_key(self, instrument: str, granularity: str, price_type: str, month: pd.Period) -> str:
+        return f"{instrument}/{granularity}/{price_type}/{month.strftime('%Y-%m')}"
+
+    def missing_ranges(self, instrument: str, granularity: str, price_type: str,
+                       start: pd.Timestamp, end: pd.Timestamp) -> list:
+        """
+        Date ranges of the request that are not cached yet, contiguous months merged into one range.
+        :return: list of (start, end) pd.Timestamp tuples
+        """
+        now = time.time()
+        ranges = []
+        with self.lock:
+            for month in pd.period_range(start, end, freq='M'):
+                entry = self.manifest.get(self.partition_key(instrument, granularity, price_type, month))
+                month_start = max(month.start_time, start)
+                month_end = min(month.end_time.floor('s'), end)
+
+                if entry is None or pd.Timestamp(entry['covered_from']) > month_start:
+                    missing_from = month_start
+                elif entry['complete'] or now - entry['written'] < self.fresh_seconds:
+                    continue
+                else:
+                    missing_from = max(pd.Timestamp(entry['covered_to']), month_start)
+
+                if ranges and ranges[-1][1] >= missing_from - pd.Timedelta(seconds=1):
+                    ranges[-1] = (ranges[-1][0], month_end)
+                else:
+                    ranges.append((missing_from, month_end))
+
+        return ranges
+
+    def store(self, instrument: str, granularity: str, price_type: str, frame: pd.DataFrame,
+              start: pd.Timestamp, end: pd.Timestamp) -> None:
+        """
+        Write fetched candles covering [start, end] into their monthly partitions.
+        An empty frame is not taken as an answer for the range, nothing is recorded so it is fetched again
+        instead of being marked complete.
+        :param frame: OHLCV frame with a naive UTC datetime index
+        :return:
+        """
+        if frame.shape[0] == 0:
+            self.logger.warning(f"store -> {instrument} {granularity} no candles for {start} - {end}, not cached")
+            return
+
+        fetched_at = pd.Timestamp.now('UTC').tz_localize(None)
+        frame = frame.set_axis(pd.to_datetime(frame.index, utc=True).tz_localize(None))
+        months = frame.index.to_period('M')
+
+        for month in pd.period_range(start, end, freq='M'):
+            key = self.partition_key(instrument, granularity, price_type, month)
+            part = frame[months == month]
+            covered_from = max(month.start_time, start)
+            covered_to = min(month.end_time.floor('s'), end)
+
+            with self.lock:
+                previous = self.manifest.get(key)
+                existing = self.load_partition(key) if previous is not None else None
+                if existing is not None:
+                    covered_from = min(covered_from, pd.Timestamp(previous['covered_from']))
+                    covered_to = max(covered_to, pd.Timestamp(previous['covered_to']))
+                    if existing.shape[0] > 0:
+                        part = pd.concat([existing, part])
+                        part = part[~part.index.duplicated(keep='last')].sort_index()
+
+                complete = month.end_time < fetched_at and covered_from <= month.start_time and covered_to >= month.end_time.floor('s')
+                entry = {'rows': int(part.shape[0]), 'bytes': 0, 'sha256': None, 'complete': bool(complete),
+                         'covered_from': str(covered_from), 'covered_to': str(covered_to),
+                         'written': time.time(), 'accessed': time.time()}
+
+                if part.shape[0] > 0:
+                    buffer = io.BytesIO()
+                    part.to_parquet(buffer)
+                    payload = buffer.getvalue()
+
+                    path = os.path.join(self.cache_path, f"{key}.parquet")
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(f"{path}.tmp", 'wb') as partition_file:
+                        partition_file.write(payload)
+                    os.replace(f"{path}.tmp", path)
+
+                    entry['bytes'] = len(payload)
+                    entry['sha256'] = hashlib.sha256(payload).hexdigest()
+
+                self.manifest[key] = entry
+
+        with self.lock:
+            self.write_manifest()
+
+    def load_partition(self, key: str):
+        """
+        Read a partition after checking its checksum, a corrupt partition is dropped from the cache.
+        :param key: partition key
+        :return: pd.DataFrame, None if the partition failed the integrity check
+        """
+        entry = self.manifest[key]
+        if entry['rows'] == 0:
+            return pd.DataFrame()
+
+        path = os.path.join(self.cache_path, f"{key}.parquet")
+        try:
+            with open(path, 'rb') as partition_file:
+                payload = partition_file.read()
+
+            if hashlib.sha256(payload).hexdigest() != entry['sha256']:
+                raise ValueError('checksum mismatch')
+
+            entry['accessed'] = time.time()
+            return pd.read_parquet(io.BytesIO(payload))
+
+        except (OSError, ValueError) as error_:
+            self.logger.warning(f"load_partition -> {key} failed integrity check ({error_}), evicting")
+            self.remove(key)
+            return None
+
+    def remove(self, key: str) -> None:
+        """
+        Remove a partition file and its manifest entry.
+        :param key: partition key
+        :return:
+        """
+        self.manifest.pop(key, None)
+        path = os.path.join(self.cache_path, f"{key}.parquet")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def evict(self) -> None:
+        """
+        Drop least recently used partitions until the cache fits in candle_cache_max_mb.
+        :return:
+        """
+        total = sum(entry['bytes'] for entry in self.manifest.values())
+        for key, entry in sorted(self.manifest.items(), key=lambda item: item[1]['accessed']):
+            if total <= self.max_bytes:
+                break
+            if entry['bytes'] > 0:
+                total -= entry['bytes']
+                self.remove(key)
+                self.logger.debug(f"evict -> {key}")
+
+    def get_candles(self, instrument: str, granularity: str, price_type: str,
+                    start: pd.Timestamp, end: pd.Timestamp, fetch) -> pd.DataFrame:
+        """
+        Serve candles from the cache, only calling the broker for the ranges that are missing.
+        :param instrument: str name of instrument on OANDA XXX_XXX
+        :param granularity: OANDA granularity name
+        :param price_type: M, B or A
+        :param start: first bar
+        :param end: last bar
+        :param fetch: callable(start, end) returning an OHLCV frame from the broker, False or None when the fetch failed
+        :return: pd.DataFrame of OHLCV with a naive UTC datetime index, False on error
+        """
+        result = False
+        try:
+            # A partition failing its integrity check is evicted on read, so it is fetched again on the next pass
+            for attempt in range(2):
+                for missing_start, missing_end in self.missing_ranges(instrument, granularity, price_type, start, end):
+                    self.logger.debug(f"get_candles -> {instrument} {granularity} fetching {missing_start} - {missing_end}")
+                    fetched = fetch(missing_start, missing_end)
+                    if fetched is False or fetched is None:
+                        raise RuntimeError(f"broker fetch failed for {missing_start} - {missing_end}")
+                    self.store(instrument, granularity, price_type, fetched, missing_start, missing_end)
+
+                with self.lock:
+                    parts = [self.load_partition(key) for key in
+                             (self.partition_key(instrument, granularity, price_type, month)
+                              for month in pd.period_range(start, end, freq='M')) if key in self.manifest]
+                    self.write_manifest()
+
+                if all(part is not None for part in parts):
+                    break
+
+            parts = [part for part in parts if part is not None and part.shape[0] > 0]
+            result = pd.DataFrame()
+            if parts:
+                frame = pd.concat(parts)
+                result = frame[(frame.index >= start) & (frame.index <= end)]
+
+            # Evict only once the request is served so its own partitions are not dropped mid-read
+            with self.lock:
+                self.evict()
+                self.write_manifest()
+
+        except Exception as error_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: get_candles -> {instrument} {granularity}: {error_}\n{traceback.format_exc()}"))
+
+        return result
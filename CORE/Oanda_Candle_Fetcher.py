@@ -0,0 +1,286 @@
+import asyncio
+import configparser
+import random
+import threading
+import time
+import traceback
+import weakref
+from logging import Logger
+
+import aiohttp
+import pandas as pd
+
+from CORE.Error_Handling import ErrorHandling
+
+# Bar length of each OANDA granularity in seconds, 'M' (month) uses its longest length
+OANDA_GRANULARITY_SECONDS: dict = {
+    'S5': 5, 'S10': 10, 'S15': 15, 'S30': 30,
+    'M1': 60, 'M2': 120, 'M4': 240, 'M5': 300, 'M10': 600, 'M15': 900, 'M30': 1800,
+    'H1': 3600, 'H2': 7200, 'H3': 10800, 'H4': 14400, 'H6': 21600, 'H8': 28800, 'H12': 43200,
+    'D': 86400, 'W': 604800, 'M': 2678400,
+}
+OANDA_URLS: dict = {
+    'fxTrade Practice': 'https://api-fxpractice.oanda.com',
+    'fxTrade': 'https://api-fxtrade.oanda.com',
+}
+PRICE_COMPONENTS: dict = {'M': 'mid', 'B': 'bid', 'A': 'ask'}
+RETRY_STATUS: tuple = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """
+        Token bucket shared by every event loop and thread in the process.
+        Coroutines of one event loop queue on an asyncio.Lock of that loop, so only the head of the queue waits
+        for a token. The token count itself is shared across threads and updated under a threading.Lock that
+        is never held across an await.
+        :param rate: tokens added per second
+        :param capacity: maximum burst size
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.state_lock = threading.Lock()
+        self.loop_locks = weakref.WeakKeyDictionary()
+
+    def loop_lock(self) -> asyncio.Lock:
+        """
+        :return: the asyncio.Lock of the running event loop, created on first use
+        """
+        loop = asyncio.get_running_loop()
+        with self.state_lock:
+            lock = self.loop_locks.get(loop)
+            if lock is None:
+                lock = self.loop_locks[loop] = asyncio.Lock()
+        return lock
+
+    def take(self) -> float:
+        """
+        Take a token if one is available.
+        :return: 0 when a token was taken, otherwise the seconds until the next one
+        """
+        with self.state_lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        :return:
+        """
+        async with self.loop_lock():
+            wait = self.take()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.take()
+
+
+class OandaCandleFetcher(ErrorHandling):
+    def __init__(self, config_object: configparser.ConfigParser, logger: Logger):
+        """
+        Concurrent historical candle downloader for the OANDA v20 REST API.
+        A date range is split into max-candles-per-request chunks that are fetched concurrently over one
+        keep-alive session, throttled by a process wide token bucket and reassembled in order.
+        :param config_object: ConfigManager object
+        :param logger: Logger object
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.config = config_object
+
+        self.api_url: str = self.config.get('oanda', 'api_url', fallback='') or OANDA_URLS[self.config.get('oanda', 'account_type')]
+        self.access_token: str = self.config.get('oanda', 'access_token')
+        self.max_candles: int = self.config.getint('oanda', 'max_candles_per_request', fallback=5000)
+        self.max_concurrent: int = self.config.getint('oanda', 'max_concurrent_requests', fallback=10)
+        self.retries: int = self.config.getint('oanda', 'request_retries', fallback=5)
+        self.backoff: float = self.config.getfloat('oanda', 'request_backoff_seconds', fallback=0.5)
+        self.start_date: str = self.config.get('system', 'start_date')
+
+    # One limiter for the whole process, the broker rate limit is per token not per instrument
+    rate_limiter: TokenBucket = None
+    rate_limiter_lock = threading.Lock()
+
+    def get_rate_limiter(self) -> TokenBucket:
+        """
+        :return: the process wide TokenBucket, created from config on first use
+        """
+        with OandaCandleFetcher.rate_limiter_lock:
+            if OandaCandleFetcher.rate_limiter is None:
+                rate = self.config.getfloat('oanda', 'requests_per_second', fallback=100)
+                OandaCandleFetcher.rate_limiter = TokenBucket(rate, rate)
+
+        return OandaCandleFetcher.rate_limiter
+
+    def chunk_range(self, granularity: str, start: pd.Timestamp, end: pd.Timestamp) -> list:
+        """
+        Split a date range into windows holding at most max_candles bars.
+        :param granularity: OANDA granularity name
+        :param start: first bar to fetch
+        :param end: last bar to fetch
+        :return: list of (from, to) pd.Timestamp tuples in order
+        """
+        window = pd.Timedelta(seconds=OANDA_GRANULARITY_SECONDS[granularity] * (self.max_candles - 1))
+        chunks = []
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + window, end)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end + pd.Timedelta(seconds=OANDA_GRANULARITY_SECONDS[granularity])
+
+        return chunks
+
+    async def fetch_chunk(self, session: aiohttp.ClientSession, instrument: str, granularity: str,
+                          price_type: str, chunk_start: pd.Timestamp, chunk_end: pd.Timestamp) -> list:
+        """
+        Fetch one page of candles, retrying throttled and failed requests with exponential backoff.
+        :return: list of candle dicts
+        """
+        params = {
+            'granularity': granularity,
+            'price': price_type,
+            'from': chunk_start.strftime('%Y-%m-%dT%H:%M:%S.000000000Z'),
+            'to': chunk_end.strftime('%Y-%m-%dT%H:%M:%S.000000000Z'),
+        }
+        url = f"{self.api_url}/v3/instruments/{instrument}/candles"
+
+        for attempt in range(self.retries + 1):
+            await self.get_rate_limiter().acquire()
+            try:
+                async with session.get(url, params=params) as response:
+                    if response.status == 200:
+                        return (await response.json())['candles']
+
+                    if response.status not in RETRY_STATUS:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=await response.text())
+
+                    retry_after = response.headers.get('Retry-After')
+                    self.logger.debug(f"fetch_chunk -> {instrument} {params['from']} status {response.status}, retrying")
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error_:
+                retry_after = None
+                self.logger.debug(f"fetch_chunk -> {instrument} {params['from']} {error_}, retrying")
+
+            if attempt == self.retries:
+                break
+
+            delay = float(retry_after) if retry_after else self.backoff * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, self.backoff))
+
+        raise RuntimeError(f"fetch_chunk -> {instrument} {params['from']} failed after {self.retries} retries")
+
+    def candles_to_frame(self, pages: list, price_type: str) -> pd.DataFrame:
+        """
+        Reassemble ordered candle pages into one OHLCV frame with a naive UTC datetime index.
+        :param pages: list of candle lists in chunk order
+        :param price_type: M, B or A
+        :return: pd.DataFrame
+        """
+        component = PRICE_COMPONENTS[price_type]
+        candles = [candle for page in pages for candle in page if candle.get('complete', True)]
+
+        frame = pd.DataFrame({
+            'Open': [float(candle[component]['o']) for candle in candles],
+            'High': [float(candle[component]['h']) for candle in candles],
+            'Low': [float(candle[component]['l']) for candle in candles],
+            'Close': [float(candle[component]['c']) for candle in candles],
+            'Volume': [int(candle['volume']) for candle in candles],
+        }, index=pd.to_datetime([candle['time'] for candle in candles], utc=True).tz_localize(None))
+        frame.index.rename('DateTime', inplace=True)
+
+        # Chunk boundaries can return the same bar twice
+        return frame[~frame.index.duplicated(keep='last')].sort_index()
+
+    async def fetch_candles(self, session: aiohttp.ClientSession, instrument: str, granularity: str,
+                            price_type: str = 'M', start: pd.Timestamp = None, end: pd.Timestamp = None) -> pd.DataFrame:
+        """
+        Fetch every chunk of an instrument's date range on a shared session, at most max_concurrent_requests
+        chunks are in flight. Pages are stored by chunk index, so the frame is in order whatever order they arrive in.
+        :param session: keep-alive aiohttp session
+        :param instrument: str name of instrument on OANDA XXX_XXX
+        :param granularity: OANDA granularity name
+        :param price_type: M, B or A
+        :param start: first bar, defaults to [system] start_date
+        :param end: last bar, defaults to now
+        :return: pd.DataFrame
+        """
+        start = pd.Timestamp(start if start is not None else self.start_date)
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.now('UTC').tz_localize(None)
+        chunks = self.chunk_range(granularity, start, end)
+        self.logger.debug(f"fetch_candles -> {instrument} {granularity} {len(chunks)} chunks from {start}")
+
+        pages = [None] * len(chunks)
+        queue = asyncio.Queue()
+        for index in range(len(chunks)):
+            queue.put_nowait(index)
+
+        async def worker() -> None:
+            while not queue.empty():
+                index = queue.get_nowait()
+                pages[index] = await self.fetch_chunk(session, instrument, granularity, price_type, *chunks[index])
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.max_concurrent, len(chunks)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            # One failed chunk fails the instrument, the other workers stop instead of fetching the rest
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+
+        return self.candles_to_frame(pages, price_type)
+
+    def open_session(self) -> aiohttp.ClientSession:
+        """
+        :return: keep-alive aiohttp session authorised for the OANDA API
+        """
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_concurrent),
+                                     headers={'Authorization': f"Bearer {self.access_token}",
+                                              'Accept-Datetime-Format': 'RFC3339'})
+
+    async def fetch_many(self, requests: list) -> list:
+        """
+        Fetch several instruments concurrently over one session.
+        :param requests: list of (instrument, granularity, price_type, start) tuples
+        :return: list of pd.DataFrame, or the exception raised for that instrument, in request order
+        """
+        async with self.open_session() as session:
+            return await asyncio.gather(*[self.fetch_candles(session, instrument, granularity, price_type, start)
+                                          for instrument, granularity, price_type, start in requests],
+                                        return_exceptions=True)
+
+    def get_historical_candles(self, instrument: str, granularity: str, price_type: str = 'M',
+                               start: pd.Timestamp = None, end: pd.Timestamp = None) -> pd.DataFrame:
+        """
+        Blocking entry point, safe to call from worker threads.
+        :param instrument: str name of instrument on OANDA XXX_XXX
+        :param granularity: OANDA granularity name
+        :param price_type: M, B or A
+        :param start: first bar, defaults to [system] start_date
+        :param end: last bar, defaults to now
+        :return: pd.DataFrame of OHLCV, False on error
+        """
+        async def run() -> pd.DataFrame:
+            async with self.open_session() as session:
+                return await self.fetch_candles(session, instrument, granularity, price_type, start, end)
+
+        result = False
+        try:
+            result = asyncio.run(run())
+
+        except Exception as error_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: get_historical_candles -> {instrument} {granularity}: {error_}\n{traceback.format_exc()}"))
+
+        return result
+
@@ -1,10 +1,16 @@
+import atexit
 import configparser
 import contextlib
+import io
+import threading
+import time
 import traceback
+import weakref
 from logging import Logger
 
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, make_url, select, text, LargeBinary, UniqueConstraint
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from CORE.Error_Handling import ErrorHandling
@@ -38,6 +44,19 @@ register_adapter(np.float32, addapt_numpy_float32)
 register_adapter(np.int32, addapt_numpy_int32)
 register_adapter(np.ndarray, addapt_numpy_array)
 
+# Interfaces whose engine is still open, disposed by the single exit hook below
+OPEN_INTERFACES = weakref.WeakSet()
+
+
+@atexit.register
+def close_open_interfaces() -> None:
+    """
+    Dispose every engine still open at process exit. Holding the interfaces weakly keeps
+    the hook from extending their lifetime.
+    """
+    for interface in list(OPEN_INTERFACES):
+        interface.close_database_connection()
+
 
 class PostgreSQLInterface(ErrorHandling):
     def __init__(self, config_object: configparser.ConfigParser, logger: Logger):
@@ -47,11 +66,35 @@ class PostgreSQLInterface(ErrorHandling):
         super().__init__(logger)
 
         self.hide_progress_bar: bool = self.config.getboolean('system', 'hide_progress_bar')
-        self.engine = create_engine(self.config.get('system', 'db_string'),
-                                    pool_size=-1,
-                                    pool_recycle=10,
-                                    echo=self.config.getboolean('system', 'echo_transactions')
-                                    )
+        self.load_statistics: dict = {}
+
+        # One pooled engine for the life of the process, sized for the import thread pool
+        db_string = self.config.get('system', 'db_string')
+        self.engine = create_engine(db_string,
+                                    echo=self.config.getboolean('system', 'echo_transactions'),
+                                    **self.pool_arguments(db_string))
+
+        self.checkout_lock = threading.Lock()
+        self.checkout_count: int = 0
+        self.checkout_wait_total: float = 0.0
+        self.checkout_wait_max: float = 0.0
+        OPEN_INTERFACES.add(self)
+
+    def pool_arguments(self, db_string: str) -> dict:
+        """
+        Pool sizing only applies to a QueuePool. Other pools, such as the SingletonThreadPool of a
+        SQLite :memory: engine, reject pool_size, max_overflow and pool_timeout.
+        :param db_string: database url
+        :return: keyword arguments for create_engine
+        """
+        url = make_url(db_string)
+        arguments = {'pool_recycle': self.config.getint('system', 'db_pool_recycle', fallback=1800),
+                     'pool_pre_ping': True}
+        if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+            arguments.update(pool_size=self.config.getint('system', 'db_pool_size', fallback=10),
+                             max_overflow=self.config.getint('system', 'db_max_overflow', fallback=20),
+                             pool_timeout=self.config.getint('system', 'db_pool_timeout', fallback=30))
+        return arguments
 
     @contextlib.contextmanager
     def connect_session(self) -> Session:
@@ -59,10 +102,13 @@ class PostgreSQLInterface(ErrorHandling):
         Establish connection with database string found in config.
         :return:
         """
+        connection = None
+        session = None
         try:
             if not self.ErrorsDetected:
                 if self.engine:
-                    session = Session(bind=self.engine)
+                    connection = self.checkout_connection(self.engine.connect)
+                    session = Session(bind=connection)
 
                     yield session
                     self.logger.debug(f"Connected Successfully to Database")
@@ -83,10 +129,249 @@ class PostgreSQLInterface(ErrorHandling):
                 self.error_details(f"{__class__}: connect_session -> Error connecting to the database: {error_} \n {traceback.format_exc()}"))
 
         finally:
-            self.close_database_connection()
+            # Return the connection to the pool, the engine itself stays alive until process exit
+            if session is not None:
+                session.close()
+            if connection is not None:
+                connection.close()
+
+    def checkout_connection(self, connect):
+        """
+        Check a connection out of the pool and record how long the checkout waited.
+        :param connect: engine.connect or engine.raw_connection
+        :return: the checked out connection
+        """
+        start = time.perf_counter()
+        connection = connect()
+        waited = time.perf_counter() - start
+
+        with self.checkout_lock:
+            self.checkout_count += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+        return connection
+
+    def pool_status(self) -> dict:
+        """
+        Pool usage, used to size db_pool_size and db_max_overflow under load.
+        :return: dict of pool size, active connections and checkout wait timings
+        """
+        pool = self.engine.pool
+        with self.checkout_lock:
+            checkouts = self.checkout_count
+            wait_total = self.checkout_wait_total
+            wait_max = self.checkout_wait_max
+
+        # Only a QueuePool reports these, SingletonThreadPool.size is a plain attribute
+        def counter(name: str):
+            method = getattr(pool, name, None)
+            return method() if callable(method) else None
+
+        return {
+            'pool_size': counter('size'),
+            'checked_out': counter('checkedout'),
+            'checked_in': counter('checkedin'),
+            'overflow': counter('overflow'),
+            'checkouts': checkouts,
+            'checkout_wait_avg': wait_total / checkouts if checkouts else 0.0,
+            'checkout_wait_max': wait_max,
+        }
+
+    def copy_fact_batch(self, batch, use_staging: bool = True, on_conflict: str = 'nothing', replace: bool = False) -> int:
+        """
+        Bulk load a columnar FactBatch with COPY ... FROM STDIN (CSV) from an in-memory buffer.
+        With use_staging the rows are copied into a temporary table and merged with
+        INSERT ... ON CONFLICT so reloads stay idempotent.
+        A SQLite engine falls back to INSERT OR IGNORE / OR REPLACE so the path can be exercised without Postgres.
+        :param batch: FactBatch to load
+        :param use_staging: merge through a staging table instead of copying straight into the target
+        :param on_conflict: 'nothing' keeps stored rows, 'update' overwrites them with the batch
+        :param replace: delete every stored row of the table in the same transaction first, readers keep
+                        seeing the old rows until the load commits and a failed load leaves them in place
+        :return: number of rows inserted or updated, False on error
+        """
+        result = False
+        if not self.ErrorsDetected:
+            table = batch.model.__table__
+            columns = batch.column_names()
+            target = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+            column_list = ', '.join(f'"{name}"' for name in columns)
+
+            connection = None
+            start = time.perf_counter()
+            try:
+                connection = self.checkout_connection(self.engine.raw_connection)
+                cursor = connection.cursor()
+                if replace:
+                    cursor.execute(f"DELETE FROM {target}")
+
+                if self.engine.dialect.name == 'sqlite':
+                    rows = batch.to_rows()
+                    verb = 'INSERT OR REPLACE' if on_conflict == 'update' else 'INSERT OR IGNORE'
+                    cursor.executemany(f"{verb} INTO {target} ({column_list}) "
+                                       f"VALUES ({', '.join('?' for _ in columns)})", rows)
+                    inserted = cursor.rowcount
+
+                else:
+                    frame = batch.to_frame()
+                    for name in columns:
+                        if isinstance(table.c[name].type, LargeBinary):
+                            # bytea hex input format, CSV has no escape for raw bytes
+                            frame[name] = ['\\x' + value.hex() for value in frame[name]]
+
+                    buffer = io.StringIO()
+                    frame.to_csv(buffer, header=False, index=False, na_rep='')
+                    buffer.seek(0)
+
+                    if use_staging or on_conflict == 'update':
+                        staging = f'"staging_{table.name}"'
+                        cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP")
+                        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+                        if on_conflict == 'update':
+                            # Conflict on the natural key, partitioned tables cannot hold a unique index on id alone
+                            natural_key = next((list(constraint.columns.keys()) for constraint in table.constraints
+                                                if isinstance(constraint, UniqueConstraint)), ['id'])
+                            updates = ', '.join(f'"{name}" = EXCLUDED."{name}"' for name in columns if name not in natural_key)
+                            conflict = ', '.join(f'"{name}"' for name in natural_key)
+                            merge = f'ON CONFLICT ({conflict}) DO UPDATE SET {updates}'
+                        else:
+                            merge = 'ON CONFLICT DO NOTHING'
+                        cursor.execute(f"INSERT INTO {target} ({column_list}) "
+                                       f"SELECT {column_list} FROM {staging} {merge}")
+
+                    else:
+                        cursor.copy_expert(f"COPY {target} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+                    inserted = cursor.rowcount
+
+                connection.commit()
+                cursor.close()
+
+                elapsed = max(time.perf_counter() - start, 1e-9)
+                stats = self.load_statistics.setdefault(table.name, {'rows': 0, 'seconds': 0.0})
+                stats['rows'] += len(batch)
+                stats['seconds'] += elapsed
+                self.logger.info(f"copy_fact_batch -> {table.name}: {len(batch)} rows in {elapsed:.2f}s "
+                                 f"({len(batch) / elapsed:.0f} rows/sec), {inserted} written")
+                result = inserted
+
+            except Exception as error_:
+                if connection is not None:
+                    connection.rollback()
+                self.ErrorsDetected = True
+                self.ErrorList.append(
+                    self.error_details(f"{__class__}: copy_fact_batch -> Failed to load {table.name}: {error_} \n {traceback.format_exc()}"))
+
+            finally:
+                if connection is not None:
+                    connection.close()
+
+        return result
+
+    def stream_model(self, model, columns: list = None, instrument_keys: list = None, granularity_keys: list = None,
+                     datetime_from: int = None, datetime_to: int = None, where: tuple = (), order_by: str = None,
+                     batch_size: int = None):
+        """
+        Read a Dimension_* / Facts_* table as typed columnar batches over a server-side cursor.
+        Rows are fetched batch_size at a time with Core select, no ORM object is built per row.
+        Filters are pushed down to the database, a filter is skipped when the model lacks its column.
+        :param model: Dimension_* or Facts_* model
+        :param columns: column names to read, defaults to all
+        :param instrument_keys: InstrumentKey values to keep
+        :param granularity_keys: GranularityKey values to keep
+        :param datetime_from: inclusive lower DateTimeKey
+        :param datetime_to: inclusive upper DateTimeKey
+        :param where: extra Core predicates, e.g. (Facts_Instruments.PriceTypeKey == 1,)
+        :param order_by: column name to sort on
+        :param batch_size: rows per batch, defaults to [system] db_stream_batch_rows
+        :return: generator of dict of column name to np.ndarray, a failed read is logged and raised so a
+                 consumer never mistakes a truncated stream for the whole table
+        """
+        table = model.__table__
+        selected = [table.c[name] for name in columns] if columns else list(table.c)
+        batch_size = batch_size or self.config.getint('system', 'db_stream_batch_rows', fallback=100000)
+
+        predicates = list(where)
+        if instrument_keys is not None and 'InstrumentKey' in table.c:
+            predicates.append(table.c.InstrumentKey.in_([int(key) for key in instrument_keys]))
+        if granularity_keys is not None and 'GranularityKey' in table.c:
+            predicates.append(table.c.GranularityKey.in_([int(key) for key in granularity_keys]))
+        if datetime_from is not None and 'DateTimeKey' in table.c:
+            predicates.append(table.c.DateTimeKey >= int(datetime_from))
+        if datetime_to is not None and 'DateTimeKey' in table.c:
+            predicates.append(table.c.DateTimeKey <= int(datetime_to))
+
+        stmt = select(*selected).where(*predicates)
+        if order_by is not None:
+            stmt = stmt.order_by(table.c[order_by])
+
+        connection = None
+        try:
+            connection = self.checkout_connection(self.engine.connect)
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+
+            for rows in result.partitions(batch_size):
+                yield {column.name: self.column_array(column, values) for column, values in zip(selected, zip(*rows))}
+
+        except SQLAlchemyError as error_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(
+                self.error_details(f"{__class__}: stream_model -> Failed to read {table.name}: {error_} \n {traceback.format_exc()}"))
+            raise
+
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def column_array(self, column, values: tuple) -> np.ndarray:
+        """
+        :param column: SQLAlchemy column the values were read from
+        :param values: one batch of values for the column
+        :return: the dtype only depends on the column definition, so every batch of a stream agrees:
+                 int64 for NOT NULL integer columns, float64 with NaN for nullable integer and float columns,
+                 object otherwise
+        """
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = object
+
+        if python_type is int and not column.nullable:
+            return np.array(values, dtype=np.int64)
+        if python_type in (int, float):
+            return np.array(values, dtype=np.float64)
+
+        return np.array(values, dtype=object)
+
+    def read_model(self, model, **filters) -> pd.DataFrame:
+        """
+        Read a whole (filtered) table through stream_model, meant for dimensions and single series.
+        :param model: Dimension_* or Facts_* model
+        :param filters: keyword arguments of stream_model
+        :return: pd.DataFrame with one column per selected table column
+        """
+        batches = list(self.stream_model(model, **filters))
+        names = filters.get('columns') or [column.name for column in model.__table__.c]
+        if not batches:
+            return pd.DataFrame({name: self.column_array(model.__table__.c[name], ()) for name in names})
+
+        return pd.DataFrame({name: np.concatenate([batch[name] for batch in batches]) for name in names})
+
+    def load_rates(self) -> dict:
+        """
+        :return: rows/sec per table for every batch loaded through copy_fact_batch
+        """
+        return {name: stats['rows'] / stats['seconds'] for name, stats in self.load_statistics.items() if stats['seconds'] > 0}
 
     def close_database_connection(self) -> None:
+        """
+        Dispose of the pooled engine, run by close_open_interfaces at process exit if not called before.
+        :return:
+        """
+        OPEN_INTERFACES.discard(self)
         if self.engine:
+            self.logger.debug(f"Pool status at shutdown: {self.pool_status()}")
             self.engine.dispose()
             self.logger.debug("Connection to the database closed.")
         else:
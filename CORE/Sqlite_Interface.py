@@ -1,11 +1,27 @@
+import atexit
 import configparser
 import sqlite3
+import threading
+import weakref
 from logging import Logger
 
 import numpy as np
 import pandas as pd
 from CORE.Error_Handling import ErrorHandling
 
+# Interfaces with connections possibly still open, closed by the single exit hook below
+OPEN_INTERFACES = weakref.WeakSet()
+
+
+@atexit.register
+def close_open_interfaces() -> None:
+    """
+    Close the connections of every interface still alive at process exit. Holding the interfaces
+    weakly keeps the hook from extending their lifetime.
+    """
+    for interface in list(OPEN_INTERFACES):
+        interface.close_all_connections()
+
 
 class SqliteInterface(ErrorHandling):
     def __init__(self, config_object: configparser.ConfigParser, logger: Logger):
@@ -13,6 +29,113 @@ class SqliteInterface(ErrorHandling):
         self.logger = logger
         self.config = config_object
 
+        self.sqlite_cache_size_mb: int = self.config.getint('system', 'sqlite_cache_size_mb', fallback=64)
+        self.sqlite_mmap_size_mb: int = self.config.getint('system', 'sqlite_mmap_size_mb', fallback=256)
+        self.open_connection_state()
+
+    def open_connection_state(self) -> None:
+        """
+        Per-thread persistent connections, one per database for every thread that touches the staging store.
+        :return:
+        """
+        self.thread_connections = threading.local()
+        self.all_connections: list = []
+        self.connections_lock = threading.Lock()
+        OPEN_INTERFACES.add(self)
+
+    def __getstate__(self) -> dict:
+        """
+        Connections stay with the process that opened them.
+        :return: picklable instance state
+        """
+        state = super().__getstate__().copy()
+        for name in ('thread_connections', 'all_connections', 'connections_lock'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.open_connection_state()
+
+    def connect(self, db_name: str) -> sqlite3.Connection:
+        """
+        Return this thread's connection to db_name, opening and tuning it on first use.
+        WAL lets readers run alongside the single writer and synchronous=NORMAL is safe in WAL mode.
+        :param db_name: database name.
+        :return: sqlite3.Connection in autocommit mode, writes use explicit transactions.
+        """
+        connections = getattr(self.thread_connections, 'by_name', None)
+        if connections is None:
+            connections = self.thread_connections.by_name = {}
+
+        con = connections.get(db_name)
+        if con is None:
+            con = sqlite3.connect(db_name, timeout=600, isolation_level=None, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA temp_store=MEMORY")
+            con.execute(f"PRAGMA cache_size=-{self.sqlite_cache_size_mb * 1024}")
+            con.execute(f"PRAGMA mmap_size={self.sqlite_mmap_size_mb * 1024 * 1024}")
+            connections[db_name] = con
+
+            with self.connections_lock:
+                self.all_connections.append(con)
+            self.logger.debug(f"Connection opened: {db_name} on {threading.current_thread().name}")
+
+        return con
+
+    def close_all_connections(self) -> None:
+        """
+        Close every connection opened by any thread, run by close_open_interfaces at process exit if not called before.
+        :return:
+        """
+        with self.connections_lock:
+            for con in self.all_connections:
+                try:
+                    con.close()
+                except sqlite3.Error:
+                    pass
+            self.all_connections.clear()
+        self.thread_connections = threading.local()
+
+    def write_frame(self, con: sqlite3.Connection, df: pd.DataFrame or pd.Series, table_name: str, if_exists: str) -> None:
+        """
+        Write a frame with executemany inside one explicit transaction.
+        :param con: connection from connect.
+        :param df: pd.DataFrame to save, the index is stored as a column like DataFrame.to_sql.
+        :param table_name: name to save table in SQL database.
+        :param if_exists: 'replace' or 'append'.
+        :return:
+        """
+        frame = df.to_frame() if isinstance(df, pd.Series) else df
+        frame = frame.reset_index()
+        columns = [str(name) for name in frame.columns]
+
+        # Match DataFrame.to_sql storage: datetimes as text and NaN as NULL
+        values = []
+        for name in frame.columns:
+            column = frame[name]
+            if pd.api.types.is_datetime64_any_dtype(column):
+                column = column.dt.strftime('%Y-%m-%d %H:%M:%S')
+            values.append(column.astype(object).where(column.notna(), None).tolist())
+
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            table_exists = con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
+            if if_exists == 'replace' or not table_exists:
+                # Same column types DataFrame.to_sql would create, without its own commit
+                con.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                con.execute(pd.io.sql.get_schema(frame, table_name, con=con))
+
+            column_list = ', '.join(f'"{name}"' for name in columns)
+            placeholders = ', '.join('?' for _ in columns)
+            con.executemany(f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})', zip(*values))
+            con.execute("COMMIT")
+
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+
     def excel_to_table(self, target_directory: str, db_name: str, table_name: str, idx: bool = False, index_name: str = "") -> pd.DataFrame:
         """
         :param index_name:
@@ -22,7 +145,6 @@ class SqliteInterface(ErrorHandling):
         :param table_name: name to save table in SQL database.
         :return: SQL database saved to directory.
         """
-        con = None
         try:
 
             if idx:
@@ -35,12 +157,8 @@ class SqliteInterface(ErrorHandling):
                 excel_df = pd.read_excel(target_directory, header=1)
 
             if excel_df.shape != (0, 0):
-                con = sqlite3.connect(db_name, timeout=600)
                 self.logger.debug(f"Adding: {table_name} to {db_name}")
-                excel_df.to_sql(name=table_name, con=con, if_exists='replace')
-                con.commit()
-                con.close()
-                self.logger.debug(f"Connection closed: {db_name}")
+                self.write_frame(self.connect(db_name), excel_df, table_name, 'replace')
 
             else:
                 self.ErrorsDetected = True
@@ -49,7 +167,6 @@ class SqliteInterface(ErrorHandling):
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: excel_to_table -> Failed to CREATE {table_name} in {db_name}: {error_}"))
-            con.close()
             raise error_
 
         return excel_df
@@ -63,7 +180,6 @@ class SqliteInterface(ErrorHandling):
         :param table_name: name to save table in SQL database.
         :return: SQL database saved to directory.
         """
-        con = None
         result = False
         try:
 
@@ -77,12 +193,8 @@ class SqliteInterface(ErrorHandling):
                 csv_df = pd.read_csv(target_directory, header=1)
 
             if csv_df.shape != (0, 0):
-                con = sqlite3.connect(db_name, timeout=600)
                 self.logger.debug(f"Adding: {table_name} to {db_name}")
-                csv_df.to_sql(name=table_name, con=con, if_exists='replace')
-                con.commit()
-                con.close()
-                self.logger.debug(f"Connection closed: {db_name}")
+                self.write_frame(self.connect(db_name), csv_df, table_name, 'replace')
                 result = csv_df
 
             else:
@@ -92,11 +204,44 @@ class SqliteInterface(ErrorHandling):
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: csv_to_table -> Failed to CREATE {table_name} in {db_name}: {error_}"))
-            con.close()
             raise error_
 
         return result
 
+    def csv_to_table_chunked(self, target_directory: str, db_name: str, table_name: str, index_name: str,
+                             chunk_size: int, dtypes: dict = None):
+        """
+        Stream a CSV into the staging database in fixed size chunks, peak memory is bounded by chunk_size.
+        Each chunk is appended to the table in its own transaction and then yielded to the caller.
+        :param target_directory: folder path for file.
+        :param db_name: database name.
+        :param table_name: name to save table in SQL database.
+        :param index_name: datetime column used as the index.
+        :param chunk_size: rows per chunk.
+        :param dtypes: explicit column dtypes, defaults to float64 OHLCV.
+        :return: generator of pd.DataFrame chunks with a parsed datetime index.
+        """
+        try:
+            # Header is on the second line, strip the names once so every chunk shares them
+            columns = pd.read_csv(target_directory, header=1, nrows=0).columns.str.strip().to_list()
+            dtypes = dtypes or {name: 'float64' for name in ('Open', 'High', 'Low', 'Close', 'Volume') if name in columns}
+
+            con = self.connect(db_name)
+            self.logger.debug(f"Streaming: {target_directory} to {table_name} in {db_name} in chunks of {chunk_size}")
+
+            reader = pd.read_csv(target_directory, header=None, skiprows=2, names=columns, dtype=dtypes,
+                                 parse_dates=[index_name], chunksize=chunk_size)
+
+            for chunk_number, chunk in enumerate(reader):
+                chunk.set_index(index_name, inplace=True)
+                self.write_frame(con, chunk, table_name, 'replace' if chunk_number == 0 else 'append')
+                yield chunk
+
+        except sqlite3.Error as error_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: csv_to_table_chunked -> Failed to APPEND {table_name} in {db_name}: {error_}"))
+            raise error_
+
     def df_to_table(self, db_name: str, df: pd.DataFrame or pd.Series, table_name: str):
         """
         :param db_name: database name.
@@ -104,19 +249,13 @@ class SqliteInterface(ErrorHandling):
         :param table_name: name to save table in SQL database.
         :return: SQL database saved to directory.
         """
-        con = None
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Adding: {table_name} to {db_name}")
-            df.to_sql(name=table_name, con=con, if_exists='replace')
-            con.commit()
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
+            self.write_frame(self.connect(db_name), df, table_name, 'replace')
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: df_to_table -> Failed to CREATE {table_name} in {db_name}: {error_}"))
-            con.close()
             raise error_
 
     def table_to_df(self, db_name: str, table_name: str) -> pd.DataFrame:
@@ -126,20 +265,15 @@ class SqliteInterface(ErrorHandling):
         :param table_name: table name inside database.
         :return: table from database as a pd.DataFrame.
         """
-        con = None
         df = None
 
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Importing: {table_name} from {db_name} as pd.DataFrame")
-            df = pd.read_sql(f"SELECT * FROM {table_name}", con=con)
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
+            df = pd.read_sql(f"SELECT * FROM {table_name}", con=self.connect(db_name))
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: table_to_df -> Failed to IMPORT {table_name} in {db_name} as pd.DataFrame: {error_}"))
-            con.close()
             raise error_
 
         return df
@@ -151,23 +285,117 @@ class SqliteInterface(ErrorHandling):
         :param table_name: table name inside database.
         :return: table from database as a np.array.
         """
-        con = None
         df = None
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Importing: {table_name} from {db_name} as np.array")
-            df = pd.read_sql(f"SELECT * FROM {table_name}", con=con)
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
+            df = pd.read_sql(f"SELECT * FROM {table_name}", con=self.connect(db_name))
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: table_to_np -> Failed to IMPORT {table_name} in {db_name} as np.array: {error_}"))
-            con.close()
             raise error_
 
         return np.array(df)
 
+    def table_columns(self, con: sqlite3.Connection, table_name: str) -> dict:
+        """
+        :param con: connection from connect.
+        :param table_name: table name inside database.
+        :return: dict of column name to (declared SQLite type, nullable), in table order.
+        """
+        # pragma_table_info rows: cid, name, type, notnull, dflt_value, pk. An INTEGER PRIMARY KEY is the rowid, never NULL
+        columns = {row[1]: (row[2].upper(), not row[3] and not (row[5] and row[2].upper() == 'INTEGER'))
+                   for row in con.execute("SELECT * FROM pragma_table_info(?)", (table_name,))}
+        if not columns:
+            raise sqlite3.OperationalError(f"no such table: {table_name}")
+
+        return columns
+
+    def rows_to_records(self, rows: list, names: list, types: dict) -> np.ndarray:
+        """
+        Build a typed NumPy record array straight from cursor rows.
+        The dtype of a field only depends on the column declaration, so every batch of a stream has the same dtype:
+        TIMESTAMP columns become datetime64[s] with NaT, INTEGER NOT NULL columns int64, nullable INTEGER and REAL
+        columns float64 with NaN for NULL.
+        :param rows: non-empty list of row tuples from the cursor.
+        :param names: selected column names in row order.
+        :param types: (declared SQLite type, nullable) per column, from table_columns.
+        :return: np.recarray with one field per selected column.
+        """
+        arrays = []
+        for name, values in zip(names, zip(*rows)):
+            declared, nullable = types[name]
+            if 'TIMESTAMP' in declared or 'DATE' in declared:
+                arrays.append(np.array(values, dtype='datetime64[s]'))
+            elif 'INT' in declared and not nullable:
+                arrays.append(np.array(values, dtype=np.int64))
+            elif 'REAL' in declared or 'FLOA' in declared or 'DOUB' in declared or 'INT' in declared:
+                arrays.append(np.array(values, dtype=np.float64))
+            else:
+                arrays.append(np.array(values, dtype=object))
+
+        return np.rec.fromarrays(arrays, names=names)
+
+    def stream_table(self, db_name: str, table_name: str, columns: list = None, time_column: str = None,
+                     start=None, end=None, where: str = None, params: tuple = (), batch_size: int = 100000):
+        """
+        Scan a staging table in typed record batches without building a pd.DataFrame.
+        Only the projected columns are read and every value is passed as a bound parameter.
+        :param db_name: database name.
+        :param table_name: table name inside database.
+        :param columns: columns to read, defaults to all.
+        :param time_column: datetime column the start / end range applies to.
+        :param start: inclusive lower bound on time_column.
+        :param end: inclusive upper bound on time_column.
+        :param where: extra SQL predicate using ? placeholders.
+        :param params: values bound to the placeholders in where.
+        :param batch_size: rows per batch.
+        :return: generator of np.recarray batches in time_column order when given.
+        """
+        try:
+            con = self.connect(db_name)
+            types = self.table_columns(con, table_name)
+            names = list(columns) if columns else list(types)
+
+            # Identifiers cannot be bound, so they are checked against the table definition instead
+            unknown = [name for name in names + ([time_column] if time_column else []) if name not in types]
+            if unknown:
+                raise sqlite3.OperationalError(f"no such column in {table_name}: {unknown}")
+
+            predicates, values = [], []
+            if time_column and start is not None:
+                predicates.append(f'"{time_column}" >= ?')
+                values.append(pd.Timestamp(start).strftime('%Y-%m-%d %H:%M:%S'))
+            if time_column and end is not None:
+                predicates.append(f'"{time_column}" <= ?')
+                values.append(pd.Timestamp(end).strftime('%Y-%m-%d %H:%M:%S'))
+            if where:
+                predicates.append(f"({where})")
+                values.extend(params)
+
+            column_list = ', '.join(f'"{name}"' for name in names)
+            query = f'SELECT {column_list} FROM "{table_name}"'
+            if predicates:
+                query += f" WHERE {' AND '.join(predicates)}"
+            if time_column:
+                query += f' ORDER BY "{time_column}"'
+
+            self.logger.debug(f"Streaming {table_name} from {db_name} in batches of {batch_size}")
+            cursor = con.execute(query, values)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield self.rows_to_records(rows, names, types)
+            finally:
+                cursor.close()
+
+        except sqlite3.Error as error_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: stream_table -> Failed to STREAM {table_name} in {db_name}: {error_}"))
+            raise error_
+
     def update_db(self, db_name: str, df: pd.DataFrame or pd.Series, table_name: str):
         """
         :param db_name: database name.
@@ -175,76 +403,60 @@ class SqliteInterface(ErrorHandling):
         :param table_name: name to save table in SQL database.
         :return: SQL database updated with new files.
         """
-        con = None
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Connection established:  {db_name} | {table_name}")
-            df.to_sql(name=table_name, con=con, if_exists='append')
-            con.commit()
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
+            self.write_frame(self.connect(db_name), df, table_name, 'append')
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: update_db -> Failed to UPDATE {table_name} in {db_name}: {error_}"))
-            self.logger.error(f"")
-            con.close()
             raise error_
 
-    def query_db_df(self, db_name: str, query: str) -> pd.DataFrame:
+    def query_db_df(self, db_name: str, query: str, params: tuple = ()) -> pd.DataFrame:
         """
         :param db_name: database name.
-        :param query: an sql query in string format
+        :param query: an sql query in string format, values as ? placeholders
+        :param params: values bound to the placeholders in query
         :return: an SQL query into a pd.DataFrame.
         """
-        con = None
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Querying data from {db_name} as pd.DataFrame")
-            df = pd.read_sql_query(query, con)
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
-            return df
+            return pd.read_sql_query(query, self.connect(db_name), params=params)
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: query_db_df -> Failed to QUERY the above query as pd.DataFrame: {error_}"))
-            con.close()
             raise error_
 
-    def query_db_np(self, db_name: str, query: str) -> np.ndarray:
+    def query_db_np(self, db_name: str, query: str, params: tuple = ()) -> np.ndarray:
         """
         :param db_name: database name.
-        :param query: an sql query in string format
+        :param query: an sql query in string format, values as ? placeholders
+        :param params: values bound to the placeholders in query
         :return: an SQL query into a np.ndarray.
         """
-        con = None
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Querying data from {db_name} as np.array")
-            df = pd.read_sql_query(query, con)
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
-            return np.array(df)
+            return np.array(pd.read_sql_query(query, self.connect(db_name), params=params))
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: query_db_np -> Failed to QUERY the above query as np.ndarray: {error_}"))
-            con.close()
             raise error_
 
     def execute_query(self, db_name: str, query: str) -> None:
-        con = None
         try:
-            con = sqlite3.connect(db_name, timeout=600)
             self.logger.debug(f"Executing Querying {query}...")
-            con.execute(query)
-            con.commit()
-            con.close()
-            self.logger.debug(f"Connection closed: {db_name}")
+            con = self.connect(db_name)
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                con.execute(query)
+                con.execute("COMMIT")
+            except sqlite3.Error:
+                con.execute("ROLLBACK")
+                raise
 
         except sqlite3.Error as error_:
             self.ErrorsDetected = True
             self.ErrorList.append(self.error_details(f"{__class__}: execute_query -> Failed to EXECUTE QUERY: {error_}\n{query}"))
-            con.close()
             raise error_
@@ -0,0 +1,247 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from CORE.Oanda_Candle_Fetcher import OANDA_GRANULARITY_SECONDS
+
+SECONDS_PER_DAY: int = 86400
+
+# FX trading sessions in UTC hours, [open, close), a session past midnight wraps around
+FX_SESSIONS_UTC: dict = {
+    'IsSydneySession': (22, 7),
+    'IsTokoyoSession': (0, 9),
+    'IsLondonSession': (8, 17),
+    'IsNewYorkSession': (13, 22),
+}
+
+# Hour the TimeOfDay bucket starts at
+TIME_OF_DAY: tuple = ((0, 'Night'), (6, 'Morning'), (12, 'Afternoon'), (18, 'Evening'))
+
+
+def granularity_timedelta(granularity: str) -> pd.Timedelta:
+    """
+    :param granularity: OANDA granularity name
+    :return: length of one bar
+    """
+    return pd.Timedelta(seconds=OANDA_GRANULARITY_SECONDS[granularity])
+
+
+def datetime_key_to_timestamp(datetime_key: int) -> pd.Timestamp:
+    """
+    :param datetime_key: DateTimeKey as YYYYMMDDHHMMSS
+    :return: naive UTC pd.Timestamp
+    """
+    return pd.to_datetime(str(int(datetime_key)), format='%Y%m%d%H%M%S')
+
+
+def timestamp_to_datetime_key(timestamp: pd.Timestamp) -> int:
+    """
+    :param timestamp: naive UTC pd.Timestamp
+    :return: DateTimeKey as YYYYMMDDHHMMSS
+    """
+    return int(timestamp.strftime('%Y%m%d%H%M%S'))
+
+
+def index_to_datetime64(index) -> np.ndarray:
+    """
+    Normalise a candle index (strings, naive or tz-aware datetimes) to naive UTC datetime64[ns].
+    :param index: pd.Index or array of date times
+    :return: np.ndarray[datetime64[ns]]
+    """
+    return pd.to_datetime(index, utc=True).tz_localize(None).values
+
+
+def civil_from_days(days: np.ndarray) -> tuple:
+    """
+    Proleptic Gregorian calendar date of day numbers, integer arithmetic only.
+    :param days: days since 1970-01-01
+    :return: (year, month, day) np.ndarray[int64] tuple
+    """
+    z = np.asarray(days, dtype=np.int64) + 719468
+    era = z // 146097
+    day_of_era = z - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = np.where(month_index < 10, month_index + 3, month_index - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def days_from_civil(year: np.ndarray, month: np.ndarray, day: np.ndarray) -> np.ndarray:
+    """
+    Reverse of civil_from_days.
+    :return: days since 1970-01-01 as np.ndarray[int64]
+    """
+    year = np.asarray(year, dtype=np.int64) - (np.asarray(month) <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((np.asarray(month, dtype=np.int64) + 9) % 12) + 2) // 5 + np.asarray(day, dtype=np.int64) - 1
+    return era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+
+
+def datetime64_to_keys(values) -> tuple:
+    """
+    DateTimeKey, DateKey and TimeKey of every timestamp in one vectorized integer pass.
+    :param values: naive UTC datetime64 values, or anything index_to_datetime64 accepts
+    :return: (DateTimeKey YYYYMMDDHHMMSS, DateKey YYYYMMDD, TimeKey HHMMSS) np.ndarray[int64] tuple
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != 'M':
+        values = index_to_datetime64(values)
+
+    seconds = values.astype('datetime64[s]').astype(np.int64)
+    days, second_of_day = np.divmod(seconds, SECONDS_PER_DAY)
+    year, month, day = civil_from_days(days)
+
+    date_keys = year * 10000 + month * 100 + day
+    time_keys = second_of_day // 3600 * 10000 + second_of_day % 3600 // 60 * 100 + second_of_day % 60
+    return date_keys * 1_000_000 + time_keys, date_keys, time_keys
+
+
+def datetime_keys_to_datetime64(datetime_keys: np.ndarray) -> np.ndarray:
+    """
+    Reverse of datetime64_to_keys.
+    :param datetime_keys: DateTimeKey YYYYMMDDHHMMSS per row
+    :return: np.ndarray[datetime64[s]]
+    """
+    datetime_keys = np.asarray(datetime_keys, dtype=np.int64)
+    date_keys, time_keys = np.divmod(datetime_keys, 1_000_000)
+    days = days_from_civil(date_keys // 10000, date_keys // 100 % 100, date_keys % 100)
+    seconds = days * SECONDS_PER_DAY + time_keys // 10000 * 3600 + time_keys // 100 % 100 * 60 + time_keys % 100
+    return seconds.astype('datetime64[s]')
+
+
+def date_attributes(days: np.ndarray) -> dict:
+    """
+    Dimension_Date attributes of day numbers as dense arrays.
+    :param days: days since 1970-01-01
+    :return: dict of Dimension_Date column name -> np.ndarray
+    """
+    days = np.asarray(days, dtype=np.int64)
+    year, month, day = civil_from_days(days)
+    month_length = days_from_civil(year + (month == 12), month % 12 + 1, 1) - days_from_civil(year, month, 1)
+    weekday = (days + 3) % 7
+
+    # ISO week, the week belongs to the year holding its Thursday
+    thursday = days - weekday + 3
+    thursday_year = civil_from_days(thursday)[0]
+    week = (thursday - days_from_civil(thursday_year, 1, 1)) // 7 + 1
+
+    is_month_start = day == 1
+    is_month_end = day == month_length
+    return {
+        'DateKey': year * 10000 + month * 100 + day,
+        'IsYearStart': (is_month_start & (month == 1)).astype(np.int64),
+        'IsYearEnd': (is_month_end & (month == 12)).astype(np.int64),
+        'Year': year,
+        'IsLeapYear': ((year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))).astype(np.int64),
+        'IsQuarterStart': (is_month_start & (month % 3 == 1)).astype(np.int64),
+        'IsQuarterEnd': (is_month_end & (month % 3 == 0)).astype(np.int64),
+        'Quarter': (month - 1) // 3 + 1,
+        'Week': week,
+        'IsMonthStart': is_month_start.astype(np.int64),
+        'IsMonthEnd': is_month_end.astype(np.int64),
+        'Month': month,
+        'DayOfMonth': day,
+        'Day': weekday,
+        'DayOfYear': days - days_from_civil(year, 1, 1) + 1,
+        'IsWeekend': (weekday >= 5).astype(np.int64),
+    }
+
+
+@lru_cache(maxsize=1)
+def time_attributes() -> dict:
+    """
+    Dimension_Time attributes for every second of the day, indexed by second of day.
+    Computed once per process.
+    :return: dict of Dimension_Time column name -> np.ndarray of length 86400
+    """
+    second_of_day = np.arange(SECONDS_PER_DAY, dtype=np.int64)
+    hour = second_of_day // 3600
+    attributes = {
+        'TimeKey': hour * 10000 + second_of_day % 3600 // 60 * 100 + second_of_day % 60,
+        'Hour': hour,
+        'Minute': second_of_day % 3600 // 60,
+        'Second': second_of_day % 60,
+        'TimeOfDay': np.array([name for start, name in TIME_OF_DAY], dtype=object)[
+            np.searchsorted([start for start, name in TIME_OF_DAY], hour, side='right') - 1],
+    }
+
+    for session, (open_hour, close_hour) in FX_SESSIONS_UTC.items():
+        in_session = (hour >= open_hour) & (hour < close_hour) if open_hour < close_hour else \
+            (hour >= open_hour) | (hour < close_hour)
+        attributes[session] = in_session.astype(np.int64)
+
+    return attributes
+
+
+def session_flags(values) -> dict:
+    """
+    Trading session flags of timestamps, a lookup into time_attributes.
+    :param values: naive UTC datetime64 values
+    :return: dict of session name -> np.ndarray[int64]
+    """
+    seconds = np.asarray(values).astype('datetime64[s]').astype(np.int64) % SECONDS_PER_DAY
+    lookup = time_attributes()
+    return {session: lookup[session][seconds] for session in FX_SESSIONS_UTC}
+
+
+def tradable_mask(values) -> np.ndarray:
+    """
+    FX market hours of timestamps from the Dimension_Date weekend and Dimension_Time session flags.
+    The week opens with the Sydney session on Sunday and closes with the New York session on Friday.
+    :param values: naive UTC datetime64 values
+    :return: np.ndarray[bool], True where the market is open
+    """
+    seconds = np.asarray(values).astype('datetime64[s]').astype(np.int64)
+    days, second_of_day = np.divmod(seconds, SECONDS_PER_DAY)
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    weekday = date_attributes(unique_days)['Day'][day_index]
+    hour = time_attributes()['Hour'][second_of_day]
+
+    week_open = FX_SESSIONS_UTC['IsSydneySession'][0]
+    week_close = FX_SESSIONS_UTC['IsNewYorkSession'][1]
+    return ((weekday < 5) & ~((weekday == 4) & (hour >= week_close))) | ((weekday == 6) & (hour >= week_open))
+
+
+def zero_padded(values: np.ndarray, width: int) -> np.ndarray:
+    return np.char.zfill(np.asarray(values).astype(str), width)
+
+
+def date_dimension(start, end) -> pd.DataFrame:
+    """
+    Dimension_Date rows for every day in [start, end].
+    :param start: first date
+    :param end: last date
+    :return: pd.DataFrame with the Dimension_Date columns
+    """
+    days = np.arange(pd.Timestamp(start).normalize().value // 10 ** 9 // SECONDS_PER_DAY,
+                     pd.Timestamp(end).normalize().value // 10 ** 9 // SECONDS_PER_DAY + 1)
+    attributes = date_attributes(days)
+
+    date_string = np.char.add(np.char.add(np.char.add(zero_padded(attributes['Year'], 4), '-'),
+                                          np.char.add(zero_padded(attributes['Month'], 2), '-')),
+                              zero_padded(attributes['DayOfMonth'], 2))
+
+    frame = pd.DataFrame(attributes)
+    frame.insert(1, 'DateString', date_string.astype(object))
+    return frame
+
+
+def time_dimension() -> pd.DataFrame:
+    """
+    Dimension_Time rows for every second of the day.
+    :return: pd.DataFrame with the Dimension_Time columns
+    """
+    attributes = time_attributes()
+    time_string = np.char.add(np.char.add(np.char.add(zero_padded(attributes['Hour'], 2), ':'),
+                                          np.char.add(zero_padded(attributes['Minute'], 2), ':')),
+                              zero_padded(attributes['Second'], 2))
+
+    frame = pd.DataFrame(attributes)
+    frame.insert(1, 'TimeString', time_string.astype(object))
+    return frame
@@ -0,0 +1,183 @@
+import configparser
+import json
+import os
+import traceback
+from logging import Logger
+
+import numpy as np
+
+from CORE.Error_Handling import ErrorHandling
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DAL.Trading.Dimension_Cache import DimensionCache
+from DAL.Trading.Fact_Batches import PRICE_COLUMNS
+from DOL.Trading.Facts.Facts_InstrumentsDataAligned import Facts_InstrumentsDataAligned
+
+# Last axis of the exported array
+DATASET_FIELDS: tuple = PRICE_COLUMNS + ('Volume',)
+
+
+def load_dataset(path: str) -> dict:
+    """
+    Open an exported dataset without reading it, slices of the arrays are paged in on access.
+    :param path: path of the .npy array written by DatasetExport
+    :return: dict of 'values' (time, instrument, field) read only memmap, 'datetime_keys' memmap and the sidecar entries
+    """
+    with open(f"{os.path.splitext(path)[0]}.json") as sidecar_file:
+        sidecar = json.load(sidecar_file)
+
+    sidecar['values'] = np.load(path, mmap_mode='r')
+    sidecar['datetime_keys'] = np.load(os.path.join(os.path.dirname(path), sidecar['datetime_keys_file']), mmap_mode='r')
+    return sidecar
+
+
+class DatasetExport(ErrorHandling):
+    def __init__(self,
+                 config_object: configparser.ConfigParser,
+                 postgres_interface: PostgreSQLInterface,
+                 logger: Logger,
+                 granularity: str,
+                 price_type: str = 'M'):
+        """
+        Export Facts_InstrumentsDataAligned as a dense (time x instrument x field) float32 .npy array for training jobs.
+        A JSON sidecar maps instruments and fields to their index, the DateTimeKey of each time step is a second
+        int64 .npy array. Both are opened with load_dataset as memory maps, without Postgres.
+        :param config_object: ConfigManager object
+        :param postgres_interface: PostgreSQLInterface object
+        :param logger: Logger object
+        :param granularity: OANDA granularity name of the series
+        :param price_type: Price Type Bid, Ask, Mid of the series
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.config = config_object
+        self.postgres_interface = postgres_interface
+        self.granularity: str = granularity
+        self.price_type: str = price_type
+
+        self.dimensions = DimensionCache.shared(self.postgres_interface, self.logger)
+        self.export_path: str = self.config.get('system', 'dataset_export_path', fallback='Datasets')
+
+    def dataset_path(self) -> str:
+        """
+        :return: path of the .npy array of this granularity and price type
+        """
+        return os.path.join(self.export_path, f"Aligned_{self.granularity}_{self.price_type}.npy")
+
+    def temporary_paths(self) -> list:
+        """
+        :return: files export writes before moving them in place
+        """
+        base = os.path.splitext(self.dataset_path())[0]
+        return [f"{self.dataset_path()}.tmp", f"{base}.datetime.npy.tmp.npy", f"{base}.json.tmp"]
+
+    def stream_aligned(self, granularity_key: int, price_type_key: int, columns: list):
+        """
+        :return: generator of column batches of the aligned series at this granularity and price type
+        """
+        return self.postgres_interface.stream_model(Facts_InstrumentsDataAligned,
+                                                    columns=columns,
+                                                    granularity_keys=[granularity_key],
+                                                    where=(Facts_InstrumentsDataAligned.PriceTypeKey == price_type_key,))
+
+    def export(self):
+        """
+        Two passes over the aligned table: the first collects the time and instrument axes from the key columns,
+        the second writes each streamed batch straight into the memory mapped array, so memory stays at one batch.
+        Files are written under temporary names and moved in place once complete, a failed read removes them
+        so a partial dataset is never published.
+        :return: path of the .npy array, False on error
+        """
+        result = False
+        try:
+            if not self.ErrorsDetected:
+                granularity_key = self.dimensions.get_key('granularity', self.granularity)
+                price_type_key = self.dimensions.get_key('price_type', self.price_type)
+                if granularity_key is None or price_type_key is None:
+                    self.ErrorsDetected = True
+                    self.ErrorList.append(self.error_details(
+                        f"{__class__}: export -> {self.granularity} {self.price_type} missing from the Trading dimensions"))
+                    return result
+
+                datetime_batches, instrument_batches = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+                for batch in self.stream_aligned(granularity_key, price_type_key, ['InstrumentKey', 'DateTimeKey']):
+                    datetime_batches.append(np.unique(batch['DateTimeKey']))
+                    instrument_batches.append(np.unique(batch['InstrumentKey']))
+                datetime_keys, instrument_keys = np.unique(np.concatenate(datetime_batches)), np.unique(np.concatenate(instrument_batches))
+
+                if datetime_keys.size == 0:
+                    self.ErrorsDetected = True
+                    self.ErrorList.append(self.error_details(
+                        f"{__class__}: export -> No Data in Facts_InstrumentsDataAligned for {self.granularity} {self.price_type}"))
+                    return result
+
+                path = self.dataset_path()
+                datetime_path = f"{os.path.splitext(path)[0]}.datetime.npy"
+                os.makedirs(self.export_path, exist_ok=True)
+
+                shape = (datetime_keys.size, instrument_keys.size, len(DATASET_FIELDS))
+                values = np.lib.format.open_memmap(f"{path}.tmp", mode='w+', dtype=np.float32, shape=shape)
+                values[:] = np.nan
+
+                rows, skipped = 0, 0
+                for batch in self.stream_aligned(granularity_key, price_type_key, ['InstrumentKey', 'DateTimeKey'] + list(DATASET_FIELDS)):
+                    time_index = np.minimum(np.searchsorted(datetime_keys, batch['DateTimeKey']), datetime_keys.size - 1)
+                    instrument_index = np.minimum(np.searchsorted(instrument_keys, batch['InstrumentKey']), instrument_keys.size - 1)
+                    # Rows aligned after the first pass have no place on the axes, they are left for the next export
+                    known = (datetime_keys[time_index] == batch['DateTimeKey']) & (instrument_keys[instrument_index] == batch['InstrumentKey'])
+                    values[time_index[known], instrument_index[known]] = \
+                        np.column_stack([batch[name][known] for name in DATASET_FIELDS])
+                    rows += int(known.sum())
+                    skipped += int(known.size - known.sum())
+
+                if skipped:
+                    self.logger.warning(f"export -> {skipped} rows aligned during the export were left out of {path}")
+
+                values.flush()
+                del values
+                np.save(f"{datetime_path}.tmp.npy", datetime_keys)
+
+                sidecar = {
+                    'granularity': self.granularity,
+                    'price_type': self.price_type,
+                    'shape': list(shape),
+                    'dtype': 'float32',
+                    'axes': ['time', 'instrument', 'field'],
+                    'fields': {name: index for index, name in enumerate(DATASET_FIELDS)},
+                    'instruments': {self.dimensions.get_name('instrument', int(key)): index for index, key in enumerate(instrument_keys)},
+                    'instrument_keys': {int(key): index for index, key in enumerate(instrument_keys)},
+                    'datetime_keys_file': os.path.basename(datetime_path),
+                    'datetime_from': int(datetime_keys[0]),
+                    'datetime_to': int(datetime_keys[-1]),
+                }
+                with open(f"{os.path.splitext(path)[0]}.json.tmp", 'w') as sidecar_file:
+                    json.dump(sidecar, sidecar_file, indent=2)
+
+                os.replace(f"{path}.tmp", path)
+                os.replace(f"{datetime_path}.tmp.npy", datetime_path)
+                os.replace(f"{os.path.splitext(path)[0]}.json.tmp", f"{os.path.splitext(path)[0]}.json")
+
+                self.logger.info(f"export -> {path}: {rows} aligned rows as {shape} float32, "
+                                 f"{np.prod(shape) * 4 / 2 ** 20:.1f} MB")
+                result = path
+
+            else:
+                self.print_all_errors()
+
+        except Exception as err_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: export -> {err_}\n{traceback.format_exc()}"))
+            for temporary_path in self.temporary_paths():
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+
+        return result
+
+
+if __name__ == '__main__':
+    from CORE.Config_Manager import ConfigManager
+    from Logger import log_maker
+
+    logs = log_maker('DatasetExport', '../../configs.ini')
+    cm = ConfigManager(logs, '../../configs.ini')
+    sql = PostgreSQLInterface(cm.create_config(), logs)
+    DatasetExport(cm.create_config(), sql, logs, 'D').export()
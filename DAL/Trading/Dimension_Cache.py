@@ -0,0 +1,197 @@
+import threading
+from logging import Logger
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+
+from CORE.Error_Handling import ErrorHandling
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DOL.Trading.Dimensions.Dimension_Features import Dimension_Features
+from DOL.Trading.Dimensions.Dimension_Granularity import Dimension_Granularity
+from DOL.Trading.Dimensions.Dimension_IndicatorCategory import Dimension_IndicatorCategory
+from DOL.Trading.Dimensions.Dimension_IndicatorType import Dimension_IndicatorType
+from DOL.Trading.Dimensions.Dimension_Indicators import Dimension_Indicators
+from DOL.Trading.Dimensions.Dimension_Instruments import Dimension_Instruments
+from DOL.Trading.Dimensions.Dimension_LineType import Dimension_LineType
+from DOL.Trading.Dimensions.Dimension_PriceType import Dimension_PriceType
+
+# Dimension name -> (model, natural key column, surrogate key column)
+DIMENSION_LOOKUPS: dict = {
+    'granularity': (Dimension_Granularity, 'OandaAlias', 'GranularityKey'),
+    'instrument': (Dimension_Instruments, 'Name', 'InstrumentKey'),
+    'price_type': (Dimension_PriceType, 'Alias', 'PriceTypeKey'),
+    'indicator': (Dimension_Indicators, 'Name', 'IndicatorKey'),
+    'indicator_category': (Dimension_IndicatorCategory, 'Name', 'IndicatorCategoryKey'),
+    'indicator_type': (Dimension_IndicatorType, 'Name', 'IndicatorTypeKey'),
+    'line_type': (Dimension_LineType, 'Name', 'LineTypeKey'),
+    'feature': (Dimension_Features, 'Name', 'FeatureKey'),
+}
+
+
+class DimensionCache(ErrorHandling):
+    def __init__(self, postgres_interface: PostgreSQLInterface, logger: Logger):
+        """
+        Process wide lookup maps for the Trading dimension tables.
+        Each dimension is read once on first use into a natural key -> surrogate key dict and a key indexed
+        array of natural keys, a miss re-reads that dimension once so rows added by another job are found.
+        A value still missing after the re-read is remembered until the dimension is read again, so repeated
+        lookups of an unknown value do not each hit the database.
+        :param postgres_interface: PostgreSQLInterface object
+        :param logger: Logger object
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.postgres_interface = postgres_interface
+
+        self.frames: dict = {}
+        self.keys: dict = {}
+        self.names: dict = {}
+        self.misses: dict = {}
+        self.lock = threading.RLock()
+
+    # One cache per process, shared by every Instruments instance
+    shared_cache = None
+    shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, postgres_interface: PostgreSQLInterface, logger: Logger):
+        """
+        :return: the process wide DimensionCache, created on first use without touching the database
+        """
+        with cls.shared_lock:
+            if cls.shared_cache is None:
+                cls.shared_cache = cls(postgres_interface, logger)
+
+        return cls.shared_cache
+
+    def __getstate__(self) -> dict:
+        """
+        Ship the loaded maps to worker processes, the database interface and lock stay behind.
+        :return: picklable instance state
+        """
+        state = self.__dict__.copy()
+        state['postgres_interface'] = None
+        state.pop('lock', None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def load(self, dimension: str) -> None:
+        """
+        (Re)read one dimension table and rebuild its lookup maps.
+        :param dimension: name in DIMENSION_LOOKUPS
+        :return:
+        """
+        model, natural_key, surrogate_key = DIMENSION_LOOKUPS[dimension]
+        if self.postgres_interface is None:
+            # Copies sent to worker processes only hold what was loaded before they were pickled
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: load -> cannot read {dimension}, no database interface in this process"))
+            return
+
+        frame = self.postgres_interface.read_model(model)
+        keys = frame[surrogate_key].to_numpy(dtype=np.int64) if frame.shape[0] > 0 else np.array([], dtype=np.int64)
+
+        names = np.full(int(keys.max()) + 1 if keys.size else 0, None, dtype=object)
+        names[keys] = frame[natural_key].to_numpy(dtype=object)
+
+        with self.lock:
+            self.frames[dimension] = frame
+            self.keys[dimension] = dict(zip(frame[natural_key].to_list(), keys.tolist()))
+            self.names[dimension] = names
+            self.misses[dimension] = set()
+
+        self.logger.debug(f"DimensionCache -> loaded {dimension}: {frame.shape[0]} rows")
+
+    def load_all(self) -> None:
+        """
+        Warm every dimension, used before instances are sent to worker processes.
+        :return:
+        """
+        for dimension in DIMENSION_LOOKUPS:
+            if dimension not in self.keys:
+                self.load(dimension)
+
+    def get_key(self, dimension: str, natural_key: str):
+        """
+        O(1) surrogate key lookup, the dimension is re-read once per unknown value and load.
+        :param dimension: name in DIMENSION_LOOKUPS
+        :param natural_key: e.g. OandaAlias 'M1', instrument Name 'EUR_USD' or price type Alias 'M'
+        :return: int key, None if the value is not in the dimension
+        """
+        with self.lock:
+            if dimension not in self.keys:
+                self.load(dimension)
+
+            key = self.keys.get(dimension, {}).get(natural_key)
+            if key is None and natural_key not in self.misses.get(dimension, ()):
+                self.logger.debug(f"DimensionCache -> {dimension} miss for {natural_key}, refreshing")
+                self.load(dimension)
+                key = self.keys.get(dimension, {}).get(natural_key)
+                if key is None:
+                    self.misses.setdefault(dimension, set()).add(natural_key)
+
+        return key
+
+    def get_name(self, dimension: str, key: int):
+        """
+        :param dimension: name in DIMENSION_LOOKUPS
+        :param key: surrogate key
+        :return: natural key, None if the key is not in the dimension
+        """
+        with self.lock:
+            if dimension not in self.names:
+                self.load(dimension)
+            names = self.names.get(dimension, np.array([], dtype=object))
+
+        return names[key] if 0 <= key < len(names) else None
+
+    def get_frame(self, dimension: str) -> pd.DataFrame:
+        """
+        :param dimension: name in DIMENSION_LOOKUPS
+        :return: the cached dimension table
+        """
+        with self.lock:
+            if dimension not in self.frames:
+                self.load(dimension)
+
+            return self.frames.get(dimension, pd.DataFrame())
+
+    def ensure(self, dimension: str, rows: list) -> dict:
+        """
+        Insert the rows whose natural key is not in the dimension yet, e.g. indicator definitions read from config.
+        :param dimension: name in DIMENSION_LOOKUPS
+        :param rows: dicts holding at least the natural key column and every non nullable column
+        :return: natural key -> surrogate key of every row
+        """
+        model, natural_key, surrogate_key = DIMENSION_LOOKUPS[dimension]
+        rows = list({row[natural_key]: row for row in rows}.values())
+
+        with self.lock:
+            self.load(dimension)
+            missing = [row for row in rows if row[natural_key] not in self.keys.get(dimension, {})]
+            if missing and self.postgres_interface is not None:
+                self.logger.debug(f"DimensionCache -> adding {len(missing)} rows to {model.__tablename__}")
+                with self.postgres_interface.connect_session() as session:
+                    session.execute(insert(model.__table__), missing)
+                    session.commit()
+                self.load(dimension)
+
+            return {row[natural_key]: self.keys.get(dimension, {}).get(row[natural_key]) for row in rows}
+
+    def invalidate(self, dimension: str = None) -> None:
+        """
+        Drop cached maps so the next lookup re-reads the table, e.g. after inserting dimension rows.
+        :param dimension: name in DIMENSION_LOOKUPS, all dimensions when None
+        :return:
+        """
+        with self.lock:
+            for name in ([dimension] if dimension else list(self.keys)):
+                self.frames.pop(name, None)
+                self.keys.pop(name, None)
+                self.names.pop(name, None)
+                self.misses.pop(name, None)
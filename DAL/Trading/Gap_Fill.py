@@ -0,0 +1,231 @@
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from DAL.Trading.Calendar import OANDA_GRANULARITY_SECONDS, tradable_mask
+from DAL.Trading.Fact_Batches import PRICE_COLUMNS
+
+# Friday New York close to Sunday Sydney open, a gap may span this much closed time on top of max_gap_bars
+MARKET_CLOSED_SECONDS: int = 48 * 3600
+
+# Columns that are not interpolated, a generated bar has no traded volume
+VOLUME_COLUMNS: tuple = ('Volume',)
+
+
+@dataclass
+class GapReport:
+    """
+    Gap statistics of one instrument series, summed over every batch filled for it.
+    """
+    instrument: str
+    granularity: str
+    method: str
+    bars: int = 0               # observed bars
+    gaps: int = 0               # runs of missing tradable bars between two observed bars
+    filled_gaps: int = 0
+    filled_bars: int = 0
+    skipped_gaps: int = 0       # longer than max_gap_bars, left open
+    skipped_bars: int = 0
+    closed_bars: int = 0        # missing bars outside market hours, never generated
+    missing_values: int = 0     # NaN prices inside observed bars
+    dropped_bars: int = 0       # bars still incomplete after the fill, e.g. NaN before the first price
+    longest_gap: int = 0
+
+    def merge(self, other: 'GapReport') -> 'GapReport':
+        """
+        :param other: report of a later batch of the same series
+        :return: combined report
+        """
+        counts = {item.name: getattr(self, item.name) + getattr(other, item.name)
+                  for item in fields(self) if item.type is int and item.name != 'longest_gap'}
+        return GapReport(self.instrument, self.granularity, self.method,
+                         longest_gap=max(self.longest_gap, other.longest_gap), **counts)
+
+    def __str__(self) -> str:
+        return (f"{self.instrument} {self.granularity} {self.method}: {self.bars} bars, {self.gaps} gaps, "
+                f"filled {self.filled_bars} bars in {self.filled_gaps} gaps, "
+                f"skipped {self.skipped_bars} bars in {self.skipped_gaps} gaps, {self.closed_bars} closed bars, "
+                f"{self.missing_values} missing values, {self.dropped_bars} dropped bars, longest gap {self.longest_gap}")
+
+
+def linear_kernel(x: np.ndarray, y: np.ndarray, targets: np.ndarray, step: int, order: int, window: int) -> np.ndarray:
+    """
+    Straight line between the observed bars either side of each target.
+    :param x: observed seconds, ascending
+    :param y: observed values
+    :param targets: seconds to fill
+    :return: np.ndarray[float64], NaN outside the observed range
+    """
+    return np.interp(targets, x, y, left=np.nan, right=np.nan)
+
+
+def ffill_kernel(x: np.ndarray, y: np.ndarray, targets: np.ndarray, step: int, order: int, window: int) -> np.ndarray:
+    """
+    Last observed value before each target.
+    """
+    left = np.searchsorted(x, targets, side='right') - 1
+    result = np.full(targets.shape, np.nan)
+    result[left >= 0] = y[left[left >= 0]]
+    return result
+
+
+def poly_kernel(x: np.ndarray, y: np.ndarray, targets: np.ndarray, step: int, order: int, window: int) -> np.ndarray:
+    """
+    Least squares polynomial through the window bars either side of the gap, one batched fit per gap.
+    The fitted value is clipped to the range of the window so a fit cannot overshoot the local prices.
+    :param order: polynomial order, linear_kernel is used when there are too few observed bars
+    :param window: observed bars used on each side of the gap
+    """
+    if x.size <= order:
+        return linear_kernel(x, y, targets, step, order, window)
+
+    left = np.searchsorted(x, targets, side='right') - 1
+    inside = (left >= 0) & (left < x.size - 1)
+    result = np.full(targets.shape, np.nan)
+    if not inside.any():
+        return result
+
+    anchors, gap_index = np.unique(left[inside], return_inverse=True)
+    window_index = np.clip(anchors[:, None] + np.arange(-window + 1, window + 1), 0, x.size - 1)
+    origin = x[anchors]
+    powers = np.arange(order + 1)
+
+    # Positions in bars relative to the last bar before the gap keep the Vandermonde system well conditioned
+    vandermonde = ((x[window_index] - origin[:, None]) / step)[..., None] ** powers
+    values = y[window_index]
+    coefficients = np.matmul(np.linalg.pinv(vandermonde), values[..., None])[..., 0]
+
+    position = (targets[inside] - origin[gap_index]) / step
+    fitted = ((position[:, None] ** powers) * coefficients[gap_index]).sum(axis=1)
+    result[inside] = np.clip(fitted, values.min(axis=1)[gap_index], values.max(axis=1)[gap_index])
+    return result
+
+
+# [system] fill_missing_values -> kernel
+GAP_FILL_KERNELS: dict = {
+    'interpolate_lin': linear_kernel,
+    'interpolate_poly': poly_kernel,
+    'ffill': ffill_kernel,
+}
+
+
+def missing_bars(seconds: np.ndarray, step: int, max_gap_bars: int) -> tuple:
+    """
+    Timestamps of the missing tradable bars between observed bars.
+    Only gaps that can hold at most max_gap_bars tradable bars are expanded, so a long outage costs nothing.
+    :param seconds: observed bar start in seconds since the epoch, ascending and unique
+    :param step: bar length in seconds
+    :param max_gap_bars: longest gap filled in tradable bars, 0 fills every gap
+    :return: (missing bar seconds, gap of each missing bar, tradable bars per expanded gap, calendar bars per gap, expanded mask, closed bars)
+    """
+    gap_bars = np.diff(seconds) // step - 1
+    expanded = gap_bars > 0
+    if max_gap_bars > 0:
+        expanded &= gap_bars <= max_gap_bars + MARKET_CLOSED_SECONDS // step
+
+    counts = gap_bars[expanded]
+    gap_of_bar = np.repeat(np.arange(counts.size), counts)
+    bar_in_gap = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    candidates = seconds[:-1][expanded][gap_of_bar] + bar_in_gap * step
+
+    is_open = tradable_mask(candidates.astype('datetime64[s]'))
+    tradable = np.bincount(gap_of_bar[is_open], minlength=counts.size)
+    return candidates[is_open], gap_of_bar[is_open], tradable, gap_bars, expanded, int((~is_open).sum())
+
+
+def interleave(generated: np.ndarray, observed_values: np.ndarray, generated_values: np.ndarray) -> np.ndarray:
+    """
+    :param generated: np.ndarray[bool] over the merged rows, True where a generated bar goes
+    :return: observed and generated values merged in bar order
+    """
+    merged = np.empty(generated.size, dtype=np.result_type(observed_values, generated_values))
+    merged[~generated] = observed_values
+    merged[generated] = generated_values
+    return merged
+
+
+def fill_gaps(seconds: np.ndarray,
+              columns: dict,
+              granularity: str,
+              method: str,
+              max_gap_bars: int = 0,
+              poly_order: int = 3,
+              poly_window: int = 8,
+              instrument: str = '') -> tuple:
+    """
+    Complete a candle series on its tradable bars only.
+    Missing bars are generated inside market hours between observed bars, gaps longer than max_gap_bars are
+    left open, and prices of generated bars and NaN prices of observed bars come from a GAP_FILL_KERNELS kernel.
+    Bars that stay incomplete are dropped.
+    :param seconds: bar start in seconds since the epoch
+    :param columns: dict of column name -> values in seconds order
+    :param granularity: OANDA granularity name, 'M' bars have no fixed length and are not expanded
+    :param method: name in GAP_FILL_KERNELS
+    :param max_gap_bars: longest gap filled in tradable bars, 0 fills every gap
+    :param poly_order: polynomial order of interpolate_poly
+    :param poly_window: observed bars used on each side of a gap by interpolate_poly
+    :param instrument: name reported in the GapReport
+    :return: (seconds, dict of filled columns, source row of each bar or -1 for a generated bar, GapReport)
+    """
+    kernel = GAP_FILL_KERNELS[method]
+    step = OANDA_GRANULARITY_SECONDS[granularity]
+
+    seconds = np.asarray(seconds, dtype=np.int64)
+    if (np.diff(seconds) > 0).all():
+        first = np.arange(seconds.size)
+    else:
+        seconds, first = np.unique(seconds, return_index=True)
+    columns = {name: np.asarray(values, dtype=np.float64)[first] for name, values in columns.items()}
+    report = GapReport(instrument, granularity, method, bars=int(seconds.size))
+
+    if granularity == 'M' or seconds.size < 2:
+        new_seconds, gap_of_bar, tradable = np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        gap_bars, expanded = np.zeros(max(seconds.size - 1, 0), dtype=np.int64), np.zeros(max(seconds.size - 1, 0), dtype=bool)
+    else:
+        new_seconds, gap_of_bar, tradable, gap_bars, expanded, report.closed_bars = missing_bars(seconds, step, max_gap_bars)
+
+    too_long = (gap_bars > 0) & ~expanded
+    fillable = (tradable > 0) & ((tradable <= max_gap_bars) if max_gap_bars > 0 else True)
+    skipped = (tradable > max_gap_bars) if max_gap_bars > 0 else np.zeros(tradable.size, dtype=bool)
+    new_seconds = new_seconds[fillable[gap_of_bar]]
+
+    report.gaps = int((tradable > 0).sum() + too_long.sum())
+    report.filled_gaps = int(fillable.sum())
+    report.filled_bars = int(new_seconds.size)
+    report.skipped_gaps = int(skipped.sum() + too_long.sum())
+    report.skipped_bars = int(tradable[skipped].sum() + gap_bars[too_long].sum())
+    report.longest_gap = int(max(tradable.max(initial=0), gap_bars[too_long].max(initial=0)))
+
+    # Generated bars slot in after the observed bar opening their gap, a linear merge instead of a sort
+    generated = np.zeros(seconds.size + new_seconds.size, dtype=bool)
+    generated[np.searchsorted(seconds, new_seconds) + np.arange(new_seconds.size)] = True
+
+    filled = {}
+    for name, values in columns.items():
+        if name in VOLUME_COLUMNS:
+            filled[name] = interleave(generated, values, np.zeros(new_seconds.size))
+            continue
+
+        missing = np.isnan(values)
+        report.missing_values += int(missing.sum())
+        targets = np.concatenate([seconds[missing], new_seconds]).astype(np.float64)
+        fitted = kernel(seconds[~missing].astype(np.float64), values[~missing], targets, step, poly_order, poly_window) \
+            if (~missing).any() else np.full(targets.size, np.nan)
+
+        values = values.copy()
+        values[missing] = fitted[:missing.sum()]
+        filled[name] = interleave(generated, values, fitted[missing.sum():])
+
+    # Generated bars keep High / Low around their interpolated Open and Close
+    if all(name in filled for name in PRICE_COLUMNS) and generated.any():
+        prices = np.vstack([filled[name][generated] for name in PRICE_COLUMNS])
+        filled['High'][generated] = prices.max(axis=0)
+        filled['Low'][generated] = prices.min(axis=0)
+
+    seconds = interleave(generated, seconds, new_seconds)
+    complete = ~np.any([np.isnan(values) for name, values in filled.items() if name not in VOLUME_COLUMNS], axis=0) \
+        if len(filled) > len(VOLUME_COLUMNS) else np.ones(seconds.size, dtype=bool)
+    report.dropped_bars = int((~complete).sum())
+
+    source = interleave(generated, first, np.full(new_seconds.size, -1))
+    return seconds[complete], {name: values[complete] for name, values in filled.items()}, source[complete], report
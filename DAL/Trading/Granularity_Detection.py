@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from DAL.Trading.Calendar import OANDA_GRANULARITY_SECONDS, SECONDS_PER_DAY
+
+# Bar lengths are exact below a day, daily and weekly bars move by an hour with daylight saving,
+# monthly bars are 28 to 31 days long
+DST_TOLERANCE_SECONDS: int = 3600
+MONTH_SECONDS: tuple = (28 * SECONDS_PER_DAY, 31 * SECONDS_PER_DAY)
+
+# Diffs inspected per frame, evenly strided over the whole index
+DETECTION_SAMPLE_SIZE: int = 65536
+
+STEP_GRANULARITY: dict = {seconds: name for name, seconds in OANDA_GRANULARITY_SECONDS.items() if name != 'M'}
+
+
+@dataclass(frozen=True)
+class GranularityDetection:
+    """
+    Granularity of one frame of candles, detected once and shared by every consumer of the frame.
+    """
+    granularity: str    # OANDA granularity name, None when no bar length is recognised
+    step: int           # most common distance between bars in seconds
+    confidence: float   # share of sampled distances that are exactly one bar
+    samples: int        # distances inspected
+
+    def matches(self, granularity: str, min_confidence: float = 0.0, min_samples: int = 1) -> bool:
+        """
+        :param granularity: expected OANDA granularity name
+        :param min_confidence: lowest confidence accepted
+        :param min_samples: below this many distances the confidence is not checked, a short frame only fails
+                            when it clearly holds another granularity
+        :return: True if the frame holds bars of that granularity
+        """
+        if self.samples < min_samples:
+            return self.granularity in (None, granularity)
+
+        return self.granularity == granularity and self.confidence >= min_confidence
+
+    def __str__(self) -> str:
+        return f"{self.granularity} (step {self.step}s, confidence {self.confidence:.2f} over {self.samples} bars)"
+
+
+def step_granularity(step: int):
+    """
+    :param step: distance between two bars in seconds
+    :return: OANDA granularity name, None if the step is not a bar length
+    """
+    if step in STEP_GRANULARITY:
+        return STEP_GRANULARITY[step]
+    elif MONTH_SECONDS[0] <= step <= MONTH_SECONDS[1]:
+        return 'M'
+
+    for name in ('D', 'W'):
+        if abs(step - OANDA_GRANULARITY_SECONDS[name]) <= DST_TOLERANCE_SECONDS:
+            return name
+
+    return None
+
+
+def one_bar(diffs: np.ndarray, granularity: str) -> np.ndarray:
+    """
+    :param diffs: distances between bars in seconds
+    :param granularity: OANDA granularity name
+    :return: np.ndarray[bool], True where the distance is exactly one bar of that granularity
+    """
+    if granularity == 'M':
+        return (diffs >= MONTH_SECONDS[0]) & (diffs <= MONTH_SECONDS[1])
+    elif granularity in ('D', 'W'):
+        return np.abs(diffs - OANDA_GRANULARITY_SECONDS[granularity]) <= DST_TOLERANCE_SECONDS
+
+    return diffs == OANDA_GRANULARITY_SECONDS[granularity]
+
+
+def detect_granularity(seconds: np.ndarray) -> GranularityDetection:
+    """
+    Mode of the integer distances between bars. Weekend closes, missing bars and irregular ticks only add
+    larger or odd distances, so the mode stays the bar length as long as most neighbouring bars are present.
+    :param seconds: bar start in seconds since the epoch
+    :return: GranularityDetection
+    """
+    diffs = np.diff(np.asarray(seconds, dtype=np.int64))
+    if (diffs < 0).any():
+        diffs = np.diff(np.sort(np.asarray(seconds, dtype=np.int64)))
+
+    # Repeated bars are not a distance, the sample is strided so the whole index is represented
+    diffs = diffs[diffs > 0]
+    diffs = diffs[::max(1, diffs.size // DETECTION_SAMPLE_SIZE)]
+    if diffs.size == 0:
+        return GranularityDetection(None, 0, 0.0, 0)
+
+    steps, counts = np.unique(diffs, return_counts=True)
+    step = int(steps[np.argmax(counts)])
+    granularity = step_granularity(step)
+    if granularity is None:
+        return GranularityDetection(None, step, 0.0, int(diffs.size))
+
+    return GranularityDetection(granularity, step, float(one_bar(diffs, granularity).mean()), int(diffs.size))
@@ -0,0 +1,290 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Column order of the ohlcv matrix every kernel takes, the Facts_CleanInstrument price columns
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(5)
+
+# Bars solved per matrix product by linear_recurrence
+RECURRENCE_BLOCK: int = 32
+
+# Rows summed per restart of the rolling_std cumulative sums, at least four windows
+ROLLING_CHUNK: int = 4096
+
+
+def valid_start(x: np.ndarray) -> int:
+    """
+    :param x: (bars, columns) array whose leading warm up rows may be NaN
+    :return: index of the first row without NaN
+    """
+    complete = ~np.isnan(x).any(axis=1)
+    return int(np.argmax(complete)) if complete.any() else x.shape[0]
+
+
+def shift(x: np.ndarray, bars: int) -> np.ndarray:
+    """
+    :return: x delayed by bars rows, NaN in front
+    """
+    result = np.full(x.shape, np.nan)
+    result[bars:] = x[:x.shape[0] - bars]
+    return result
+
+
+def linear_recurrence(x: np.ndarray, decay: float) -> np.ndarray:
+    """
+    y[t] = decay * y[t - 1] + x[t] for every column, solved without a Python loop over bars.
+    Each block of RECURRENCE_BLOCK bars is one matrix product, the state carried between blocks is the same
+    recurrence over the block ends with decay ** RECURRENCE_BLOCK, solved recursively.
+    :param x: (bars, columns) finite drive, a NaN spoils its whole block and every later one
+    :param decay: factor in [0, 1)
+    :return: (bars, columns) np.ndarray[float64]
+    """
+    bars, width = x.shape
+    lags = np.subtract.outer(np.arange(min(bars, RECURRENCE_BLOCK)), np.arange(min(bars, RECURRENCE_BLOCK)))
+    transfer = np.tril(decay ** np.maximum(lags, 0))
+    if bars <= RECURRENCE_BLOCK:
+        return transfer @ x
+
+    blocks = -(-bars // RECURRENCE_BLOCK)
+    padded = np.zeros((blocks * RECURRENCE_BLOCK, width))
+    padded[:bars] = x
+    local = np.matmul(transfer, padded.reshape(blocks, RECURRENCE_BLOCK, width))
+
+    ends = linear_recurrence(local[:, -1, :], decay ** RECURRENCE_BLOCK)
+    carry = np.vstack([np.zeros((1, width)), ends[:-1]])
+    result = local + (decay ** np.arange(1, RECURRENCE_BLOCK + 1))[None, :, None] * carry[:, None, :]
+    return result.reshape(-1, width)[:bars]
+
+
+def ewm(x: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Exponentially weighted mean of each column seeded with its first value,
+    pandas ewm(alpha=alpha, adjust=False, ignore_na=True).
+    NaN rows are skipped, the mean of the last value is carried over them.
+    :param x: (bars, columns) array, leading NaN rows stay NaN
+    :param alpha: smoothing factor, 2 / (span + 1) or 1 / period for Wilder smoothing
+    """
+    result = np.full(x.shape, np.nan)
+    start = valid_start(x)
+    if start < x.shape[0] and not np.isnan(x[start:]).any():
+        drive = alpha * x[start:]
+        drive[0] = x[start]
+        result[start:] = linear_recurrence(drive, 1.0 - alpha)
+        return result
+
+    # Gaps inside the series: each column is solved over its observed rows only, then carried forward
+    valid = ~np.isnan(x)
+    for column in range(x.shape[1]):
+        rows = np.flatnonzero(valid[:, column])
+        if rows.size:
+            drive = alpha * x[rows, column]
+            drive[0] = x[rows[0], column]
+            smoothed = linear_recurrence(drive[:, None], 1.0 - alpha)[:, 0]
+            result[rows[0]:, column] = smoothed[np.cumsum(valid[rows[0]:, column]) - 1]
+    return result
+
+
+def rolling_mean(x: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean of the last window rows from one cumulative sum, NaN until a full window is available.
+    Windows holding a NaN are NaN, like pandas rolling(window).mean(), later windows are not affected.
+    """
+    result = np.full(x.shape, np.nan)
+    start = valid_start(x)
+    if x.shape[0] - start >= window:
+        # Offsetting by the first row keeps the running sum small so the difference of two sums stays precise
+        offset = x[start]
+        values = x[start:] - offset
+        missing = np.isnan(values)
+        padding = np.zeros((1, x.shape[1]))
+        total = np.cumsum(np.vstack([padding, np.where(missing, 0.0, values)]), axis=0)
+        gaps = np.cumsum(np.vstack([padding, missing]), axis=0)
+        mean = (total[window:] - total[:-window]) / window + offset
+        mean[gaps[window:] > gaps[:-window]] = np.nan
+        result[start + window - 1:] = mean
+    return result
+
+
+def rolling_std(x: np.ndarray, window: int) -> np.ndarray:
+    """
+    Population standard deviation of the last window rows from cumulative sums of x and x ** 2,
+    NaN until a full window is available and for windows holding a NaN, like pandas rolling(window).std(ddof=0).
+    The sums restart every ROLLING_CHUNK rows around the mean of the chunk, so they stay small enough for the
+    difference of two sums to keep its precision on long drifting series.
+    """
+    result = np.full(x.shape, np.nan)
+    start = valid_start(x)
+    chunk = max(ROLLING_CHUNK, 4 * window)
+    padding = np.zeros((1, x.shape[1]))
+    for begin in range(start, x.shape[0] - window + 1, chunk):
+        segment = x[begin:min(begin + chunk + window - 1, x.shape[0])]
+        missing = np.isnan(segment)
+        observed = np.maximum((~missing).sum(axis=0), 1)
+        filled = np.where(missing, 0.0, segment - np.nansum(segment, axis=0) / observed)
+
+        total = np.cumsum(np.vstack([padding, filled]), axis=0)
+        squares = np.cumsum(np.vstack([padding, filled * filled]), axis=0)
+        gaps = np.cumsum(np.vstack([padding, missing]), axis=0)
+
+        mean = (total[window:] - total[:-window]) / window
+        # Rounding can leave a constant window slightly below zero
+        variance = np.maximum((squares[window:] - squares[:-window]) / window - mean * mean, 0.0)
+        variance[gaps[window:] > gaps[:-window]] = np.nan
+        result[begin + window - 1:begin + segment.shape[0]] = np.sqrt(variance)
+    return result
+
+
+def rolling_reduce(x: np.ndarray, window: int, reducer: str) -> np.ndarray:
+    """
+    :param reducer: 'max' or 'min' over the last window rows, reduced on a strided view without copying the windows
+    """
+    result = np.full(x.shape, np.nan)
+    if x.shape[0] >= window:
+        result[window - 1:] = getattr(sliding_window_view(x, window, axis=0), reducer)(axis=-1)
+    return result
+
+
+def with_volume(prices: np.ndarray, volume: np.ndarray = None) -> np.ndarray:
+    """
+    :param prices: (bars, 4) result on the Open, High, Low, Close columns
+    :param volume: (bars,) result on the Volume column, NaN when the indicator does not apply to volume
+    :return: (bars, 5) array in ohlcv order
+    """
+    return np.column_stack([prices, np.full(prices.shape[0], np.nan) if volume is None else volume])
+
+
+def relative_strength_index(ohlcv: np.ndarray, period: int) -> dict:
+    """
+    Wilder RSI of every column.
+    """
+    change = np.diff(ohlcv, axis=0, prepend=np.nan)
+    average_gain = ewm(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0)), 1.0 / period)
+    average_loss = ewm(np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0)), 1.0 / period)
+
+    total = average_gain + average_loss
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rsi = np.where(total > 0, 100.0 * average_gain / total, 50.0)
+    rsi[:period] = np.nan
+    return {'': rsi}
+
+
+def stochastic_oscillator(ohlcv: np.ndarray, period: int, smoothing: int) -> dict:
+    """
+    %K of each price column against the High / Low range of the last period bars and its smoothed %D.
+    """
+    highest = rolling_reduce(ohlcv[:, [HIGH]], period, 'max')
+    lowest = rolling_reduce(ohlcv[:, [LOW]], period, 'min')
+    span = highest - lowest
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = np.where(span > 0, 100.0 * (ohlcv[:, :VOLUME] - lowest) / span, 50.0)
+    k[np.isnan(span[:, 0])] = np.nan
+    return {'K': with_volume(k), 'D': with_volume(rolling_mean(k, smoothing))}
+
+
+def williams_r(ohlcv: np.ndarray, period: int) -> dict:
+    """
+    Williams %R of each price column, 0 at the period high and -100 at the period low.
+    """
+    highest = rolling_reduce(ohlcv[:, [HIGH]], period, 'max')
+    lowest = rolling_reduce(ohlcv[:, [LOW]], period, 'min')
+    span = highest - lowest
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wr = np.where(span > 0, -100.0 * (highest - ohlcv[:, :VOLUME]) / span, -50.0)
+    wr[np.isnan(span[:, 0])] = np.nan
+    return {'': with_volume(wr)}
+
+
+def on_balance_volume(ohlcv: np.ndarray) -> dict:
+    """
+    Running sum of the volume signed by the direction of each price column.
+    """
+    direction = np.sign(np.diff(ohlcv[:, :VOLUME], axis=0, prepend=ohlcv[:1, :VOLUME]))
+    return {'': with_volume(np.cumsum(direction * ohlcv[:, [VOLUME]], axis=0))}
+
+
+def moving_average(ohlcv: np.ndarray, period: int) -> dict:
+    """
+    Simple moving average of every column.
+    """
+    return {'': rolling_mean(ohlcv, period)}
+
+
+def moving_average_convergence_divergence(ohlcv: np.ndarray, fast: int, slow: int, signal: int) -> dict:
+    """
+    MACD line, signal line and histogram of every column.
+    """
+    line = ewm(ohlcv, 2.0 / (fast + 1)) - ewm(ohlcv, 2.0 / (slow + 1))
+    line[:slow - 1] = np.nan
+    signal_line = ewm(line, 2.0 / (signal + 1))
+    signal_line[:slow + signal - 2] = np.nan
+    return {'': line, 'Signal': signal_line, 'Histogram': line - signal_line}
+
+
+def bollinger_bands(ohlcv: np.ndarray, period: int, deviations: float) -> dict:
+    """
+    Moving average of every column with bands deviations population standard deviations away.
+    """
+    middle = rolling_mean(ohlcv, period)
+    width = deviations * rolling_std(ohlcv, period)
+    return {'Upper': middle + width, 'Middle': middle, 'Lower': middle - width}
+
+
+def keltner_channels(ohlcv: np.ndarray, period: int, multiplier: float) -> dict:
+    """
+    EMA of each price column with bands multiplier Wilder average true ranges away.
+    """
+    previous_close = shift(ohlcv[:, [CLOSE]], 1)
+    true_range = np.nanmax(np.column_stack([ohlcv[:, HIGH] - ohlcv[:, LOW],
+                                            np.abs(ohlcv[:, [HIGH]] - previous_close)[:, 0],
+                                            np.abs(ohlcv[:, [LOW]] - previous_close)[:, 0]]), axis=1)
+    average_range = ewm(true_range[:, None], 1.0 / period)
+
+    middle = ewm(ohlcv[:, :VOLUME], 2.0 / (period + 1))
+    middle[:period - 1] = np.nan
+    width = multiplier * average_range
+    return {'Upper': with_volume(middle + width), 'Middle': with_volume(middle), 'Lower': with_volume(middle - width)}
+
+
+def returns(ohlcv: np.ndarray, period: int) -> dict:
+    """
+    Simple return of every column over period bars.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        change = ohlcv / shift(ohlcv, period) - 1.0
+    change[~np.isfinite(change)] = np.nan
+    return {'': change}
+
+
+# [indicators] bucket name -> (kernel, line names, default parameter sets)
+# Parameter sets are read from [indicators] <name>_periods, e.g. rsi_periods = 14, 21 or macd_periods = 12/26/9
+INDICATOR_KERNELS: dict = {
+    'RSI': (relative_strength_index, ('',), ((14,),)),
+    'STOCH_OSC': (stochastic_oscillator, ('K', 'D'), ((14, 3),)),
+    'WR': (williams_r, ('',), ((14,),)),
+    'OBV': (on_balance_volume, ('',), ((),)),
+    'MA': (moving_average, ('',), ((20,), (50,), (200,))),
+    'MACD': (moving_average_convergence_divergence, ('', 'Signal', 'Histogram'), ((12, 26, 9),)),
+    'BB': (bollinger_bands, ('Upper', 'Middle', 'Lower'), ((20, 2),)),
+    'KC': (keltner_channels, ('Upper', 'Middle', 'Lower'), ((20, 2),)),
+    'Returns': (returns, ('',), ((1,),)),
+}
+
+
+def indicator_line_name(name: str, parameters: tuple, line: str) -> str:
+    """
+    :return: Dimension_Indicators Name of one output line, e.g. RSI_14, MACD_12_26_9_Signal or OBV
+    """
+    return '_'.join([name] + [f"{value:g}" for value in parameters] + ([line] if line else []))
+
+
+if __name__ == '__main__':
+    import time
+
+    bars = 1_000_000
+    close = 1.1 + np.cumsum(np.random.normal(0, 1e-4, bars))
+    spread = np.abs(np.random.normal(0, 1e-4, bars))
+    frame = np.column_stack([close, close + spread, close - spread, close, np.random.randint(1, 1000, bars)]).astype(np.float64)
+
+    for name, (kernel, lines, parameter_sets) in INDICATOR_KERNELS.items():
+        start = time.perf_counter()
+        kernel(frame, *parameter_sets[0])
+        print(f"{indicator_line_name(name, parameter_sets[0], '')}: {bars / (time.perf_counter() - start):,.0f} bars/sec")
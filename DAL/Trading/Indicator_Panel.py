@@ -0,0 +1,100 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from DAL.Trading.Fact_Batches import PRICE_COLUMNS
+from DAL.Trading.Indicator_Kernels import CLOSE, INDICATOR_KERNELS
+
+# Last axis of the panel, the ohlcv order of Indicator_Kernels
+PANEL_FIELDS: tuple = PRICE_COLUMNS + ('Volume',)
+
+# Panel attached by a worker process, set once by attach_panel
+WORKER_PANEL: dict = {}
+
+
+class PricePanel:
+    """
+    Instrument x time x ohlcv float64 panel in shared memory. Worker processes attach to it by name,
+    the prices are never pickled. Bars an instrument does not have on the shared time axis are NaN.
+    """
+    def __init__(self, instrument_keys: np.ndarray, datetime_keys: np.ndarray, date_keys: np.ndarray, time_keys: np.ndarray):
+        """
+        :param instrument_keys: InstrumentKey of each panel row
+        :param datetime_keys: ascending DateTimeKey of each time step, the union over every instrument
+        :param date_keys: DateKey of each time step
+        :param time_keys: TimeKey of each time step
+        """
+        self.instrument_keys = instrument_keys
+        self.datetime_keys = datetime_keys
+        self.date_keys = date_keys
+        self.time_keys = time_keys
+        self.shape = (instrument_keys.size, datetime_keys.size, len(PANEL_FIELDS))
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(int(np.prod(self.shape)) * 8, 1))
+        self.values = np.ndarray(self.shape, dtype=np.float64, buffer=self.memory.buf)
+        self.values.fill(np.nan)
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> 'PricePanel':
+        """
+        :param columns: dict of InstrumentKey, DateTimeKey, DateKey, TimeKey and PANEL_FIELDS name -> np.ndarray, one row per bar
+        :return: PricePanel holding every bar
+        """
+        instrument_keys, instrument_index = np.unique(columns['InstrumentKey'], return_inverse=True)
+        datetime_keys, first, time_index = np.unique(columns['DateTimeKey'], return_index=True, return_inverse=True)
+
+        panel = cls(instrument_keys, datetime_keys, columns['DateKey'][first], columns['TimeKey'][first])
+        for position, name in enumerate(PANEL_FIELDS):
+            panel.values[instrument_index, time_index, position] = columns[name]
+        return panel
+
+    @property
+    def descriptor(self) -> tuple:
+        """
+        :return: (shared memory name, shape), all a worker needs to attach
+        """
+        return self.memory.name, self.shape
+
+    def series(self, rows: np.ndarray) -> dict:
+        """
+        :param rows: time steps of one instrument
+        :return: DateTimeKey, DateKey and TimeKey columns of those steps, the series argument of Indicators.indicator_batch
+        """
+        return {'DateTimeKey': self.datetime_keys[rows], 'DateKey': self.date_keys[rows], 'TimeKey': self.time_keys[rows]}
+
+    def release(self) -> None:
+        """
+        Free the shared memory, the panel cannot be used afterwards.
+        """
+        self.values = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+def attach_panel(name: str, shape: tuple) -> None:
+    """
+    Worker process initializer, maps the shared panel once per process.
+    :param name: shared memory name of PricePanel.descriptor
+    :param shape: panel shape
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    WORKER_PANEL['memory'] = memory
+    WORKER_PANEL['values'] = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+
+
+def compute_panel_slice(instrument_index: int, name: str, parameters: tuple) -> tuple:
+    """
+    One cell of the instrument x indicator grid, run in a worker attached with attach_panel.
+    The kernel sees only the bars the instrument has, so the gaps of the shared time axis do not reach the windows.
+    :param instrument_index: panel row
+    :param name: indicator name in INDICATOR_KERNELS
+    :param parameters: parameter set of the indicator
+    :return: (instrument_index, name, parameters, time steps of the bars, line -> (bars, 5) values, kernel seconds)
+    """
+    prices = WORKER_PANEL['values'][instrument_index]
+    rows = np.flatnonzero(~np.isnan(prices[:, CLOSE]))
+
+    start = time.perf_counter()
+    values = INDICATOR_KERNELS[name][0](prices[rows], *parameters)
+    return instrument_index, name, parameters, rows, values, time.perf_counter() - start
@@ -0,0 +1,398 @@
+import json
+
+import numpy as np
+
+from DAL.Trading.Indicator_Kernels import OPEN, HIGH, LOW, CLOSE, VOLUME, ewm, stochastic_oscillator, valid_start
+
+
+def export_state(holder) -> dict:
+    """
+    :param holder: stream or accumulator
+    :return: JSON ready dict of its arrays, nested accumulators and scalars
+    """
+    state = {}
+    for key, value in vars(holder).items():
+        if key == 'parameters':
+            continue
+        elif isinstance(value, np.ndarray):
+            state[key] = {'array': value.tolist()}
+        elif hasattr(value, '__dict__'):
+            state[key] = {'holder': export_state(value)}
+        else:
+            state[key] = value
+    return state
+
+
+def import_state(holder, state: dict) -> None:
+    """
+    Reverse of export_state onto an instance built with the same parameters.
+    """
+    for key, value in state.items():
+        if isinstance(value, dict) and 'array' in value:
+            setattr(holder, key, np.array(value['array'], dtype=np.float64))
+        elif isinstance(value, dict) and 'holder' in value:
+            import_state(getattr(holder, key), value['holder'])
+        else:
+            setattr(holder, key, value)
+
+
+def row_with_volume(prices: np.ndarray) -> np.ndarray:
+    """
+    :return: one bar of a price column result in ohlcv order, the Volume value NaN
+    """
+    return np.append(prices, np.nan)
+
+
+class Ema:
+    """
+    Exponentially weighted mean seeded with the first value, the state of Indicator_Kernels.ewm.
+    """
+    def __init__(self, alpha: float, width: int):
+        self.alpha = alpha
+        self.value = np.full(width, np.nan)
+        self.seeded = False
+
+    def update(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float64)
+        blended = (1.0 - self.alpha) * self.value + self.alpha * x if self.seeded else x
+        # A NaN keeps the mean of its column, a column without a mean yet is seeded with its first value
+        self.value = np.where(np.isnan(x), self.value, np.where(np.isnan(self.value), x, blended))
+        self.seeded = True
+        return self.value
+
+    def warm(self, series: np.ndarray) -> None:
+        """
+        :param series: (bars, width) history, leading NaN rows are skipped like ewm does
+        """
+        if valid_start(series) < series.shape[0]:
+            self.value = ewm(series, self.alpha)[-1]
+            self.seeded = True
+
+
+class RingWindow:
+    """
+    The last window rows of a series in a ring buffer, with a running sum re-added exactly once per lap.
+    """
+    def __init__(self, window: int, width: int):
+        self.window = window
+        self.values = np.full((window, width), np.nan)
+        self.total = np.zeros(width)
+        self.missing = np.zeros(width)
+        self.position = 0
+        self.count = 0
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.window
+
+    def oldest(self) -> np.ndarray:
+        """
+        :return: the row pushed window rows ago, NaN until the window is full
+        """
+        return self.values[self.position] if self.full else np.full(self.values.shape[1], np.nan)
+
+    def push(self, x: np.ndarray) -> None:
+        # NaN rows are counted instead of summed, so they leave the mean once they leave the window
+        oldest = self.values[self.position] if self.full else np.zeros(self.values.shape[1])
+        self.total = self.total + np.nan_to_num(x, nan=0.0) - np.nan_to_num(oldest, nan=0.0)
+        self.missing = self.missing + np.isnan(x) - np.isnan(oldest)
+        self.values[self.position] = x
+        self.position = (self.position + 1) % self.window
+        self.count += 1
+        if self.position == 0:
+            self.total = np.nansum(self.values, axis=0)
+
+    def mean(self) -> np.ndarray:
+        if not self.full:
+            return np.full(self.values.shape[1], np.nan)
+        return np.where(self.missing > 0, np.nan, self.total / self.window)
+
+    def reduce(self, reducer: str) -> np.ndarray:
+        """
+        :param reducer: 'max', 'min' or 'std' over the window
+        """
+        return getattr(self.values, reducer)(axis=0) if self.full else np.full(self.values.shape[1], np.nan)
+
+    def warm(self, series: np.ndarray) -> None:
+        """
+        :param series: (bars, width) history pushed in order
+        """
+        tail = series[-self.window:]
+        self.count = series.shape[0]
+        self.position = self.count % self.window
+        self.values[np.arange(self.count - tail.shape[0], self.count) % self.window] = tail
+        self.total = np.nansum(tail, axis=0)
+        self.missing = np.isnan(tail).sum(axis=0).astype(np.float64)
+
+
+class IndicatorStream:
+    """
+    O(1) per bar state of one indicator parameter set over the five ohlcv columns.
+    update returns the row the Indicator_Kernels batch kernel returns for the same bar, warm folds a whole
+    history in with the batch kernels so a stream can start at the end of a stored series.
+    """
+    def __init__(self, *parameters):
+        self.parameters = parameters
+        self.bars = 0
+
+    def update(self, bar: np.ndarray) -> dict:
+        """
+        :param bar: Open, High, Low, Close, Volume of the next bar
+        :return: dict of line -> (5,) np.ndarray
+        """
+        raise NotImplementedError
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        """
+        :param ohlcv: (bars, 5) history
+        """
+        raise NotImplementedError
+
+    def dumps(self) -> str:
+        return json.dumps(export_state(self))
+
+    def loads(self, state: str) -> 'IndicatorStream':
+        import_state(self, json.loads(state))
+        return self
+
+
+class RelativeStrengthIndexStream(IndicatorStream):
+    def __init__(self, period: int):
+        super().__init__(period)
+        self.period = period
+        self.previous = np.full(5, np.nan)
+        self.gain = Ema(1.0 / period, 5)
+        self.loss = Ema(1.0 / period, 5)
+
+    def update(self, bar: np.ndarray) -> dict:
+        rsi = np.full(5, np.nan)
+        if self.bars > 0:
+            change = bar - self.previous
+            gain = self.gain.update(np.maximum(change, 0.0))
+            loss = self.loss.update(np.maximum(-change, 0.0))
+            total = gain + loss
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rsi = np.where(total > 0, 100.0 * gain / total, 50.0)
+
+        self.previous = np.array(bar, dtype=np.float64)
+        self.bars += 1
+        return {'': rsi if self.bars > self.period else np.full(5, np.nan)}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        change = np.diff(ohlcv, axis=0, prepend=np.nan)
+        self.gain.warm(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0)))
+        self.loss.warm(np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0)))
+        self.previous = ohlcv[-1].astype(np.float64)
+        self.bars = ohlcv.shape[0]
+
+
+class RangeStream(IndicatorStream):
+    """
+    High / Low range of the last period bars, shared by the stochastic oscillator and Williams %R.
+    """
+    def __init__(self, period: int, *parameters):
+        super().__init__(period, *parameters)
+        self.highs = RingWindow(period, 1)
+        self.lows = RingWindow(period, 1)
+
+    def push_range(self, bar: np.ndarray) -> tuple:
+        """
+        :return: (highest high, lowest low) as (1,) arrays, NaN until the window is full
+        """
+        self.highs.push(bar[[HIGH]])
+        self.lows.push(bar[[LOW]])
+        self.bars += 1
+        return self.highs.reduce('max'), self.lows.reduce('min')
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        self.highs.warm(ohlcv[:, [HIGH]])
+        self.lows.warm(ohlcv[:, [LOW]])
+        self.bars = ohlcv.shape[0]
+
+
+class StochasticOscillatorStream(RangeStream):
+    def __init__(self, period: int, smoothing: int):
+        super().__init__(period, smoothing)
+        self.k_window = RingWindow(smoothing, 4)
+
+    def update(self, bar: np.ndarray) -> dict:
+        highest, lowest = self.push_range(bar)
+        span = highest - lowest
+        k = np.full(4, np.nan)
+        if self.highs.full:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                k = np.where(span > 0, 100.0 * (bar[:VOLUME] - lowest) / span, 50.0)
+            self.k_window.push(k)
+
+        return {'K': row_with_volume(k), 'D': row_with_volume(self.k_window.mean())}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        super().warm(ohlcv)
+        k = stochastic_oscillator(ohlcv, *self.parameters)['K'][:, :VOLUME]
+        if valid_start(k) < k.shape[0]:
+            self.k_window.warm(k[valid_start(k):])
+
+
+class WilliamsRStream(RangeStream):
+    def __init__(self, period: int):
+        super().__init__(period)
+
+    def update(self, bar: np.ndarray) -> dict:
+        highest, lowest = self.push_range(bar)
+        span = highest - lowest
+        wr = np.full(4, np.nan)
+        if self.highs.full:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                wr = np.where(span > 0, -100.0 * (highest - bar[:VOLUME]) / span, -50.0)
+
+        return {'': row_with_volume(wr)}
+
+
+class OnBalanceVolumeStream(IndicatorStream):
+    def __init__(self):
+        super().__init__()
+        self.previous = np.full(4, np.nan)
+        self.total = np.zeros(4)
+
+    def update(self, bar: np.ndarray) -> dict:
+        if self.bars > 0:
+            self.total = self.total + np.sign(bar[:VOLUME] - self.previous) * bar[VOLUME]
+        self.previous = np.array(bar[:VOLUME], dtype=np.float64)
+        self.bars += 1
+        return {'': row_with_volume(self.total)}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        direction = np.sign(np.diff(ohlcv[:, :VOLUME], axis=0, prepend=ohlcv[:1, :VOLUME]))
+        self.total = (direction * ohlcv[:, [VOLUME]]).sum(axis=0)
+        self.previous = ohlcv[-1, :VOLUME].astype(np.float64)
+        self.bars = ohlcv.shape[0]
+
+
+class MovingAverageStream(IndicatorStream):
+    def __init__(self, period: int):
+        super().__init__(period)
+        self.window = RingWindow(period, 5)
+
+    def update(self, bar: np.ndarray) -> dict:
+        self.window.push(bar)
+        self.bars += 1
+        return {'': self.window.mean()}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        self.window.warm(ohlcv)
+        self.bars = ohlcv.shape[0]
+
+
+class MovingAverageConvergenceDivergenceStream(IndicatorStream):
+    def __init__(self, fast: int, slow: int, signal: int):
+        super().__init__(fast, slow, signal)
+        self.slow_period = slow
+        self.signal_period = signal
+        self.fast = Ema(2.0 / (fast + 1), 5)
+        self.slow = Ema(2.0 / (slow + 1), 5)
+        self.signal = Ema(2.0 / (signal + 1), 5)
+
+    def update(self, bar: np.ndarray) -> dict:
+        line = self.fast.update(bar) - self.slow.update(bar)
+        signal = np.full(5, np.nan)
+        if self.bars >= self.slow_period - 1:
+            signal = self.signal.update(line)
+        else:
+            line = np.full(5, np.nan)
+
+        if self.bars < self.slow_period + self.signal_period - 2:
+            signal = np.full(5, np.nan)
+
+        self.bars += 1
+        return {'': line, 'Signal': signal, 'Histogram': line - signal}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        fast, slow = ewm(ohlcv, self.fast.alpha), ewm(ohlcv, self.slow.alpha)
+        line = fast - slow
+        line[:self.slow_period - 1] = np.nan
+        self.fast.value, self.slow.value = fast[-1], slow[-1]
+        self.fast.seeded = self.slow.seeded = True
+        self.signal.warm(line)
+        self.bars = ohlcv.shape[0]
+
+
+class BollingerBandsStream(IndicatorStream):
+    def __init__(self, period: int, deviations: float):
+        super().__init__(period, deviations)
+        self.deviations = deviations
+        self.window = RingWindow(period, 5)
+
+    def update(self, bar: np.ndarray) -> dict:
+        self.window.push(bar)
+        self.bars += 1
+        middle = self.window.mean()
+        width = self.deviations * self.window.reduce('std')
+        return {'Upper': middle + width, 'Middle': middle, 'Lower': middle - width}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        self.window.warm(ohlcv)
+        self.bars = ohlcv.shape[0]
+
+
+class KeltnerChannelsStream(IndicatorStream):
+    def __init__(self, period: int, multiplier: float):
+        super().__init__(period, multiplier)
+        self.period = period
+        self.multiplier = multiplier
+        self.previous_close = np.nan
+        self.middle = Ema(2.0 / (period + 1), 4)
+        self.average_range = Ema(1.0 / period, 1)
+
+    def update(self, bar: np.ndarray) -> dict:
+        true_range = np.nanmax([bar[HIGH] - bar[LOW], abs(bar[HIGH] - self.previous_close), abs(bar[LOW] - self.previous_close)])
+        average_range = self.average_range.update(np.array([true_range]))
+        middle = self.middle.update(bar[:VOLUME])
+        if self.bars < self.period - 1:
+            middle = np.full(4, np.nan)
+
+        self.previous_close = float(bar[CLOSE])
+        self.bars += 1
+        width = self.multiplier * average_range
+        return {'Upper': row_with_volume(middle + width), 'Middle': row_with_volume(middle), 'Lower': row_with_volume(middle - width)}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        previous_close = np.concatenate([[np.nan], ohlcv[:-1, CLOSE]])
+        true_range = np.nanmax(np.column_stack([ohlcv[:, HIGH] - ohlcv[:, LOW],
+                                                np.abs(ohlcv[:, HIGH] - previous_close),
+                                                np.abs(ohlcv[:, LOW] - previous_close)]), axis=1)
+        self.average_range.warm(true_range[:, None])
+        self.middle.warm(ohlcv[:, :VOLUME])
+        self.previous_close = float(ohlcv[-1, CLOSE])
+        self.bars = ohlcv.shape[0]
+
+
+class ReturnsStream(IndicatorStream):
+    def __init__(self, period: int):
+        super().__init__(period)
+        self.window = RingWindow(period, 5)
+
+    def update(self, bar: np.ndarray) -> dict:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change = bar / self.window.oldest() - 1.0
+        change[~np.isfinite(change)] = np.nan
+        self.window.push(bar)
+        self.bars += 1
+        return {'': change}
+
+    def warm(self, ohlcv: np.ndarray) -> None:
+        self.window.warm(ohlcv)
+        self.bars = ohlcv.shape[0]
+
+
+# [indicators] bucket name -> stream class, the streaming counterpart of Indicator_Kernels.INDICATOR_KERNELS
+INDICATOR_STREAMS: dict = {
+    'RSI': RelativeStrengthIndexStream,
+    'STOCH_OSC': StochasticOscillatorStream,
+    'WR': WilliamsRStream,
+    'OBV': OnBalanceVolumeStream,
+    'MA': MovingAverageStream,
+    'MACD': MovingAverageConvergenceDivergenceStream,
+    'BB': BollingerBandsStream,
+    'KC': KeltnerChannelsStream,
+    'Returns': ReturnsStream,
+}
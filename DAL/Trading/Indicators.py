@@ -0,0 +1,485 @@
+import configparser
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from logging import Logger
+
+import numpy as np
+from sqlalchemy import select, distinct, delete, insert
+
+from CORE.Error_Handling import ErrorHandling
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DAL.Trading.Dimension_Cache import DimensionCache
+from DAL.Trading.Fact_Batches import PRICE_COLUMNS, FactBatch, FactBatchBuilder
+from DAL.Trading.Indicator_Kernels import INDICATOR_KERNELS, indicator_line_name
+from DAL.Trading.Indicator_Panel import PANEL_FIELDS, PricePanel, attach_panel, compute_panel_slice
+from DAL.Trading.Indicator_Streams import INDICATOR_STREAMS
+from DOL.Trading.Facts.Facts_CleanInstruments import Facts_CleanInstrument
+from DOL.Trading.Facts.Facts_Indicators import Facts_Indicators
+from DOL.Trading.States.State_Indicators import State_Indicators
+
+# [indicators] buckets naming the Dimension_IndicatorCategory and Dimension_IndicatorType of each indicator
+CATEGORY_BUCKETS: tuple = ('leading_bucket', 'lagging_bucket')
+TYPE_BUCKETS: tuple = ('momentum_bucket', 'trend_bucket', 'volatility_bucket', 'volume_bucket')
+
+# Facts_CleanInstrument columns the kernels read, in the ohlcv matrix order of Indicator_Kernels
+SERIES_COLUMNS: tuple = ('DateTimeKey', 'DateKey', 'TimeKey') + PRICE_COLUMNS + ('Volume',)
+
+
+class Indicators(ErrorHandling, FactBatchBuilder):
+    def __init__(self,
+                 config_object: configparser.ConfigParser,
+                 postgres_interface: PostgreSQLInterface,
+                 logger: Logger,
+                 granularity: str,
+                 price_type: str = 'M'):
+        """
+        Compute the configured indicators from Facts_CleanInstrument and load them into Facts_Indicators.
+        Each instrument series is read once, every indicator runs on the same NumPy arrays.
+        :param config_object: ConfigManager object
+        :param postgres_interface: PostgreSQLInterface object
+        :param logger: Logger object
+        :param granularity: OANDA granularity name of the series
+        :param price_type: Price Type Bid, Ask, Mid of the series
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.config = config_object
+        self.postgres_interface = postgres_interface
+        self.granularity: str = granularity
+        self.price_type: str = price_type
+
+        self.dimensions = DimensionCache.shared(self.postgres_interface, self.logger)
+
+        # Indicator name -> {'bars': bars computed, 'seconds': kernel time}
+        self.throughput: dict = {}
+
+    def bucket(self, option: str) -> list:
+        """
+        :param option: [indicators] option holding a comma separated list
+        :return: stripped non empty names
+        """
+        return [name.strip() for name in self.config.get('indicators', option, fallback='').split(',') if name.strip()]
+
+    def configured_indicators(self) -> dict:
+        """
+        Indicators listed in the category buckets and custom_indicators, with their category and type.
+        :return: dict of indicator name -> (category name, type name)
+        """
+        categories = {name: option.replace('_bucket', '').capitalize() for option in CATEGORY_BUCKETS for name in self.bucket(option)}
+        types = {name: option.replace('_bucket', '').capitalize() for option in TYPE_BUCKETS for name in self.bucket(option)}
+
+        indicators = {}
+        for name in list(categories) + [name for name in self.bucket('custom_indicators') if name not in categories]:
+            if name not in INDICATOR_KERNELS:
+                self.logger.warning(f"configured_indicators -> no kernel for '{name}', skipped")
+            elif name not in categories or name not in types:
+                self.ErrorsDetected = True
+                self.ErrorList.append(self.error_details(
+                    f"{__class__}: configured_indicators -> '{name}' needs a category ({', '.join(CATEGORY_BUCKETS)}) and a type ({', '.join(TYPE_BUCKETS)}) bucket"))
+            else:
+                indicators[name] = (categories[name], types[name])
+
+        return indicators
+
+    def indicator_parameters(self, name: str) -> tuple:
+        """
+        Parameter sets of an indicator from [indicators] <name>_periods, sets separated by ',' and the
+        parameters of one set by '/', e.g. rsi_periods = 14, 21 or macd_periods = 12/26/9.
+        :param name: indicator name in INDICATOR_KERNELS
+        :return: tuple of parameter tuples
+        """
+        option = self.config.get('indicators', f"{name.lower()}_periods", fallback='').strip()
+        if not option:
+            return INDICATOR_KERNELS[name][2]
+
+        return tuple(tuple(int(value) if float(value).is_integer() else float(value)
+                           for value in parameter_set.split('/') if value.strip())
+                     for parameter_set in option.split(','))
+
+    def ensure_indicator_dimensions(self, indicators: dict) -> dict:
+        """
+        Add the categories, types and one Dimension_Indicators row per output line that are not stored yet.
+        :param indicators: output of configured_indicators
+        :return: dict of indicator name -> list of (parameters, {line: IndicatorKey})
+        """
+        category_keys = self.dimensions.ensure('indicator_category', [{'Name': category} for category, kind in indicators.values()])
+        type_keys = self.dimensions.ensure('indicator_type', [{'Name': kind} for category, kind in indicators.values()])
+
+        lines = {}
+        rows = []
+        for name, (category, kind) in indicators.items():
+            lines[name] = [(parameters, {line: indicator_line_name(name, parameters, line) for line in INDICATOR_KERNELS[name][1]})
+                           for parameters in self.indicator_parameters(name)]
+            rows.extend({'Name': line_name, 'IndicatorCategoryKey': category_keys[category], 'IndicatorTypeKey': type_keys[kind]}
+                        for parameters, names in lines[name] for line_name in names.values())
+
+        indicator_keys = self.dimensions.ensure('indicator', rows)
+        return {name: [(parameters, {line: indicator_keys[line_name] for line, line_name in names.items()})
+                       for parameters, names in sets] for name, sets in lines.items()}
+
+    def read_clean_series(self, instrument_key: int, granularity_key: int, price_type_key: int, after_datetime: int = None) -> dict:
+        """
+        :param after_datetime: only bars with a later DateTimeKey are read, None reads the whole series
+        :return: dict of SERIES_COLUMNS name -> np.ndarray of one Facts_CleanInstrument series in DateTimeKey order
+        """
+        where = (Facts_CleanInstrument.PriceTypeKey == price_type_key,)
+        if after_datetime is not None:
+            where += (Facts_CleanInstrument.DateTimeKey > int(after_datetime),)
+
+        batches = list(self.postgres_interface.stream_model(Facts_CleanInstrument,
+                                                            columns=list(SERIES_COLUMNS),
+                                                            instrument_keys=[instrument_key],
+                                                            granularity_keys=[granularity_key],
+                                                            where=where,
+                                                            order_by='DateTimeKey'))
+        return {name: np.concatenate([batch[name] for batch in batches]) if batches else np.array([])
+                for name in SERIES_COLUMNS}
+
+    def indicator_batch(self, series: dict, granularity_key: int, instrument_key: int, lines: dict, values: dict) -> FactBatch:
+        """
+        One Facts_Indicators batch holding every line of an indicator, warm up bars without any value are left out.
+        :param series: output of read_clean_series
+        :param granularity_key: GranularityKey of the series
+        :param instrument_key: InstrumentKey of the series
+        :param lines: line -> IndicatorKey
+        :param values: line -> (bars, 5) array in ohlcv order
+        :return: FactBatch for Facts_Indicators
+        """
+        bars = series['DateTimeKey'].size
+        stacked = np.concatenate([values[line] for line in lines])
+        keep = ~np.isnan(stacked).all(axis=1)
+
+        columns = {name: np.tile(series[name], len(lines))[keep] for name in ('DateTimeKey', 'DateKey', 'TimeKey')}
+        columns['GranularityKey'] = np.full(columns['DateTimeKey'].size, granularity_key, dtype=np.int64)
+        columns['InstrumentKey'] = np.full(columns['DateTimeKey'].size, instrument_key, dtype=np.int64)
+        columns['IndicatorKey'] = np.repeat(np.array(list(lines.values()), dtype=np.int64), bars)[keep]
+        for position, name in enumerate(PRICE_COLUMNS + ('Volume',)):
+            columns[name] = stacked[keep, position]
+
+        columns['id'] = self.fact_row_ids(columns)
+        return FactBatch(model=Facts_Indicators, columns=columns)
+
+    @staticmethod
+    def series_ohlcv(series: dict) -> np.ndarray:
+        """
+        :param series: output of read_clean_series
+        :return: (bars, 5) float64 matrix in Indicator_Kernels ohlcv order
+        """
+        return np.column_stack([series[name] for name in PRICE_COLUMNS + ('Volume',)]).astype(np.float64)
+
+    def run_kernel(self, name: str, parameters: tuple, ohlcv: np.ndarray) -> dict:
+        """
+        Run one batch kernel and add its time to the indicator throughput.
+        :return: line -> (bars, 5) np.ndarray
+        """
+        start = time.perf_counter()
+        values = INDICATOR_KERNELS[name][0](ohlcv, *parameters)
+        self.add_throughput(name, ohlcv.shape[0], time.perf_counter() - start)
+        return values
+
+    def add_throughput(self, name: str, bars: int, seconds: float) -> None:
+        stats = self.throughput.setdefault(name, {'bars': 0, 'seconds': 0.0})
+        stats['bars'] += bars
+        stats['seconds'] += seconds
+
+    def populate_instrument_indicators(self, instrument_key: int, granularity_key: int, price_type_key: int,
+                                       indicator_keys: dict) -> bool:
+        """
+        Read one clean series and compute, then load, every configured indicator from its arrays.
+        :param indicator_keys: output of ensure_indicator_dimensions
+        :return: True if successful
+        """
+        series = self.read_clean_series(instrument_key, granularity_key, price_type_key)
+        bars = series['DateTimeKey'].size
+        if bars == 0:
+            return True
+
+        ohlcv = self.series_ohlcv(series)
+
+        result = True
+        for name, parameter_sets in indicator_keys.items():
+            for parameters, lines in parameter_sets:
+                values = self.run_kernel(name, parameters, ohlcv)
+                batch = self.indicator_batch(series, granularity_key, instrument_key, lines, values)
+                result = self.postgres_interface.copy_fact_batch(batch, on_conflict='update') is not False and result
+
+        self.logger.debug(f"populate_instrument_indicators -> InstrumentKey {instrument_key}: {len(indicator_keys)} indicators over {bars} bars")
+        return result
+
+    def dimension_keys(self, caller: str):
+        """
+        :param caller: method name reported on error
+        :return: (GranularityKey, PriceTypeKey) of this granularity and price type, None if the dimensions are missing
+        """
+        granularity_key = self.dimensions.get_key('granularity', self.granularity)
+        price_type_key = self.dimensions.get_key('price_type', self.price_type)
+        if granularity_key is None or price_type_key is None:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: {caller} -> {self.granularity} {self.price_type} missing from the Trading dimensions"))
+            return None
+
+        return granularity_key, price_type_key
+
+    def series_keys(self, caller: str):
+        """
+        :param caller: method name reported on error
+        :return: (GranularityKey, PriceTypeKey, InstrumentKeys held in Facts_CleanInstrument), None if the dimensions are missing
+        """
+        keys = self.dimension_keys(caller)
+        if keys is None:
+            return None
+
+        with self.postgres_interface.connect_session() as session:
+            instrument_keys = session.execute(
+                select(distinct(Facts_CleanInstrument.InstrumentKey))
+                .where(Facts_CleanInstrument.GranularityKey == keys[0],
+                       Facts_CleanInstrument.PriceTypeKey == keys[1])).scalars().all()
+
+        return keys + (instrument_keys,)
+
+    def populate_all_indicator_data(self) -> bool:
+        """
+        Compute every configured indicator for every instrument held in Facts_CleanInstrument at this granularity.
+        :return: True if successful
+        """
+        result = False
+        try:
+            if not self.ErrorsDetected:
+                indicator_keys = self.ensure_indicator_dimensions(self.configured_indicators())
+                keys = self.series_keys('populate_all_indicator_data')
+                if keys is None:
+                    return result
+
+                granularity_key, price_type_key, instrument_keys = keys
+                result = True
+                for instrument_key in instrument_keys:
+                    result = self.populate_instrument_indicators(instrument_key, granularity_key, price_type_key, indicator_keys) and result
+
+                self.log_throughput()
+                result = result and not self.ErrorsDetected
+
+            else:
+                self.print_all_errors()
+
+        except Exception as err_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: populate_all_indicator_data -> {err_}\n{traceback.format_exc()}"))
+
+        return result
+
+    def read_clean_panel(self, granularity_key: int, price_type_key: int):
+        """
+        Load every instrument of Facts_CleanInstrument at this granularity and price type into one shared panel.
+        The series are the ones populate_all_indicator_data reads, so both modes write the same values
+        under the same IndicatorKeys.
+        :return: PricePanel, None when the table holds no bars
+        """
+        names = ['InstrumentKey', 'DateTimeKey', 'DateKey', 'TimeKey'] + list(PANEL_FIELDS)
+        batches = list(self.postgres_interface.stream_model(Facts_CleanInstrument,
+                                                            columns=names,
+                                                            granularity_keys=[granularity_key],
+                                                            where=(Facts_CleanInstrument.PriceTypeKey == price_type_key,)))
+        if not batches:
+            return None
+
+        return PricePanel.from_columns({name: np.concatenate([batch[name] for batch in batches]) for name in names})
+
+    def populate_panel_indicator_data(self) -> bool:
+        """
+        Parallel execution mode over the instruments x indicator parameter sets grid.
+        Clean prices are read once into a shared memory PricePanel, worker processes attach to it and compute
+        one grid cell each, the results are loaded into Facts_Indicators as they complete.
+        The time axis is the union of every instrument's bars, each cell only sees the bars of its instrument,
+        so the lines equal those of populate_all_indicator_data.
+        :return: True if successful
+        """
+        result = False
+        panel = None
+        try:
+            if not self.ErrorsDetected:
+                indicator_keys = self.ensure_indicator_dimensions(self.configured_indicators())
+                keys = self.dimension_keys('populate_panel_indicator_data')
+                if keys is None:
+                    return result
+
+                granularity_key, price_type_key = keys
+                panel = self.read_clean_panel(granularity_key, price_type_key)
+                if panel is None:
+                    return True
+
+                self.logger.debug(f"populate_panel_indicator_data -> panel {panel.shape}, {panel.values.nbytes / 2 ** 20:.1f} MB shared")
+                lines = {(name, parameters): keys for name, parameter_sets in indicator_keys.items() for parameters, keys in parameter_sets}
+                workers = self.config.getint('system', 'indicator_workers', fallback=0) or os.cpu_count()
+
+                result = True
+                with ProcessPoolExecutor(max_workers=workers, initializer=attach_panel, initargs=panel.descriptor) as pool:
+                    cells = [pool.submit(compute_panel_slice, instrument_index, name, parameters)
+                             for instrument_index in range(panel.shape[0]) for name, parameters in lines]
+
+                    for cell in as_completed(cells):
+                        instrument_index, name, parameters, rows, values, seconds = cell.result()
+                        self.add_throughput(name, rows.size, seconds)
+                        batch = self.indicator_batch(panel.series(rows), granularity_key, int(panel.instrument_keys[instrument_index]),
+                                                     lines[(name, parameters)], values)
+                        result = self.postgres_interface.copy_fact_batch(batch, on_conflict='update') is not False and result
+
+                self.log_throughput()
+                result = result and not self.ErrorsDetected
+
+            else:
+                self.print_all_errors()
+
+        except Exception as err_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: populate_panel_indicator_data -> {err_}\n{traceback.format_exc()}"))
+
+        finally:
+            if panel is not None:
+                panel.release()
+
+        return result
+
+    def load_checkpoints(self, instrument_key: int, granularity_key: int) -> dict:
+        """
+        :return: dict of IndicatorKey -> (DateTimeKey, State) of the State_Indicators rows of one series
+        """
+        with self.postgres_interface.connect_session() as session:
+            rows = session.execute(select(State_Indicators.IndicatorKey, State_Indicators.DateTimeKey, State_Indicators.State)
+                                   .where(State_Indicators.InstrumentKey == instrument_key,
+                                          State_Indicators.GranularityKey == granularity_key)).all()
+
+        return {row.IndicatorKey: (row.DateTimeKey, row.State) for row in rows}
+
+    def save_checkpoints(self, instrument_key: int, granularity_key: int, checkpoints: dict) -> None:
+        """
+        Replace the State_Indicators rows of the given parameter sets in one transaction.
+        :param checkpoints: dict of IndicatorKey -> (DateTimeKey, State)
+        """
+        if not checkpoints:
+            return
+
+        with self.postgres_interface.connect_session() as session:
+            session.execute(delete(State_Indicators.__table__)
+                            .where(State_Indicators.InstrumentKey == instrument_key,
+                                   State_Indicators.GranularityKey == granularity_key,
+                                   State_Indicators.IndicatorKey.in_([int(key) for key in checkpoints])))
+            session.execute(insert(State_Indicators.__table__),
+                            [{'InstrumentKey': int(instrument_key), 'GranularityKey': int(granularity_key), 'IndicatorKey': int(key),
+                              'DateTimeKey': int(datetime_key), 'State': state}
+                             for key, (datetime_key, state) in checkpoints.items()])
+            session.commit()
+
+    def update_instrument_streams(self, instrument_key: int, granularity_key: int, price_type_key: int,
+                                  indicator_keys: dict) -> bool:
+        """
+        Bring every configured indicator of one series up to its last Facts_CleanInstrument bar with O(1) work per new bar.
+        A parameter set without a checkpoint is computed with the batch kernel over the whole series and its stream
+        is warmed from the same arrays, a checkpointed one only reads and updates the bars after its checkpoint.
+        :param indicator_keys: output of ensure_indicator_dimensions
+        :return: True if successful
+        """
+        checkpoints = self.load_checkpoints(instrument_key, granularity_key)
+
+        streams = []
+        for name, parameter_sets in indicator_keys.items():
+            for parameters, lines in parameter_sets:
+                stream = INDICATOR_STREAMS[name](*parameters)
+                state_key = next(iter(lines.values()))
+                datetime_key = None
+                if state_key in checkpoints:
+                    datetime_key, state = checkpoints[state_key]
+                    stream.loads(state)
+                streams.append((name, lines, state_key, stream, datetime_key))
+
+        resumed = [datetime_key for name, lines, state_key, stream, datetime_key in streams if datetime_key is not None]
+        after_datetime = None if len(resumed) < len(streams) else min(resumed)
+        series = self.read_clean_series(instrument_key, granularity_key, price_type_key, after_datetime)
+        if series['DateTimeKey'].size == 0:
+            return True
+
+        ohlcv = self.series_ohlcv(series)
+        last_datetime = int(series['DateTimeKey'][-1])
+
+        result = True
+        saved = {}
+        for name, lines, state_key, stream, datetime_key in streams:
+            if datetime_key is None:
+                values = self.run_kernel(name, stream.parameters, ohlcv)
+                stream.warm(ohlcv)
+                new_series = series
+            else:
+                first = int(np.searchsorted(series['DateTimeKey'], datetime_key, side='right'))
+                if first == series['DateTimeKey'].size:
+                    continue
+
+                start = time.perf_counter()
+                rows = [stream.update(bar) for bar in ohlcv[first:]]
+                self.add_throughput(name, len(rows), time.perf_counter() - start)
+                values = {line: np.vstack([row[line] for row in rows]) for line in lines}
+                new_series = {column: values_[first:] for column, values_ in series.items()}
+
+            batch = self.indicator_batch(new_series, granularity_key, instrument_key, lines, values)
+            result = self.postgres_interface.copy_fact_batch(batch, on_conflict='update') is not False and result
+            saved[state_key] = (last_datetime, stream.dumps())
+
+        if result:
+            self.save_checkpoints(instrument_key, granularity_key, saved)
+
+        self.logger.debug(f"update_instrument_streams -> InstrumentKey {instrument_key}: {len(saved)} streams up to {last_datetime}")
+        return result
+
+    def update_all_indicator_streams(self) -> bool:
+        """
+        Incremental counterpart of populate_all_indicator_data, resumes every stream from its State_Indicators checkpoint.
+        :return: True if successful
+        """
+        result = False
+        try:
+            if not self.ErrorsDetected:
+                indicator_keys = self.ensure_indicator_dimensions(self.configured_indicators())
+                keys = self.series_keys('update_all_indicator_streams')
+                if keys is None:
+                    return result
+
+                granularity_key, price_type_key, instrument_keys = keys
+                result = True
+                for instrument_key in instrument_keys:
+                    result = self.update_instrument_streams(instrument_key, granularity_key, price_type_key, indicator_keys) and result
+
+                self.log_throughput()
+                result = result and not self.ErrorsDetected
+
+            else:
+                self.print_all_errors()
+
+        except Exception as err_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: update_all_indicator_streams -> {err_}\n{traceback.format_exc()}"))
+
+        return result
+
+    def log_throughput(self) -> None:
+        """
+        Log the kernel throughput of each indicator in bars per second.
+        :return:
+        """
+        for name, stats in self.throughput.items():
+            self.logger.info(f"indicator throughput -> {name}: {stats['bars']} bars in {stats['seconds']:.2f}s "
+                             f"({stats['bars'] / max(stats['seconds'], 1e-9):,.0f} bars/sec)")
+
+
+if __name__ == '__main__':
+    from CORE.Config_Manager import ConfigManager
+    from Logger import log_maker
+
+    logs = log_maker('PopulateIndicators', '../../configs.ini')
+    cm = ConfigManager(logs, '../../configs.ini')
+    sql = PostgreSQLInterface(cm.create_config(), logs)
+    indicators = Indicators(cm.create_config(), sql, logs, 'D')
+    if cm.create_config().getboolean('system', 'indicators_from_panel', fallback=False):
+        indicators.populate_panel_indicator_data()
+    else:
+        indicators.populate_all_indicator_data()
@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from DAL.Trading.Calendar import index_to_datetime64, datetime64_to_keys
+from DAL.Trading.Fact_Batches import PRICE_COLUMNS, FactBatch, FactBatchBuilder
+from DAL.Trading.Gap_Fill import GAP_FILL_KERNELS, fill_gaps
+from DAL.Trading.Granularity_Detection import detect_granularity
+from DOL.Trading.Facts.Facts_CleanInstruments import Facts_CleanInstrument
+from DOL.Trading.Facts.Facts_Instruments import Facts_Instruments
+
+BUILDER = FactBatchBuilder()
+
+
+@dataclass(frozen=True)
+class PrepareSettings:
+    """
+    Configuration read by the preparation of a frame, sent to worker processes instead of the Instruments instance.
+    """
+    granularity: str            # target OANDA granularity name
+    nulls_method: str           # name in GAP_FILL_KERNELS
+    min_confidence: float = 0.0
+    min_samples: int = 1
+    max_gap_bars: int = 0
+    poly_order: int = 3
+    poly_window: int = 8
+
+
+def gap_fill_batch(raw: FactBatch, seconds: np.ndarray, settings: PrepareSettings, instrument: str) -> tuple:
+    """
+    Gap fill a prepared raw batch into the Facts_CleanInstrument batch.
+    Observed bars reuse the keys and ids of the raw batch, only the generated bars derive new ones.
+    :param raw: FactBatch of the observed bars
+    :param seconds: bar start of every raw row in seconds since the epoch
+    :param settings: PrepareSettings, nulls_method has to be a GAP_FILL_KERNELS name
+    :param instrument: Name of the target instrument
+    :return: (FactBatch for Facts_CleanInstrument, GapReport of the batch)
+    """
+    # Only bars inside market hours are generated, long outages are left open
+    seconds, columns, source, report = fill_gaps(
+        seconds,
+        {name: raw.columns[name] for name in PRICE_COLUMNS + ('Volume',)},
+        settings.granularity,
+        settings.nulls_method,
+        max_gap_bars=settings.max_gap_bars,
+        poly_order=settings.poly_order,
+        poly_window=settings.poly_window,
+        instrument=instrument)
+
+    observed = source >= 0
+    generated = ~observed
+    datetime_keys, date_keys, time_keys = datetime64_to_keys(seconds[generated].astype('datetime64[s]'))
+    new_keys = {'DateTimeKey': datetime_keys, 'DateKey': date_keys, 'TimeKey': time_keys}
+    for name in ('GranularityKey', 'InstrumentKey', 'PriceTypeKey'):
+        new_keys[name] = np.full(datetime_keys.size, raw.columns[name][0], dtype=np.int64)
+    new_keys['id'] = BUILDER.fact_row_ids(new_keys)
+
+    for name, values in new_keys.items():
+        column = np.empty(seconds.size, dtype=np.int64)
+        column[observed] = raw.columns[name][source[observed]]
+        column[generated] = values
+        columns[name] = column
+
+    columns['Volume'] = np.nan_to_num(columns['Volume'], nan=0.0).astype(np.int64)
+    return FactBatch(model=Facts_CleanInstrument, columns=columns), report
+
+
+def prepare_instrument_frame(df: pd.DataFrame, instrument: str, keys: tuple, settings: PrepareSettings) -> dict:
+    """
+    CPU bound preparation of the raw and clean fact batches of one frame. Module level and free of database
+    access, so a process pool only pickles the frame, the dimension keys and the settings.
+    :param df: A pd.DataFrame of OHLCV data with datetime index
+    :param instrument: Name of the target instrument
+    :param keys: (GranularityKey, InstrumentKey, PriceTypeKey) resolved by the caller
+    :param settings: PrepareSettings
+    :return: dict of raw and clean FactBatch (False when not prepared), the GranularityDetection,
+             the GapReport of the clean batch and the error messages raised while preparing
+    """
+    payload = {'raw': False, 'clean': False, 'detection': None, 'gaps': None, 'errors': []}
+
+    if df.shape[0] == 0:
+        payload['errors'].append(f"prepare_instrument_frame -> {instrument} No Data to prepare")
+        return payload
+
+    # Bar times and granularity are derived once and shared by the raw and clean preparation
+    seconds = index_to_datetime64(df.index).astype('datetime64[s]').astype(np.int64)
+    detection = payload['detection'] = detect_granularity(seconds)
+
+    if not detection.matches(settings.granularity, settings.min_confidence, settings.min_samples):
+        payload['errors'].append(f"prepare_instrument_frame -> {instrument} Granularity '{detection}' "
+                                 f"Does not match target '{settings.granularity}'")
+        return payload
+
+    payload['raw'] = BUILDER.build_fact_batch(Facts_Instruments,
+                                              *datetime64_to_keys(seconds.astype('datetime64[s]')),
+                                              *keys,
+                                              df)
+
+    # Clean version with no NA values, gap filled from the raw batch so observed bars keep their keys and ids
+    if settings.nulls_method not in GAP_FILL_KERNELS:
+        payload['errors'].append(f"prepare_instrument_frame -> {instrument} unknown fill method '{settings.nulls_method}', "
+                                 f"use one of {list(GAP_FILL_KERNELS)}")
+    elif len(payload['raw']) > 0:
+        payload['clean'], payload['gaps'] = gap_fill_batch(payload['raw'], seconds, settings, instrument)
+
+    return payload
@@ -1,30 +1,38 @@
 import configparser
 import glob
-import json
+import os
+import threading
 import traceback
 from logging import Logger
 
-from sqlalchemy import select
-from tqdm import tqdm
-from DOL.Trading.Dimensions.Dimension_Granularity import Dimension_Granularity
-from DOL.Trading.Dimensions.Dimension_Instruments import Dimension_Instruments
-from DOL.Trading.Dimensions.Dimension_PriceType import Dimension_PriceType
-from DOL.Trading.Facts.Facts_CleanInstruments import Facts_CleanInstrument
+from sqlalchemy import select, func, insert, and_, or_, tuple_
+from DOL.Trading.Dimensions.Dimension_Date import Dimension_Date
+from DOL.Trading.Dimensions.Dimension_Time import Dimension_Time
 from DOL.Trading.Facts.Facts_InstrumentsDataAligned import Facts_InstrumentsDataAligned
+from DOL.Trading.Schema_Bootstrap import SchemaBootstrap
 from CORE.Postgres_Interface import PostgreSQLInterface
 from CORE.Sqlite_Interface import SqliteInterface
 from CORE.Oanda_Interface import OandaInterface
+from CORE.Oanda_Candle_Fetcher import OandaCandleFetcher
+from CORE.Candle_Cache import CandleCache
 from CORE.Tools import Tools
-from Features.Date_Time_Factory import DateTimeFactory
-from concurrent.futures import ThreadPoolExecutor
+from DAL.Trading.Dimension_Cache import DimensionCache
+from DAL.Trading.Calendar import granularity_timedelta, datetime_key_to_timestamp, timestamp_to_datetime_key, index_to_datetime64, \
+    date_dimension, time_dimension
+from DAL.Trading.Fact_Batches import FACT_COLUMNS, PRICE_COLUMNS, FactBatch, FactBatchBuilder
+from DAL.Trading.Instrument_Preparation import PrepareSettings, prepare_instrument_frame
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 from DOL.Trading.Facts.Facts_Instruments import Facts_Instruments
 import pandas as pd
 import numpy as np
 
+# Working set of prepare_instrument_payload per source bar: the raw and clean FactBatch plus the float
+# working copies of the OHLCV columns made while gap filling
+PREPARE_ROW_BYTES: int = 2 * len(FACT_COLUMNS) * 8 + 2 * (len(PRICE_COLUMNS) + 1) * 8
 
 
-class Instruments(SqliteInterface, DateTimeFactory, Tools):
+class Instruments(SqliteInterface, Tools, FactBatchBuilder):
     def __init__(self,
                  config_object: configparser.ConfigParser,
                  postgres_interface: PostgreSQLInterface,
@@ -47,6 +55,15 @@ class Instruments(SqliteInterface, DateTimeFactory, Tools):
         # Inject other class objects for use throughout class
         self.oanda_interface = oanda_interface
         self.postgres_interface = postgres_interface
+        self.candle_fetcher = OandaCandleFetcher(self.config, self.logger) \
+            if self.config.getboolean('oanda', 'async_candle_fetcher', fallback=False) else None
+        self.candle_cache = None
+        if self.config.getboolean('system', 'candle_cache_enabled', fallback=False):
+            # The cache asks for single months, the plain broker interface always downloads the whole history
+            if self.candle_fetcher is not None:
+                self.candle_cache = CandleCache(self.config, self.logger)
+            else:
+                self.logger.warning("__init__ -> candle_cache_enabled needs [oanda] async_candle_fetcher, the cache is not used")
 
         # Generate all instrument imports from csv files found import
         self.instruments_imports: list = [i.split('/')[-1].replace('.csv', '') for i in glob.glob(f"{self.import_path_name}/*.csv")]
@@ -55,36 +72,127 @@ class Instruments(SqliteInterface, DateTimeFactory, Tools):
         self.db_string_staging: str = self.config.get('system', 'db_staging_string')
         self.hide_progress_bar: bool = self.config.getboolean('system', 'hide_progress_bar')
 
-        # Fetch label data
-        with self.postgres_interface.connect_session() as session:
-            granularity_stmt = select(Dimension_Granularity)
-            self.granularity_dim = pd.DataFrame([row[0] for row in session.execute(granularity_stmt)])
+        # Incremental imports only prepare bars after the latest DateTimeKey already stored
+        self.incremental_import: bool = self.config.getboolean('system', 'incremental_import', fallback=False)
+        self.incremental_overlap_bars: int = self.config.getint('system', 'incremental_overlap_bars', fallback=0)
+        self.watermarks: dict = None
+
+        # Rows per chunk when streaming .csv imports, 0 reads each file at once
+        self.import_chunk_rows: int = self.config.getint('system', 'import_chunk_rows', fallback=0)
+
+        # Source bars prepared in one piece, larger frames are prepared and loaded in slices, 0 never slices
+        self.prepare_budget_rows: int = self.config.getint('system', 'prepare_memory_mb', fallback=0) * 2 ** 20 // PREPARE_ROW_BYTES
+
+        # Frames with at least granularity_sample_amount bar distances are rejected below granularity_min_confidence
+        self.granularity_sample_amount: int = self.config.getint('system', 'granularity_sample_amount', fallback=1)
+        self.granularity_min_confidence: float = self.config.getfloat('system', 'granularity_min_confidence', fallback=0.0)
 
-            instrument_stmt = select(Dimension_Instruments)
-            self.instrument_dim = pd.DataFrame([row[0] for row in session.execute(instrument_stmt)])
+        # Label data is looked up in the process wide dimension cache, loaded on first use
+        self.dimensions = DimensionCache.shared(self.postgres_interface, self.logger)
 
-            price_stmt = select(Dimension_PriceType)
-            self.price_type_dim = pd.DataFrame([row[0] for row in session.execute(price_stmt)])
-            session.close()
+        # Instrument name -> GapReport of the clean series, summed over every batch loaded
+        self.gap_reports: dict = {}
+        # Payloads are loaded on the I/O pool, several slices of one instrument can finish together
+        self.gap_reports_lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        """
+        Drop the database, broker and cache interfaces when the instance is sent to a preparation process.
+        :return: picklable instance state
+        """
+        state = super().__getstate__()
+        state['postgres_interface'] = None
+        state['oanda_interface'] = None
+        state['candle_fetcher'] = None
+        state['candle_cache'] = None
+        state.pop('gap_reports_lock', None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self.gap_reports_lock = threading.Lock()
 
     def populate_all_instrument_data(self) -> bool:
         """
-        Concurrently run the instrument import procedures
+        Concurrently run the instrument import procedures.
+        Fetching and loading run on a thread pool, the CPU bound preparation runs on a process pool
+        when [system] prepare_in_processes is set.
         :return:
         """
         result = False
         try:
             if not self.ErrorsDetected:
                 self.logger.debug("populate_all_instrument_data -> Starting Instrument Populater Map...")
-                with ThreadPoolExecutor() as executor:
-                    executor.map(self.instrument_from_imports, self.instruments_imports)
-                    executor.map(self.instrument_from_oanda, self.oanda_instruments)
+                if self.incremental_import:
+                    self.watermarks = self.get_watermarks()
+
+                # Tables, natural key indexes and partitions are in place before anything is loaded
+                if self.config.getboolean('system', 'bootstrap_schema', fallback=False):
+                    SchemaBootstrap(self.config, self.postgres_interface, self.logger).bootstrap()
+
+                # Calendar dimensions have to hold every DateKey / TimeKey before facts reference them
+                if self.config.getboolean('system', 'populate_calendar_dimensions', fallback=False):
+                    self.populate_calendar_dimensions()
+
+                # Worker processes get a copy of the warm cache, they cannot reach the database
+                self.dimensions.load_all()
+
+                use_processes: bool = self.config.getboolean('system', 'prepare_in_processes', fallback=False)
+                fetch_workers: int = self.config.getint('system', 'fetch_workers', fallback=0) or None
+                prepare_workers: int = self.config.getint('system', 'prepare_workers', fallback=0) or os.cpu_count()
+                prepare_pool_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+                with ThreadPoolExecutor(max_workers=fetch_workers) as io_pool, \
+                        prepare_pool_type(max_workers=prepare_workers) as prepare_pool:
+
+                    # Streamed imports stage, prepare and load chunk by chunk on their own thread
+                    streams = {}
+                    fetches = {}
+                    for instrument in self.instruments_imports:
+                        if instrument.isspace():
+                            continue
+                        elif self.import_chunk_rows > 0:
+                            streams[io_pool.submit(self.instrument_from_imports, instrument, prepare_pool)] = instrument
+                        else:
+                            fetches[io_pool.submit(self.fetch_instrument_import, instrument)] = instrument
+
+                    fetches.update({io_pool.submit(self.fetch_instrument_oanda, instrument): instrument
+                                    for instrument in self.oanda_instruments if not instrument.isspace()})
+
+                    # Hand every fetched frame to the preparation pool as soon as it arrives, sliced to the memory budget.
+                    # Workers get the frame, the resolved dimension keys and the settings, never this instance
+                    settings = self.preparation_settings()
+                    prepares = {}
+                    for future in as_completed(fetches):
+                        fetched = self.collect_future(future, fetches[future], 'fetch')
+                        keys = self.dimension_keys(fetches[future], 'M', self.granularity) if fetched is not False else None
+                        if keys is not None and fetched[0].shape[0] > 0:
+                            frame, on_conflict = fetched
+                            for frame_slice in self.budget_slices(frame):
+                                prepares[prepare_pool.submit(prepare_instrument_frame, frame_slice, fetches[future], keys, settings)] = \
+                                    (fetches[future], on_conflict)
+
+                    loads = {}
+                    for future in as_completed(prepares):
+                        instrument, on_conflict = prepares[future]
+                        payload = self.collect_future(future, instrument, 'prepare')
+                        if payload is not False:
+                            self.record_payload(payload, instrument)
+                            loads[io_pool.submit(self.load_instrument_payload, instrument, payload, on_conflict)] = instrument
+
+                    for future in as_completed(loads):
+                        self.collect_future(future, loads[future], 'load')
+
+                    for future in as_completed(streams):
+                        self.collect_future(future, streams[future], 'stream')
+
+                for report in self.gap_reports.values():
+                    self.logger.info(f"populate_all_instrument_data -> gaps {report}")
 
                 # Align to the common minimum of the DateTimeKey Found in the database
-                with self.postgres_interface.connect_session() as session:
-                    session.bulk_save_objects(self.align_data_instruments())
-                    session.commit()
-                    session.close()
+                aligned = self.align_data_instruments()
+                if aligned is not False:
+                    self.load_aligned_data(*aligned)
 
                 if not self.ErrorsDetected:
                     result = True
@@ -98,6 +206,47 @@ class Instruments(SqliteInterface, DateTimeFactory, Tools):
 
         return result
 
+    def populate_calendar_dimensions(self, start=None, end=None) -> bool:
+        """
+        Bulk generate the Dimension_Date and Dimension_Time rows that are not stored yet, in one pass each.
+        :param start: first date, defaults to [system] start_date
+        :param end: last date, defaults to a year from now
+        :return: True if successful
+        """
+        start = pd.Timestamp(start if start is not None else self.config.get('system', 'start_date'))
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp.now('UTC').tz_localize(None) + pd.DateOffset(years=1)
+
+        for model, key, frame in ((Dimension_Date, 'DateKey', date_dimension(start, end)),
+                                  (Dimension_Time, 'TimeKey', time_dimension())):
+            stored = [batch[key] for batch in self.postgres_interface.stream_model(model, columns=[key])]
+            if stored:
+                frame = frame[~np.isin(frame[key].values, np.concatenate(stored))]
+
+            if frame.shape[0] > 0:
+                self.logger.debug(f"populate_calendar_dimensions -> adding {frame.shape[0]} rows to {model.__tablename__}")
+                with self.postgres_interface.connect_session() as session:
+                    session.execute(insert(model.__table__), frame.to_dict('records'))
+                    session.commit()
+
+        return not self.postgres_interface.ErrorsDetected
+
+    def collect_future(self, future, instrument: str, stage: str):
+        """
+        Return a worker result, recording the worker exception instead of losing it.
+        :param future: completed future
+        :param instrument: instrument the future worked on
+        :param stage: fetch, prepare or load
+        :return: the future result, False if the worker raised
+        """
+        try:
+            return future.result()
+
+        except Exception as err_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: populate_all_instrument_data -> {stage} failed for {instrument}: {err_}\n{traceback.format_exc()}"))
+            return False
+
     def instrument_from_oanda(self, instrument):
         """
         This will import the target instrument from oanda concurrently in the required chunks 
@@ -106,95 +255,149 @@ class Instruments(SqliteInterface, DateTimeFactory, Tools):
         result = False
         if not self.ErrorsDetected:
             if not instrument.isspace():
-                self.logger.debug(f"instrument_from_oanda -> Importing Data for {instrument}...")
+                fetched = self.fetch_instrument_oanda(instrument)
+
+                if fetched is not False:
+                    oanda_instrument_data, on_conflict = fetched
+                    if oanda_instrument_data.shape[0] > 0:
+                        result = self.load_instrument_payload(instrument,
+                                                              self.prepare_instrument_payload(oanda_instrument_data, instrument),
+                                                              on_conflict)
+                    else:
+                        result = True
+
+            else:
+                self.logger.warning('instrument_from_oanda -> Instrument name string is blank, passing ...')
+                pass
+        else:
+            self.print_all_errors()
+
+        return result
 
-                oanda_instrument_data = self.oanda_interface.get_historical_candles(instrument, 'M')
+    def fetch_instrument_oanda(self, instrument: str):
+        """
+        Download the candles of an instrument from oanda, trimmed to the incremental window.
+        :param instrument: str name of instrument on OANDA XXX_XXX
+        :return: (pd.DataFrame, on_conflict), an empty frame when the instrument is up to date, False on error
+        """
+        result = False
+        self.logger.debug(f"instrument_from_oanda -> Importing Data for {instrument}...")
 
-                if oanda_instrument_data.shape[0] > 0:
-                    # Prepare the data for entry into the database
-                    fact_instrument = self.prepare_data_instrument(oanda_instrument_data,
-                                                                   instrument)
+        incremental_start = self.incremental_start(instrument, 'M') if self.incremental_import else None
 
-                    fact_clean_instrument = self.fillna_data_instruments(oanda_instrument_data,
-                                                                         instrument,
-                                                                         self.config.get('system', 'fill_missing_values'))
+        if self.candle_cache is not None:
+            # Serve from the local candle cache, the broker is only asked for the missing ranges
+            oanda_instrument_data = self.candle_cache.get_candles(
+                instrument, self.granularity, 'M',
+                incremental_start if incremental_start is not None else pd.Timestamp(self.config.get('system', 'start_date')),
+                pd.Timestamp.now('UTC').tz_localize(None).floor('s'),
+                lambda start, end: self.fetch_oanda_range(instrument, start, end))
+        else:
+            oanda_instrument_data = self.fetch_oanda_range(instrument, incremental_start)
 
-                    # Check that buckets off data have information
-                    if fact_instrument is not False and fact_clean_instrument is not False:
-                        with self.postgres_interface.connect_session() as session:
+        if oanda_instrument_data is False or oanda_instrument_data is None:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: instrument_from_oanda -> Oanda fetch failed for {instrument}"))
 
-                            session.bulk_save_objects(fact_instrument)
-                            session.bulk_save_objects(fact_clean_instrument)
-                            session.commit()
-                            session.close()
+        elif oanda_instrument_data.shape[0] > 0:
+            # Only keep bars from the watermark minus the overlap window for revised bars
+            if incremental_start is not None:
+                oanda_instrument_data = oanda_instrument_data[
+                    index_to_datetime64(oanda_instrument_data.index) >= np.datetime64(incremental_start)]
 
-                        result = True
+                if oanda_instrument_data.shape[0] == 0:
+                    self.logger.debug(f"instrument_from_oanda -> {instrument} is up to date")
 
-                    else:
-                        self.ErrorsDetected = True
-                        self.ErrorList.append(self.error_details(
-                            f"{__class__}: instrument_from_imports -> List of Facts Objects is empty or with error for {instrument}"))
+            # Overlapping bars may have been revised by the broker, so they overwrite the stored rows
+            result = (oanda_instrument_data, 'update' if incremental_start is not None else 'nothing')
 
-                else:
-                    self.ErrorsDetected = True
-                    self.ErrorList.append(self.error_details(
-                        f"{__class__}: instrument_from_oanda -> Oanda DataFrame Empty For {instrument}"))
+        elif incremental_start is not None:
+            self.logger.debug(f"instrument_from_oanda -> {instrument} is up to date")
+            result = (oanda_instrument_data, 'update')
 
-            else:
-                self.logger.warning('instrument_from_oanda -> Instrument name string is blank, passing ...')
-                pass
         else:
-            self.print_all_errors()
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: instrument_from_oanda -> Oanda DataFrame Empty For {instrument}"))
 
         return result
 
-    def instrument_from_imports(self, instrument: str) -> bool:
+    def fetch_oanda_range(self, instrument: str, start: pd.Timestamp = None, end: pd.Timestamp = None) -> pd.DataFrame:
         """
-        Any OHLCV data that is in .csv files will be imported as the file name.
-        :param instrument: str name of file
-        :return: True of successful
+        Download candles from the broker, only the requested range when the async candle fetcher is enabled.
+        :param instrument: str name of instrument on OANDA XXX_XXX
+        :param start: first bar, None for the full history
+        :param end: last bar, None for up to now
+        :return: pd.DataFrame of OHLCV, False when the fetch failed
         """
-        result: bool = False
-        if not self.ErrorsDetected:
-            if not instrument.isspace():
-                self.logger.debug(f"instrument_from_imports -> Importing local files for {instrument}...")
+        if self.candle_fetcher is not None:
+            return self.candle_fetcher.get_historical_candles(instrument, self.granularity, 'M', start, end)
 
-                # check Imports Folder for CSV's of Instruments
-                # import into imported instrument object
-                raw_import_instrument = self.csv_to_table(f"{self.import_path_name}/{instrument}.csv",
-                                                          self.db_string_staging,
-                                                          f"{instrument}_Raw", True, 'Date')
+        return self.oanda_interface.get_historical_candles(instrument, 'M')
 
-                if raw_import_instrument.shape[0] > 0:
-                    # Prepare the data for entry into the database
-                    fact_instrument = self.prepare_data_instrument(raw_import_instrument,
-                                                                   instrument)
-
-                    # Create clean version with no NA values
-                    fact_clean_instrument = self.fillna_data_instruments(raw_import_instrument,
-                                                                         instrument,
-                                                                         self.config.get('system', 'fill_missing_values'))
+    def get_watermarks(self) -> dict:
+        """
+        Latest DateTimeKey stored in Facts_Instruments for every series.
+        :return: dict of (InstrumentKey, GranularityKey, PriceTypeKey) -> max DateTimeKey
+        """
+        watermarks = {}
+        with self.postgres_interface.connect_session() as session:
+            watermark_stmt = select(Facts_Instruments.InstrumentKey,
+                                    Facts_Instruments.GranularityKey,
+                                    Facts_Instruments.PriceTypeKey,
+                                    func.max(Facts_Instruments.DateTimeKey)).group_by(Facts_Instruments.InstrumentKey,
+                                                                                    Facts_Instruments.GranularityKey,
+                                                                                    Facts_Instruments.PriceTypeKey)
+            for instrument_key, granularity_key, price_type_key, datetime_key in session.execute(watermark_stmt):
+                watermarks[(instrument_key, granularity_key, price_type_key)] = datetime_key
+
+        self.logger.debug(f"get_watermarks -> {len(watermarks)} series found in Facts_Instruments")
+        return watermarks
+
+    def incremental_start(self, instrument_name: str, price_type: str = 'M'):
+        """
+        First bar to import for an instrument, the stored watermark minus the configured overlap.
+        :param instrument_name: Name of the target instrument
+        :param price_type: Price Type Bid, Ask, Mid
+        :return: pd.Timestamp, or None when nothing is stored yet
+        """
+        if self.watermarks is None:
+            self.watermarks = self.get_watermarks()
 
-                    # Check that buckets off data have information
-                    if fact_instrument is not False and fact_clean_instrument is not False:
-                        with self.postgres_interface.connect_session() as session:
+        granularity_key = self.dimensions.get_key('granularity', self.granularity)
+        instrument_key = self.dimensions.get_key('instrument', instrument_name)
+        price_type_key = self.dimensions.get_key('price_type', price_type)
+        if instrument_key is None or granularity_key is None or price_type_key is None:
+            return None
 
-                            session.bulk_save_objects(fact_instrument)
-                            session.bulk_save_objects(fact_clean_instrument)
+        watermark = self.watermarks.get((instrument_key, granularity_key, price_type_key))
+        if watermark is None:
+            return None
 
-                            session.commit()
-                            session.close()
-                            result = True
+        return datetime_key_to_timestamp(watermark) - self.incremental_overlap_bars * granularity_timedelta(self.granularity)
 
-                    else:
-                        self.ErrorsDetected = True
-                        self.ErrorList.append(self.error_details(
-                            f"{__class__}: instrument_from_imports -> List of Facts Objects is empty or with error for {instrument}"))
+    def instrument_from_imports(self, instrument: str, prepare_pool=None) -> bool:
+        """
+        Any OHLCV data that is in .csv files will be imported as the file name.
+        :param instrument: str name of file
+        :param prepare_pool: optional executor the chunk preparation is handed to when streaming
+        :return: True of successful
+        """
+        result: bool = False
+        if not self.ErrorsDetected:
+            if not instrument.isspace():
+                if self.import_chunk_rows > 0:
+                    result = self.stream_instrument_import(instrument, prepare_pool)
 
                 else:
-                    self.ErrorsDetected = True
-                    self.ErrorList.append(self.error_details(
-                        f"{__class__}: instrument_from_imports -> Raw Data Imported is Null for {instrument}"))
+                    fetched = self.fetch_instrument_import(instrument)
+
+                    if fetched is not False:
+                        raw_import_instrument, on_conflict = fetched
+                        result = self.load_instrument_payload(instrument,
+                                                              self.prepare_instrument_payload(raw_import_instrument, instrument),
+                                                              on_conflict)
 
             else:
                 self.logger.warning('instrument_from_imports -> Instrument name string is blank, passing ...')
@@ -205,233 +408,287 @@ class Instruments(SqliteInterface, DateTimeFactory, Tools):
 
         return result
 
-    def prepare_data_instrument(self, df: pd.DataFrame, instrument_name: str, price_type: str = 'M') -> list:
+    def stream_instrument_import(self, instrument: str, prepare_pool=None) -> bool:
         """
-        Create Date Time keys, Granularity Key and Instrument Keys
-        :param df: A pd.DataFrame of OHLCV data with datetime index
-        :param instrument_name: Name of the target instrument
-        :param price_type: Price Type Bid, Ask, Mid
-        :return: list[Facts_Instruments]
+        Stage, prepare and load a .csv file chunk by chunk so memory is bounded by [system] import_chunk_rows.
+        :param instrument: str name of file
+        :param prepare_pool: optional executor the chunk preparation is handed to
+        :return: True if every chunk loaded
+        """
+        result = True
+        chunks = 0
+        previous_tail = None
+        keys = self.dimension_keys(instrument, 'M', self.granularity)
+        if keys is None:
+            return False
+        settings = self.preparation_settings()
+
+        for chunk in self.csv_to_table_chunked(f"{self.import_path_name}/{instrument}.csv",
+                                               self.db_string_staging,
+                                               f"{instrument}_Raw", 'Date', self.import_chunk_rows):
+            # Carry the last bar of the previous chunk so a gap on the chunk boundary is still filled,
+            # the repeated raw bar is skipped on load by its id
+            frame = chunk if previous_tail is None else pd.concat([previous_tail, chunk])
+            previous_tail = chunk.iloc[-1:]
+
+            for frame_slice in self.budget_slices(frame):
+                if prepare_pool is not None:
+                    payload = prepare_pool.submit(prepare_instrument_frame, frame_slice, instrument, keys, settings).result()
+                else:
+                    payload = prepare_instrument_frame(frame_slice, instrument, keys, settings)
+
+                self.record_payload(payload, instrument)
+                result = self.load_instrument_payload(instrument, payload) and result
+            chunks += 1
+
+        if chunks == 0:
+            result = False
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: instrument_from_imports -> Raw Data Imported is Null for {instrument}"))
+
+        self.logger.debug(f"stream_instrument_import -> {instrument} loaded in {chunks} chunks")
+        return result
+
+    def fetch_instrument_import(self, instrument: str):
+        """
+        Stage a .csv file from the import folder and return its data.
+        :param instrument: str name of file
+        :return: (pd.DataFrame, on_conflict), False on error
         """
-        self.logger.debug(f"Starting Instrument data prep for {instrument_name} ...")
         result = False
-        if not self.ErrorsDetected:
-            if df.shape[0] > 0:
-
-                # Generate date time integers
-                ints_dt = self.datetime_to_int(df.index.values)
-
-                dff = pd.DataFrame(df)
-                dff.index = ints_dt
-                dff.index.rename('DateTimeKey', inplace=True)
-
-                # Check incoming date time index for granularity type
-                GranularityName = self.granularity_check(ints_dt,
-                                                         self.config.getint('system',
-                                                                            'granularity_sample_amount'))
-
-                if GranularityName == self.granularity:
-                    dff['GranularityKey'] = self.granularity_dim.query(f"OandaAlias == '{GranularityName}'")['GranularityKey'].values[0]
-                    dff['InstrumentKey'] = self.instrument_dim.query(f"Name == '{instrument_name}'")['InstrumentKey'].values[0]
-                    dff['PriceTypeKey'] = self.price_type_dim.query(f"Alias == '{price_type}'")['PriceTypeKey'].values[0]
-                    dff['DateKey'] = self.date_key_parser(dff.index.values)
-                    dff['TimeKey'] = self.time_key_parser(dff.index.values)
-                    dff = json.loads(dff.reset_index().to_json(orient='records'))
-
-                    result = [Facts_Instruments(
-                        id=self.create_hex_from_string(str(row)),
-                        DateTimeKey=row['DateTimeKey'],
-                        DateKey=row['DateKey'],
-                        TimeKey=row['TimeKey'],
-                        GranularityKey=row['GranularityKey'],
-                        PriceTypeKey=row['PriceTypeKey'],
-                        Open=row['Open'],
-                        High=row['High'],
-                        Low=row['Low'],
-                        Close=row['Close'],
-                        Volume=row['Volume'],
-                        InstrumentKey=row['InstrumentKey']
-
-                    ) for idx, row
-                        in tqdm(enumerate(dff),
-                                total=len(dff),
-                                desc=f"{instrument_name}_{price_type} PREPARATION",
-                                ascii=True,
-                                disable=self.hide_progress_bar)]
+        self.logger.debug(f"instrument_from_imports -> Importing local files for {instrument}...")
 
-                else:
-                    self.ErrorList.append(self.error_details(
-                        f"{__class__}: prepare_data_instrument -> {instrument_name} Granularity '{GranularityName}' Does not match target '{self.granularity}'"))
-                    pass
+        # check Imports Folder for CSV's of Instruments
+        # import into imported instrument object
+        raw_import_instrument = self.csv_to_table(f"{self.import_path_name}/{instrument}.csv",
+                                                  self.db_string_staging,
+                                                  f"{instrument}_Raw", True, 'Date')
 
-            else:
-                self.ErrorsDetected = True
-                self.ErrorList.append(self.error_details(
-                    f"{__class__}: prepare_data_instrument -> {instrument_name} No Data to prepare"))
+        if raw_import_instrument is not False and raw_import_instrument.shape[0] > 0:
+            result = (raw_import_instrument, 'nothing')
 
         else:
-            self.print_all_errors()
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: instrument_from_imports -> Raw Data Imported is Null for {instrument}"))
 
         return result
 
-    def fillna_data_instruments(self, df: pd.DataFrame, instrument_name: str, nulls_method: str = '|', price_type: str = 'M') -> list:
+    def budget_slices(self, frame: pd.DataFrame):
         """
-        fill all NA values
-        :param df:
-        :param instrument_name:
-        :param nulls_method: interpolate_lin, interpolate_poly
-        :param price_type: Price Type Bid, Ask, Mid
-        :return: List of instruments with a complete date time range with missing values solved through target method
+        Split a frame into slices of at most [system] prepare_memory_mb worth of bars.
+        Each slice repeats the last bar of the previous one so a gap on the boundary is still filled,
+        the repeated bar is skipped on load by its id.
+        :param frame: A pd.DataFrame of OHLCV data with datetime index in bar order
+        :return: generator of pd.DataFrame
+        """
+        rows = self.prepare_budget_rows
+        if rows <= 1 or frame.shape[0] <= rows:
+            yield frame
+            return
+
+        for start in range(0, frame.shape[0] - 1, rows - 1):
+            yield frame.iloc[start:start + rows]
+
+    def preparation_settings(self) -> PrepareSettings:
+        """
+        :return: PrepareSettings of this import, read from the configuration
+        """
+        return PrepareSettings(granularity=self.granularity,
+                               nulls_method=self.config.get('system', 'fill_missing_values'),
+                               min_confidence=self.granularity_min_confidence,
+                               min_samples=self.granularity_sample_amount,
+                               max_gap_bars=self.config.getint('system', 'fill_max_gap_bars', fallback=0),
+                               poly_order=self.config.getint('system', 'null_polynomial_order', fallback=3),
+                               poly_window=self.config.getint('system', 'fill_poly_window', fallback=8))
+
+    def prepare_instrument_payload(self, df: pd.DataFrame, instrument: str) -> dict:
+        """
+        Prepare the raw and clean fact batches of a frame in this thread, see prepare_instrument_frame.
+        :param df: A pd.DataFrame of OHLCV data with datetime index
+        :param instrument: Name of the target instrument
+        :return: dict of raw and clean FactBatch, the GapReport and the errors raised while preparing
+        """
+        keys = self.dimension_keys(instrument, 'M', self.granularity)
+        if keys is None:
+            return {'raw': False, 'clean': False, 'detection': None, 'gaps': None, 'errors': []}
+
+        return self.record_payload(prepare_instrument_frame(df, instrument, keys, self.preparation_settings()), instrument)
+
+    def record_payload(self, payload: dict, instrument: str) -> dict:
+        """
+        Record the outcome of prepare_instrument_frame, which may have run in a worker process.
+        Errors raised while preparing are errors of this instance.
+        :param payload: output of prepare_instrument_frame
+        :param instrument: Name of the target instrument
+        :return: payload
+        """
+        if payload['detection'] is not None:
+            self.logger.debug(f"record_payload -> {instrument} granularity {payload['detection']}")
+        if payload['gaps'] is not None:
+            self.logger.debug(f"record_payload -> {payload['gaps']}")
+
+        if payload['errors']:
+            self.ErrorsDetected = True
+            self.ErrorList.extend(self.error_details(f"{__class__}: {message}") for message in payload['errors'])
+
+        return payload
+
+    def load_instrument_payload(self, instrument: str, payload: dict, on_conflict: str = 'nothing') -> bool:
+        """
+        Load the prepared raw and clean fact batches of an instrument.
+        :param instrument: Name of the target instrument
+        :param payload: output of prepare_instrument_payload
+        :param on_conflict: 'nothing' or 'update' for rows already stored
+        :return: True if successful
         """
-        self.logger.debug(f"Starting Instrument Fill NA for {instrument_name} {nulls_method}...")
         result = False
-        if not self.ErrorsDetected:
-            if df.shape[0] > 0:
-                ints_dt = self.datetime_to_int(df.index.values)
-
-                dff: pd.DataFrame = df.copy()
-                dff.index = ints_dt
-                dff.index.rename('DateTimeKey', inplace=True)
-
-                # Check incoming date time index for granularity type
-                GranularityName = self.granularity_check(ints_dt,
-                                                         self.config.getint('system',
-                                                                            'granularity_sample_amount'))
-                if GranularityName == self.granularity:
-                    # Create Date Time index with full range of dates
-                    dates = self.datetime_to_int(pd.date_range(start=df.index.values[0],
-                                                               end=df.index.values[-1],
-                                                               freq=GranularityName))
-                    dfx = pd.DataFrame(index=dates)
-                    dfx.index.rename('DateTimeKey', inplace=True)
-
-                    # outer join the full range of dates it will generate the missing value date time
-                    # for the target data
-                    dff = pd.merge(dfx, dff, on='DateTimeKey', how='outer').sort_index()
-
-                    # Get count of None values in data frame
-                    none_values: int = dff.isna().sum().sum()
-
-                    if none_values > 0 and nulls_method == 'interpolate_lin':
-                        self.logger.debug(f"fillna_data_instruments -> data has {none_values} missing values, linear-fill")
-                        dff.interpolate(method='linear', inplace=True)
-
-                    elif none_values > 0 and nulls_method == 'interpolate_poly':
-                        self.logger.debug(f"fillna_data_instruments -> data has {none_values} missing values, poly-fill")
-                        dff.interpolate(method='polynomial', inplace=True,
-                                        order=self.config.getint('system', 'null_polynomial_order'))
-
-                    dff['GranularityKey'] = self.granularity_dim.query(f"OandaAlias == '{GranularityName}'")['GranularityKey'].values[0]
-                    dff['InstrumentKey'] = self.instrument_dim.query(f"Name == '{instrument_name}'")['InstrumentKey'].values[0]
-                    dff['PriceTypeKey'] = self.price_type_dim.query(f"Alias == '{price_type}'")['PriceTypeKey'].values[0]
-                    dff['DateKey'] = self.date_key_parser(dff.index.values)
-                    dff['TimeKey'] = self.time_key_parser(dff.index.values)
-                    dff.dropna(inplace=True)
-                    dff = json.loads(dff.reset_index().to_json(orient='records'))
-
-                    result = [Facts_CleanInstrument(
-                        id=self.create_hex_from_string(str(row)),
-                        DateTimeKey=row['DateTimeKey'],
-                        DateKey=row['DateKey'],
-                        TimeKey=row['TimeKey'],
-                        GranularityKey=row['GranularityKey'],
-                        PriceTypeKey=row['PriceTypeKey'],
-                        Open=row['Open'],
-                        High=row['High'],
-                        Low=row['Low'],
-                        Close=row['Close'],
-                        Volume=row['Volume'],
-                        InstrumentKey=row['InstrumentKey']
-
-                    ) for idx, row in
-                        tqdm(enumerate(dff),
-                             total=len(dff),
-                             desc=f"{instrument_name}_{price_type} CLEAN",
-                             ascii=True,
-                             disable=self.hide_progress_bar)]
 
-                else:
-                    self.ErrorList.append(self.error_details(
-                        f"{__class__}: fillna_data_instruments -> {instrument_name} Granularity '{GranularityName}' Does not match target '{self.granularity}'"))
-                    pass
+        if payload.get('gaps') is not None:
+            with self.gap_reports_lock:
+                previous = self.gap_reports.get(instrument)
+                self.gap_reports[instrument] = payload['gaps'] if previous is None else previous.merge(payload['gaps'])
 
-            else:
-                self.ErrorsDetected = True
-                self.ErrorList.append(self.error_details(
-                    f"{__class__}: fillna_data_instruments -> {instrument_name} {nulls_method} No Data to clean"))
+        # Check that buckets off data have information
+        if payload['raw'] is not False and payload['clean'] is not False:
+            raw_loaded = self.postgres_interface.copy_fact_batch(payload['raw'], on_conflict=on_conflict)
+            clean_loaded = self.postgres_interface.copy_fact_batch(payload['clean'], on_conflict=on_conflict)
+            result = raw_loaded is not False and clean_loaded is not False
 
         else:
-            self.print_all_errors()
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: load_instrument_payload -> List of Facts Objects is empty or with error for {instrument}"))
 
         return result
 
-    def align_data_instruments(self) -> list:
+    def dimension_keys(self, instrument_name: str, price_type: str, granularity_name: str):
+        """
+        Resolve the GranularityKey, InstrumentKey and PriceTypeKey of a series from the dimension cache.
+        :param instrument_name: Name of the target instrument
+        :param price_type: Price Type Bid, Ask, Mid
+        :param granularity_name: OANDA granularity name
+        :return: (GranularityKey, InstrumentKey, PriceTypeKey), None if any is missing from its dimension
+        """
+        keys = (self.dimensions.get_key('granularity', granularity_name),
+                self.dimensions.get_key('instrument', instrument_name),
+                self.dimensions.get_key('price_type', price_type))
+
+        if None in keys:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: dimension_keys -> {instrument_name} {granularity_name} {price_type} missing from the Trading dimensions"))
+            return None
+
+        return keys
+
+    def align_data_instruments(self):
         """
-        Input a Facts_Instruments total, it will align the data to the lowest date time of all items.
-        Is useful in machine learning
-        :return: List[Facts_InstrumentsDataAligned]
+        Align Facts_Instruments to the latest first DateTimeKey of all instruments. Is useful in machine learning,
+        Dataset_Export writes the aligned table as a memory mapped array for training jobs.
+        Only rows newer than what Facts_InstrumentsDataAligned holds are emitted, the aligned table is
+        only rebuilt when the alignment floor moves. Nothing is deleted here, load_aligned_data replaces
+        the stored rows in the transaction that loads the rebuilt batch.
+        :return: (FactBatch for Facts_InstrumentsDataAligned, True when it replaces the whole table), False on error
         """
         self.logger.debug(f"Starting Instrument data alignment ...")
-        dff: pd.DataFrame = pd.DataFrame()
         result = False
 
         if not self.ErrorsDetected:
+            raw, aligned = Facts_Instruments, Facts_InstrumentsDataAligned
+            series = []
 
-            # Pull entire fact instruments table to create an aligned instruments table
             with self.postgres_interface.connect_session() as session:
-                instrument_stmt = select(Facts_Instruments)
-                data_to_clean = pd.DataFrame([row[0] for row in session.execute(instrument_stmt)]).set_index('DateTimeKey').sort_index()
-
-            if data_to_clean.shape != (0, len(data_to_clean.columns)):
-                align_index_to = max([min(data_to_clean.query(f"InstrumentKey == {i}").index) for i in data_to_clean['InstrumentKey'].unique()])
-                data_to_clean.sort_index(inplace=True)
-
-                # use this boolean index to filter the other arrays
-                arr = np.array(data_to_clean.index, dtype=int) >= int(align_index_to)
-                dff['DateTimeKey'] = data_to_clean.index.values[arr]
-                dff['DateKey'] = data_to_clean['DateKey'].values[arr]
-
-                dff['TimeKey'] = data_to_clean['TimeKey'].values[arr]
-                dff['GranularityKey'] = data_to_clean['GranularityKey'].values[arr]
-                dff['Open'] = data_to_clean['Open'].values[arr]
-                dff['High'] = data_to_clean['High'].values[arr]
-                dff['Low'] = data_to_clean['Low'].values[arr]
-                dff['Close'] = data_to_clean['Close'].values[arr]
-                dff['Volume'] = data_to_clean['Volume'].values[arr]
-                dff['InstrumentKey'] = data_to_clean['InstrumentKey'].values[arr]
-                dff['PriceTypeKey'] = data_to_clean['PriceTypeKey'].values[arr]
-                dff = json.loads(dff.reset_index().to_json(orient='records'))
-
-                result = [Facts_InstrumentsDataAligned(
-                    id=self.create_hex_from_string(str(row)),
-                    DateTimeKey=row['DateTimeKey'],
-                    DateKey=row['DateKey'],
-                    TimeKey=row['TimeKey'],
-                    GranularityKey=row['GranularityKey'],
-                    PriceTypeKey=row['PriceTypeKey'],
-                    Open=row['Open'],
-                    High=row['High'],
-                    Low=row['Low'],
-                    Close=row['Close'],
-                    Volume=row['Volume'],
-                    InstrumentKey=row['InstrumentKey']
-
-                ) for idx, row
-                    in tqdm(enumerate(dff),
-                            total=len(dff),
-                            desc=f"ALIGNING DATA",
-                            ascii=True,
-                            disable=self.hide_progress_bar)]
+                # Alignment floor pushed down to SQL, the latest first bar of all instruments
+                starts = session.execute(select(raw.InstrumentKey, func.min(raw.DateTimeKey)).group_by(raw.InstrumentKey)).all()
+
+                if len(starts) > 0:
+                    align_index_to = max(start for _, start in starts)
+                    aligned_floor = session.execute(select(func.min(aligned.DateTimeKey))).scalar()
+
+                    rebuild = aligned_floor != align_index_to
+                    if rebuild:
+                        self.logger.debug(f"align_data_instruments -> floor moved {aligned_floor} -> {align_index_to}, rebuilding")
+                        aligned_watermarks = {}
+
+                    else:
+                        aligned_stmt = select(aligned.InstrumentKey, aligned.GranularityKey, aligned.PriceTypeKey,
+                                              func.max(aligned.DateTimeKey)).group_by(aligned.InstrumentKey,
+                                                                                      aligned.GranularityKey,
+                                                                                      aligned.PriceTypeKey)
+                        aligned_watermarks = {(i, g, p): dtk for i, g, p, dtk in session.execute(aligned_stmt)}
+
+                    series = session.execute(select(raw.InstrumentKey, raw.GranularityKey, raw.PriceTypeKey).distinct()).all()
+
+            if len(series) > 0:
+                # Series sharing a cutoff are grouped, so the new rows of every series come back from a single
+                # query with the per series cutoffs pushed down to SQL
+                cutoffs = {}
+                for keys in series:
+                    cutoff = self.alignment_cutoff(aligned_watermarks.get(tuple(keys)), align_index_to)
+                    cutoffs.setdefault(cutoff, []).append(tuple(keys))
+
+                new_rows = or_(*(and_(raw.DateTimeKey >= cutoff,
+                                      tuple_(raw.InstrumentKey, raw.GranularityKey, raw.PriceTypeKey).in_(keys))
+                                 for cutoff, keys in cutoffs.items()))
+
+                names = [name for name in FACT_COLUMNS if name != 'id']
+                batches = list(self.postgres_interface.stream_model(raw,
+                                                                    columns=names,
+                                                                    datetime_from=min(cutoffs),
+                                                                    where=(new_rows,)))
+
+                columns = {name: np.concatenate([batch[name] for batch in batches]) for name in names} if batches else \
+                    {name: np.array([], dtype=np.float64 if name in PRICE_COLUMNS else np.int64) for name in names}
+                order = np.argsort(columns['DateTimeKey'], kind='stable')
+                columns = {name: values[order] for name, values in columns.items()}
+                columns['id'] = self.fact_row_ids(columns)
+
+                self.logger.debug(f"align_data_instruments -> {len(order)} rows to align from {align_index_to}")
+                result = FactBatch(model=Facts_InstrumentsDataAligned, columns=columns), rebuild
 
             else:
                 self.ErrorsDetected = True
-                self.ErrorList.append(self.error_details(f"{__class__}: align_data_instruments -> No Data in data_to_clean"))
+                self.ErrorList.append(self.error_details(f"{__class__}: align_data_instruments -> No Data in Facts_Instruments"))
 
         else:
             self.print_all_errors()
 
         return result
 
+    def load_aligned_data(self, fact_aligned: FactBatch, rebuild: bool) -> bool:
+        """
+        Load the output of align_data_instruments. A rebuild deletes the stored aligned rows and loads the batch
+        in one transaction, so a failed load never leaves Facts_InstrumentsDataAligned empty or half rebuilt.
+        :param fact_aligned: FactBatch for Facts_InstrumentsDataAligned
+        :param rebuild: replace every stored aligned row
+        :return: True if successful
+        """
+        if len(fact_aligned) == 0 and not rebuild:
+            return True
+
+        if self.postgres_interface.copy_fact_batch(fact_aligned, on_conflict='update', replace=rebuild) is False:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: load_aligned_data -> Failed to load {len(fact_aligned)} rows into Facts_InstrumentsDataAligned, "
+                f"the stored aligned rows are unchanged"))
+            return False
+
+        return True
+
+    def alignment_cutoff(self, aligned_watermark, align_index_to: int) -> int:
+        """
+        First DateTimeKey of a series to (re)align, its aligned watermark minus the incremental overlap.
+        :param aligned_watermark: latest aligned DateTimeKey of the series, None if the series is not aligned yet
+        :param align_index_to: alignment floor
+        :return: DateTimeKey
+        """
+        if aligned_watermark is None:
+            return align_index_to
+
+        cutoff = datetime_key_to_timestamp(aligned_watermark) - self.incremental_overlap_bars * granularity_timedelta(self.granularity)
+        return max(timestamp_to_datetime_key(cutoff), align_index_to)
 
 if __name__ == '__main__':
     from CORE.Config_Manager import ConfigManager
@@ -0,0 +1,431 @@
+import configparser
+import re
+import traceback
+import warnings
+from logging import Logger
+
+import numpy as np
+from sqlalchemy import select, distinct, delete, insert
+
+from CORE.Error_Handling import ErrorHandling
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DAL.Trading.Dimension_Cache import DimensionCache
+from DAL.Trading.Fact_Batches import PRICE_COLUMNS, FactBatch, FactBatchBuilder
+from DAL.Trading.Indicator_Kernels import indicator_line_name
+from DAL.Trading.Indicators import Indicators
+from DOL.Trading.Dimensions.Dimension_Time import Dimension_Time
+from DOL.Trading.Facts.Facts_CleanInstruments import Facts_CleanInstrument
+from DOL.Trading.Facts.Facts_Indicators import Facts_Indicators
+from DOL.Trading.Facts.Facts_NormalisedFeatures import Facts_NormalisedFeatures
+from DOL.Trading.States.State_FeatureScalers import State_FeatureScalers
+
+# [features] normalisation options
+NORMALISATIONS: tuple = ('zscore', 'minmax')
+
+# Dimension_Time session columns materialised as 0 / 1 features
+SESSION_COLUMNS: tuple = ('IsLondonSession', 'IsNewYorkSession', 'IsSydneySession', 'IsTokoyoSession')
+
+# [features] RSI levels, a crossing feature is built for each level of each RSI line
+RSI_LEVEL_OPTIONS: tuple = ('rsi_upper_level_one', 'rsi_upper_level_two', 'rsi_lower_level_two', 'rsi_lower_level_one')
+RSI_LINE = re.compile(r'^RSI_\d+$')
+
+# Facts_CleanInstrument columns a feature build reads
+SERIES_COLUMNS: tuple = ('DateTimeKey', 'DateKey', 'TimeKey') + PRICE_COLUMNS + ('Volume',)
+
+
+def fit_scaler(values: np.ndarray, method: str) -> tuple:
+    """
+    :param values: (bars, features) array, NaN is ignored
+    :param method: name in NORMALISATIONS
+    :return: (location, scale) per feature, a constant or empty feature gets location 0 / scale 1 where undefined
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if method == 'zscore':
+            location, scale = np.nanmean(values, axis=0), np.nanstd(values, axis=0)
+        else:
+            location = np.nanmin(values, axis=0)
+            scale = np.nanmax(values, axis=0) - location
+
+    location = np.where(np.isfinite(location), location, 0.0)
+    scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+    return location, scale
+
+
+def level_crossings(values: np.ndarray, levels: tuple) -> np.ndarray:
+    """
+    :param values: (bars,) oscillator line
+    :param levels: thresholds
+    :return: (bars, levels) array, 1 on the bar crossing a level upwards, -1 downwards, 0 otherwise
+    """
+    previous = np.concatenate([[np.nan], values[:-1]])[:, None]
+    current = values[:, None]
+    level = np.asarray(levels, dtype=np.float64)[None, :]
+    upwards = (previous < level) & (current >= level)
+    downwards = (previous > level) & (current <= level)
+    return upwards.astype(np.float64) - downwards
+
+
+def pack_feature_rows(values: np.ndarray) -> np.ndarray:
+    """
+    :param values: (bars, features) array
+    :return: object array of one float32 little endian bytes value per bar, the Facts_NormalisedFeatures.Features column
+    """
+    rows = np.ascontiguousarray(values, dtype='<f4')
+    return np.array(rows.view(np.dtype((np.void, rows.shape[1] * 4)))[:, 0].tolist(), dtype=object)
+
+
+def unpack_feature_rows(rows, width: int) -> np.ndarray:
+    """
+    :param rows: Facts_NormalisedFeatures.Features values, bytes or memoryview
+    :param width: features per bar
+    :return: (bars, width) float32 np.ndarray
+    """
+    return np.frombuffer(b''.join(rows), dtype='<f4').reshape(len(rows), width)
+
+
+class NormalisedFeatures(ErrorHandling, FactBatchBuilder):
+    def __init__(self,
+                 config_object: configparser.ConfigParser,
+                 postgres_interface: PostgreSQLInterface,
+                 logger: Logger,
+                 granularity: str,
+                 price_type: str = 'M'):
+        """
+        Materialise the normalised feature matrix of every series into Facts_NormalisedFeatures, one float32 row per bar:
+        prices and configured indicator lines scaled with a persisted scaler, RSI level crossings and session flags as is.
+        The scaler is fitted on the first build of a series, later runs only normalise the new bars with it.
+        :param config_object: ConfigManager object
+        :param postgres_interface: PostgreSQLInterface object
+        :param logger: Logger object
+        :param granularity: OANDA granularity name of the series
+        :param price_type: Price Type Bid, Ask, Mid of the prices
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.config = config_object
+        self.postgres_interface = postgres_interface
+        self.granularity: str = granularity
+        self.price_type: str = price_type
+
+        self.dimensions = DimensionCache.shared(self.postgres_interface, self.logger)
+
+        # The configured indicator lines are the indicator features every series is expected to have
+        self.indicators = Indicators(self.config, self.postgres_interface, self.logger, self.granularity, self.price_type)
+
+        self.normalisation: str = self.config.get('features', 'normalisation', fallback='zscore')
+        if self.normalisation not in NORMALISATIONS:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(
+                f"{__class__}: __init__ -> unknown normalisation '{self.normalisation}', use one of {list(NORMALISATIONS)}"))
+
+        self.indicator_columns: list = [name.strip() for name in self.config.get('features', 'indicator_columns', fallback='Close').split(',')
+                                        if name.strip()]
+        self.rsi_levels: tuple = tuple(sorted({self.config.getfloat('features', option)
+                                               for option in RSI_LEVEL_OPTIONS if self.config.has_option('features', option)}))
+
+        # TimeKey indexed (TimeKey + 1, sessions) array of Dimension_Time session flags, read on first use
+        self.sessions = None
+
+    def session_lookup(self) -> np.ndarray:
+        """
+        :return: array indexed by TimeKey holding the SESSION_COLUMNS flags of Dimension_Time
+        """
+        if self.sessions is None:
+            frame = self.postgres_interface.read_model(Dimension_Time)
+            time_keys = frame['TimeKey'].to_numpy(dtype=np.int64) if frame.shape[0] > 0 else np.array([], dtype=np.int64)
+            self.sessions = np.zeros((int(time_keys.max(initial=0)) + 1, len(SESSION_COLUMNS)), dtype=np.float64)
+            for position, name in enumerate(SESSION_COLUMNS):
+                self.sessions[time_keys, position] = frame[name].fillna(0).to_numpy(dtype=np.float64)
+
+        return self.sessions
+
+    def configured_lines(self) -> list:
+        """
+        :return: list of (IndicatorKey, line name) of every configured indicator line, in configuration order
+        """
+        indicator_keys = self.indicators.ensure_indicator_dimensions(self.indicators.configured_indicators())
+        if self.indicators.ErrorsDetected:
+            self.ErrorsDetected = True
+            self.ErrorList.extend(self.indicators.ErrorList)
+
+        return [(key, indicator_line_name(name, parameters, line))
+                for name, parameter_sets in indicator_keys.items() for parameters, lines in parameter_sets for line, key in lines.items()]
+
+    def read_series(self, instrument_key: int, granularity_key: int, price_type_key: int, datetime_from: int = None) -> dict:
+        """
+        :param datetime_from: inclusive lower DateTimeKey, None reads the whole series
+        :return: dict of SERIES_COLUMNS name -> np.ndarray in DateTimeKey order
+        """
+        batches = list(self.postgres_interface.stream_model(Facts_CleanInstrument,
+                                                            columns=list(SERIES_COLUMNS),
+                                                            instrument_keys=[instrument_key],
+                                                            granularity_keys=[granularity_key],
+                                                            datetime_from=datetime_from,
+                                                            where=(Facts_CleanInstrument.PriceTypeKey == price_type_key,),
+                                                            order_by='DateTimeKey'))
+        return {name: np.concatenate([batch[name] for batch in batches]) if batches else np.array([])
+                for name in SERIES_COLUMNS}
+
+    def read_indicator_matrix(self, instrument_key: int, granularity_key: int, datetime_keys: np.ndarray,
+                              indicator_keys: list) -> tuple:
+        """
+        Pivot the Facts_Indicators lines of a series onto its bars.
+        :param datetime_keys: ascending DateTimeKey of the bars
+        :param indicator_keys: IndicatorKey of each line, in the column order of the matrix
+        :return: ((bars, lines x indicator_columns) np.ndarray, NaN where a line has no value,
+                  (bars, lines) np.ndarray[bool], True where a line has a Facts_Indicators row)
+        """
+        matrix = np.full((datetime_keys.size, len(indicator_keys) * len(self.indicator_columns)), np.nan)
+        present = np.zeros((datetime_keys.size, len(indicator_keys)), dtype=bool)
+        if not indicator_keys:
+            return matrix, present
+
+        names = ['DateTimeKey', 'IndicatorKey'] + self.indicator_columns
+        batches = list(self.postgres_interface.stream_model(Facts_Indicators,
+                                                            columns=names,
+                                                            instrument_keys=[instrument_key],
+                                                            granularity_keys=[granularity_key],
+                                                            datetime_from=int(datetime_keys[0]),
+                                                            datetime_to=int(datetime_keys[-1]),
+                                                            where=(Facts_Indicators.IndicatorKey.in_([int(key) for key in indicator_keys]),)))
+        if not batches:
+            return matrix, present
+
+        columns = {name: np.concatenate([batch[name] for batch in batches]) for name in names}
+        keys = np.asarray(indicator_keys, dtype=np.int64)
+        order = np.argsort(keys)
+        line = order[np.searchsorted(keys[order], columns['IndicatorKey'])]
+        row = np.searchsorted(datetime_keys, columns['DateTimeKey'])
+        found = (row < datetime_keys.size) & (datetime_keys[np.minimum(row, datetime_keys.size - 1)] == columns['DateTimeKey'])
+
+        present[row[found], line[found]] = True
+        for position, column in enumerate(self.indicator_columns):
+            matrix[row[found], line[found] * len(self.indicator_columns) + position] = columns[column][found]
+
+        return matrix, present
+
+    def feature_layout(self, indicator_names: list) -> tuple:
+        """
+        Feature columns of a series, they only depend on the configured indicator lines and RSI levels.
+        :param indicator_names: '<line>_<column>' names of the indicator matrix columns
+        :return: (feature names, np.ndarray[bool] True where a feature is scaled,
+                  indicator matrix columns a block of RSI level crossings is built from)
+        """
+        names = list(PRICE_COLUMNS + ('Volume',)) + indicator_names
+        scaled = [True] * len(names)
+        crossings = []
+
+        rsi_column = 'Close' if 'Close' in self.indicator_columns else self.indicator_columns[0]
+        for position, name in enumerate(indicator_names):
+            indicator = name[:-len(rsi_column) - 1]
+            if self.rsi_levels and name.endswith(f"_{rsi_column}") and RSI_LINE.match(indicator):
+                crossings.append(position)
+                names.extend(f"{indicator}_Cross_{level:g}" for level in self.rsi_levels)
+                scaled.extend([False] * len(self.rsi_levels))
+
+        names.extend(SESSION_COLUMNS)
+        scaled.extend([False] * len(SESSION_COLUMNS))
+        return names, np.array(scaled), crossings
+
+    def build_features(self, series: dict, indicators: np.ndarray, crossings: list) -> np.ndarray:
+        """
+        Assemble the raw feature matrix of a series in one pass over its arrays, in feature_layout order.
+        :param series: output of read_series
+        :param indicators: (bars, indicator features) np.ndarray
+        :param crossings: indicator columns of feature_layout
+        :return: (bars, features) np.ndarray
+        """
+        prices = np.column_stack([series[name] for name in PRICE_COLUMNS + ('Volume',)]).astype(np.float64)
+        blocks = [prices, indicators] + [level_crossings(indicators[:, position], self.rsi_levels) for position in crossings]
+
+        sessions = self.session_lookup()
+        time_keys = series['TimeKey'].astype(np.int64)
+        blocks.append(sessions[np.minimum(time_keys, sessions.shape[0] - 1)] * (time_keys < sessions.shape[0])[:, None])
+        return np.hstack(blocks)
+
+    def load_scalers(self, instrument_key: int, granularity_key: int, price_type_key: int) -> dict:
+        """
+        :return: dict of FeatureKey -> (Location, Scale, Position, DateTimeKey) of the State_FeatureScalers rows of one series
+        """
+        with self.postgres_interface.connect_session() as session:
+            rows = session.execute(select(State_FeatureScalers.FeatureKey, State_FeatureScalers.Location,
+                                          State_FeatureScalers.Scale, State_FeatureScalers.Position,
+                                          State_FeatureScalers.DateTimeKey)
+                                   .where(State_FeatureScalers.InstrumentKey == instrument_key,
+                                          State_FeatureScalers.GranularityKey == granularity_key,
+                                          State_FeatureScalers.PriceTypeKey == price_type_key)).all()
+
+        return {row.FeatureKey: (row.Location, row.Scale, row.Position, row.DateTimeKey) for row in rows}
+
+    def save_scalers(self, instrument_key: int, granularity_key: int, price_type_key: int, feature_keys: np.ndarray,
+                     location: np.ndarray, scale: np.ndarray, datetime_key: int) -> None:
+        """
+        Replace the State_FeatureScalers rows of one series in one transaction, Position is the order of feature_keys.
+        """
+        with self.postgres_interface.connect_session() as session:
+            session.execute(delete(State_FeatureScalers.__table__)
+                            .where(State_FeatureScalers.InstrumentKey == instrument_key,
+                                   State_FeatureScalers.GranularityKey == granularity_key,
+                                   State_FeatureScalers.PriceTypeKey == price_type_key))
+            session.execute(insert(State_FeatureScalers.__table__),
+                            [{'InstrumentKey': int(instrument_key), 'GranularityKey': int(granularity_key),
+                              'PriceTypeKey': int(price_type_key), 'FeatureKey': int(key), 'Position': position,
+                              'Location': float(loc), 'Scale': float(sca), 'DateTimeKey': int(datetime_key)}
+                             for position, (key, loc, sca) in enumerate(zip(feature_keys, location, scale))])
+            session.commit()
+
+    def delete_features(self, instrument_key: int, granularity_key: int, price_type_key: int) -> None:
+        """
+        Remove the Facts_NormalisedFeatures rows of one series, their columns no longer match its scaler.
+        """
+        with self.postgres_interface.connect_session() as session:
+            session.execute(delete(Facts_NormalisedFeatures.__table__)
+                            .where(Facts_NormalisedFeatures.InstrumentKey == instrument_key,
+                                   Facts_NormalisedFeatures.GranularityKey == granularity_key,
+                                   Facts_NormalisedFeatures.PriceTypeKey == price_type_key))
+            session.commit()
+
+    def feature_batch(self, series: dict, granularity_key: int, instrument_key: int, price_type_key: int,
+                      values: np.ndarray) -> FactBatch:
+        """
+        One Facts_NormalisedFeatures batch, one row per bar holding every feature.
+        :param series: bars of the values
+        :param values: (bars, features) float32 np.ndarray in scaler Position order
+        :return: FactBatch for Facts_NormalisedFeatures
+        """
+        columns = {name: series[name].astype(np.int64) for name in ('DateTimeKey', 'DateKey', 'TimeKey')}
+        columns['GranularityKey'] = np.full(values.shape[0], granularity_key, dtype=np.int64)
+        columns['InstrumentKey'] = np.full(values.shape[0], instrument_key, dtype=np.int64)
+        columns['PriceTypeKey'] = np.full(values.shape[0], price_type_key, dtype=np.int64)
+        columns['Features'] = pack_feature_rows(values)
+
+        columns['id'] = self.fact_row_ids(columns)
+        return FactBatch(model=Facts_NormalisedFeatures, columns=columns)
+
+    def read_feature_matrix(self, instrument_key: int, granularity_key: int, price_type_key: int) -> tuple:
+        """
+        :return: (feature names, DateTimeKey of each bar, (bars, features) float32 np.ndarray) of one materialised series
+        """
+        scalers = self.load_scalers(instrument_key, granularity_key, price_type_key)
+        feature_keys = sorted(scalers, key=lambda key: scalers[key][2])
+        batches = list(self.postgres_interface.stream_model(Facts_NormalisedFeatures,
+                                                            columns=['DateTimeKey', 'Features'],
+                                                            instrument_keys=[instrument_key],
+                                                            granularity_keys=[granularity_key],
+                                                            where=(Facts_NormalisedFeatures.PriceTypeKey == price_type_key,),
+                                                            order_by='DateTimeKey'))
+
+        datetime_keys = np.concatenate([batch['DateTimeKey'] for batch in batches]) if batches else np.array([], dtype=np.int64)
+        rows = np.concatenate([batch['Features'] for batch in batches]) if batches else []
+        return ([self.dimensions.get_name('feature', int(key)) for key in feature_keys], datetime_keys,
+                unpack_feature_rows(rows, len(feature_keys)))
+
+    def materialise_instrument_features(self, instrument_key: int, granularity_key: int, price_type_key: int,
+                                        lines: list) -> bool:
+        """
+        Normalise the bars of one series that are not materialised yet, up to the last bar holding a Facts_Indicators
+        row of every configured line. Later bars wait for their indicators, the watermark never passes them.
+        The feature set follows from the configured lines, a series whose scaler was fitted on another set is
+        rebuilt and refitted over its whole history. The last materialised bar is read again as the previous bar
+        of the RSI crossings.
+        :param lines: output of configured_lines
+        :return: True if successful
+        """
+        indicator_keys = [key for key, name in lines]
+        names, scaled, crossings = self.feature_layout([f"{name}_{column}" for key, name in lines for column in self.indicator_columns])
+        feature_map = self.dimensions.ensure('feature', [{'Name': name} for name in names])
+        feature_keys = np.array([feature_map[name] for name in names], dtype=np.int64)
+
+        scalers = self.load_scalers(instrument_key, granularity_key, price_type_key)
+        refit = sorted(scalers, key=lambda key: scalers[key][2]) != feature_keys.tolist()
+        watermark = None if refit else min(datetime_key for location, scale, position, datetime_key in scalers.values())
+        if refit and scalers:
+            self.logger.info(f"materialise_instrument_features -> InstrumentKey {instrument_key}: features changed, refitting the scaler")
+
+        series = self.read_series(instrument_key, granularity_key, price_type_key, watermark)
+        datetime_keys = series['DateTimeKey'].astype(np.int64)
+        if datetime_keys.size == 0 or (watermark is not None and datetime_keys[-1] <= watermark):
+            return True
+
+        indicators, present = self.read_indicator_matrix(instrument_key, granularity_key, datetime_keys, indicator_keys)
+        complete = np.flatnonzero(present.all(axis=1))
+        if complete.size == 0 or (watermark is not None and datetime_keys[complete[-1]] <= watermark):
+            self.logger.debug(f"materialise_instrument_features -> InstrumentKey {instrument_key}: waiting for indicators")
+            return True
+
+        last = complete[-1]
+        values = self.build_features(series, indicators, crossings)
+        new = np.arange(datetime_keys.size) <= last
+        if watermark is None:
+            location, scale = fit_scaler(values[new], self.normalisation)
+            location, scale = np.where(scaled, location, 0.0), np.where(scaled, scale, 1.0)
+            if scalers:
+                self.delete_features(instrument_key, granularity_key, price_type_key)
+        else:
+            location = np.array([scalers[int(key)][0] if flag else 0.0 for key, flag in zip(feature_keys, scaled)])
+            scale = np.array([scalers[int(key)][1] if flag else 1.0 for key, flag in zip(feature_keys, scaled)])
+            new &= datetime_keys > watermark
+
+        normalised = ((values[new] - location) / scale).astype(np.float32)
+        batch = self.feature_batch({name: column[new] for name, column in series.items()},
+                                   granularity_key, instrument_key, price_type_key, normalised)
+
+        result = self.postgres_interface.copy_fact_batch(batch, on_conflict='update') is not False
+        if result:
+            self.save_scalers(instrument_key, granularity_key, price_type_key, feature_keys, location, scale, int(datetime_keys[last]))
+
+        self.logger.debug(f"materialise_instrument_features -> InstrumentKey {instrument_key}: {int(new.sum())} bars x {len(names)} features")
+        return result
+
+    def materialise_all_features(self) -> bool:
+        """
+        Materialise the new bars of every series held in Facts_CleanInstrument at this granularity and price type.
+        Bars are materialised once every configured indicator line reaches them.
+        :return: True if successful
+        """
+        result = False
+        try:
+            if not self.ErrorsDetected:
+                granularity_key = self.dimensions.get_key('granularity', self.granularity)
+                price_type_key = self.dimensions.get_key('price_type', self.price_type)
+                if granularity_key is None or price_type_key is None:
+                    self.ErrorsDetected = True
+                    self.ErrorList.append(self.error_details(
+                        f"{__class__}: materialise_all_features -> {self.granularity} {self.price_type} missing from the Trading dimensions"))
+                    return result
+
+                lines = self.configured_lines()
+                if self.ErrorsDetected:
+                    return result
+
+                with self.postgres_interface.connect_session() as session:
+                    instrument_keys = session.execute(
+                        select(distinct(Facts_CleanInstrument.InstrumentKey))
+                        .where(Facts_CleanInstrument.GranularityKey == granularity_key,
+                               Facts_CleanInstrument.PriceTypeKey == price_type_key)).scalars().all()
+
+                result = True
+                for instrument_key in instrument_keys:
+                    result = self.materialise_instrument_features(instrument_key, granularity_key, price_type_key, lines) and result
+
+                result = result and not self.ErrorsDetected
+
+            else:
+                self.print_all_errors()
+
+        except Exception as err_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: materialise_all_features -> {err_}\n{traceback.format_exc()}"))
+
+        return result
+
+
+if __name__ == '__main__':
+    from CORE.Config_Manager import ConfigManager
+    from Logger import log_maker
+
+    logs = log_maker('MaterialiseFeatures', '../../configs.ini')
+    cm = ConfigManager(logs, '../../configs.ini')
+    sql = PostgreSQLInterface(cm.create_config(), logs)
+    NormalisedFeatures(cm.create_config(), sql, logs, 'D').materialise_all_features()
@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+
+from sqlalchemy import Column, String, Integer
+from ..Base import Base
+
+
+@dataclass
+class Dimension_Features(Base):
+    __tablename__ = 'Dimension_Features'
+    __bind_key__ = 'Trading'
+    __table_args__ = {'schema': 'Trading'}
+
+    FeatureKey: int = Column(Integer, primary_key=True, autoincrement=True)
+    Name: str = Column(String, nullable=False)
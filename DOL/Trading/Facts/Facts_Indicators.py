@@ -1,38 +1,44 @@
 from dataclasses import dataclass
 
-from sqlalchemy import Column, String, Integer, ForeignKey, Float, BigInteger
+from sqlalchemy import Column, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from ..Base import Base
+from ..Storage_Types import FACT_ID, DATETIME_KEY, CALENDAR_KEY, DIMENSION_KEY, PRICE, VOLUME
 
 
 @dataclass
 class Facts_Indicators(Base):
     __tablename__ = 'Facts_Indicators'
     __bind_key__ = 'Trading'
-    __table_args__ = {'schema': 'Trading'}
-
-    id: str = Column(String, primary_key=True)
-    DateTimeKey: int = Column(BigInteger, nullable=False)
-    DateKey: int = Column(BigInteger, ForeignKey('Trading.Dimension_Date.DateKey'), nullable=False)
-    TimeKey: int = Column(BigInteger, ForeignKey('Trading.Dimension_Time.TimeKey'), nullable=False)
+    __table_args__ = (
+        # Natural key, also the index every per-series time range read is served from
+        UniqueConstraint('InstrumentKey', 'GranularityKey', 'IndicatorKey', 'DateTimeKey', name='uq_Facts_Indicators_natural_key'),
+        Index('ix_Facts_Indicators_DateTimeKey', 'DateTimeKey'),
+        {'schema': 'Trading'},
+    )
+
+    id: int = Column(FACT_ID, primary_key=True)
+    DateTimeKey: int = Column(DATETIME_KEY, nullable=False)
+    DateKey: int = Column(CALENDAR_KEY, ForeignKey('Trading.Dimension_Date.DateKey'), nullable=False)
+    TimeKey: int = Column(CALENDAR_KEY, ForeignKey('Trading.Dimension_Time.TimeKey'), nullable=False)
     Date = relationship("Dimension_Date")
     Time = relationship("Dimension_Time")
 
-    GranularityKey: int = Column(Integer, ForeignKey('Trading.Dimension_Granularity.GranularityKey'), nullable=False)
+    GranularityKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Granularity.GranularityKey'), nullable=False)
     Granularity = relationship("Dimension_Granularity")
 
-    InstrumentKey: int = Column(Integer, ForeignKey('Trading.Dimension_Instruments.InstrumentKey'), nullable=False)
+    InstrumentKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Instruments.InstrumentKey'), nullable=False)
     Instrument = relationship("Dimension_Instruments")
 
-    IndicatorKey: int = Column(Integer, ForeignKey('Trading.Dimension_Indicators.IndicatorKey'), nullable=False)
+    IndicatorKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Indicators.IndicatorKey'), nullable=False)
     Indicator = relationship("Dimension_Indicators")
 
-    Open: float = Column(Float)
-    High: float = Column(Float)
-    Low: float = Column(Float)
-    Close: float = Column(Float)
-    Volume: int = Column(Integer)
+    Open: float = Column(PRICE)
+    High: float = Column(PRICE)
+    Low: float = Column(PRICE)
+    Close: float = Column(PRICE)
+    Volume: float = Column(PRICE)
 
 
 
@@ -0,0 +1,38 @@
+from dataclasses import dataclass
+
+from sqlalchemy import Column, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import relationship
+
+from ..Base import Base
+from ..Storage_Types import FACT_ID, DATETIME_KEY, CALENDAR_KEY, DIMENSION_KEY, FEATURE_ROW
+
+
+@dataclass
+class Facts_NormalisedFeatures(Base):
+    __tablename__ = 'Facts_NormalisedFeatures'
+    __bind_key__ = 'Trading'
+    __table_args__ = (
+        # Natural key, also the index every per-series time range read is served from
+        UniqueConstraint('InstrumentKey', 'GranularityKey', 'PriceTypeKey', 'DateTimeKey', name='uq_Facts_NormalisedFeatures_natural_key'),
+        Index('ix_Facts_NormalisedFeatures_DateTimeKey', 'DateTimeKey'),
+        {'schema': 'Trading'},
+    )
+
+    id: int = Column(FACT_ID, primary_key=True)
+    DateTimeKey: int = Column(DATETIME_KEY, nullable=False)
+    DateKey: int = Column(CALENDAR_KEY, ForeignKey('Trading.Dimension_Date.DateKey'), nullable=False)
+    TimeKey: int = Column(CALENDAR_KEY, ForeignKey('Trading.Dimension_Time.TimeKey'), nullable=False)
+    Date = relationship("Dimension_Date")
+    Time = relationship("Dimension_Time")
+
+    GranularityKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Granularity.GranularityKey'), nullable=False)
+    Granularity = relationship("Dimension_Granularity")
+
+    InstrumentKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Instruments.InstrumentKey'), nullable=False)
+    Instrument = relationship("Dimension_Instruments")
+
+    PriceTypeKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_PriceType.PriceTypeKey'), nullable=False)
+    Price = relationship("Dimension_PriceType")
+
+    # Every feature of the bar as float32, in the State_FeatureScalers Position order of the series, NaN where missing
+    Features: bytes = Column(FEATURE_ROW, nullable=False)
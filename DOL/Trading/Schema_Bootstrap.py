@@ -0,0 +1,307 @@
+import configparser
+import traceback
+import warnings
+from logging import Logger
+
+import pandas as pd
+from sqlalchemy import Index, MetaData, PrimaryKeyConstraint, UniqueConstraint, inspect, text
+from sqlalchemy.exc import SAWarning, SQLAlchemyError
+
+from CORE.Error_Handling import ErrorHandling
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DAL.Trading.Fact_Batches import VARIANT_COLUMNS, pack_fact_keys_sql
+from DOL.Trading.Base import Base
+from DOL.Trading.Facts.Facts_CleanInstruments import Facts_CleanInstrument
+from DOL.Trading.Facts.Facts_Indicators import Facts_Indicators
+from DOL.Trading.Facts.Facts_Instruments import Facts_Instruments
+from DOL.Trading.Facts.Facts_InstrumentsDataAligned import Facts_InstrumentsDataAligned
+from DOL.Trading.Facts.Facts_NormalisedFeatures import Facts_NormalisedFeatures
+from DOL.Trading.States.State_FeatureScalers import State_FeatureScalers  # noqa: F401, registers the table with Base.metadata
+from DOL.Trading.States.State_Indicators import State_Indicators  # noqa: F401, registers the table with Base.metadata
+from DOL.Trading.Storage_Types import PRICE, PRICE_TYPES
+
+FACT_MODELS: tuple = (Facts_Instruments, Facts_CleanInstrument, Facts_InstrumentsDataAligned, Facts_Indicators, Facts_NormalisedFeatures)
+
+# [system] fact_partitioning -> partition column
+PARTITION_COLUMNS: dict = {'datetime': 'DateTimeKey', 'instrument': 'InstrumentKey'}
+
+# Duplicate natural keys removed before the unique index is added keep the first row in this order:
+# the bar with the largest Volume is the most complete revision of a candle, the id breaks ties, NULL sorts last
+SURVIVOR_ORDER: tuple = (('Volume', 'DESC'), ('id', 'DESC'))
+
+# Duplicate natural keys logged when they are found
+DUPLICATE_SAMPLE_ROWS: int = 10
+
+
+class SchemaBootstrap(ErrorHandling):
+    def __init__(self, config_object: configparser.ConfigParser, postgres_interface: PostgreSQLInterface, logger: Logger):
+        """
+        Create the Trading schema and bring existing fact tables up to the model definition:
+        natural key unique index, DateTimeKey index and, on Postgres, the compact storage types and
+        optional range partitioning.
+        :param config_object: ConfigManager object
+        :param postgres_interface: PostgreSQLInterface object
+        :param logger: Logger object
+        """
+        super().__init__(logger)
+        self.logger = logger
+        self.config = config_object
+        self.postgres_interface = postgres_interface
+
+        self.partitioning: str = self.config.get('system', 'fact_partitioning', fallback='none')
+        self.partition_instruments: int = self.config.getint('system', 'fact_partition_instruments', fallback=64)
+        self.start_date: str = self.config.get('system', 'start_date')
+        self.price_precision: str = self.config.get('system', 'fact_price_precision', fallback='double')
+        self.migrate_types: bool = self.config.getboolean('system', 'migrate_storage_types', fallback=False)
+        self.remove_duplicate_facts: bool = self.config.getboolean('system', 'remove_duplicate_facts', fallback=False)
+
+    def bootstrap(self) -> bool:
+        """
+        Idempotent, safe to run before every import.
+        :return: True if successful
+        """
+        result = False
+        engine = self.postgres_interface.engine
+        postgres = engine.dialect.name == 'postgresql'
+        partitioned = postgres and self.partitioning in PARTITION_COLUMNS
+
+        try:
+            with engine.begin() as connection:
+                if postgres:
+                    connection.execute(text('CREATE SCHEMA IF NOT EXISTS "Trading"'))
+
+                fact_tables = [model.__table__ for model in FACT_MODELS]
+                Base.metadata.create_all(connection, tables=[table for table in Base.metadata.sorted_tables
+                                                             if table not in fact_tables], checkfirst=True)
+
+                inspector = inspect(connection)
+                for table in fact_tables:
+                    if not inspector.has_table(table.name, schema=table.schema):
+                        self.create_fact_table(connection, table, partitioned)
+
+                    else:
+                        if postgres and self.migrate_types:
+                            self.migrate_storage_types(connection, inspector, table)
+                        self.migrate_fact_table(connection, inspector, table)
+                        if partitioned and not self.is_partitioned(connection, table):
+                            self.logger.warning(f"bootstrap -> {table.name} already exists unpartitioned, "
+                                                f"it has to be rebuilt to use fact_partitioning = {self.partitioning}")
+
+                    if partitioned and self.is_partitioned(connection, table):
+                        self.ensure_partitions(connection, table)
+
+            result = not self.ErrorsDetected
+
+        except SQLAlchemyError as error_:
+            self.ErrorsDetected = True
+            self.ErrorList.append(self.error_details(f"{__class__}: bootstrap -> {error_} \n {traceback.format_exc()}"))
+
+        return result
+
+    def fact_table_definition(self, table, partitioned: bool):
+        """
+        Copy of a fact table carrying the configured storage profile.
+        Prices use [system] fact_price_precision, a partitioned table needs its partition column
+        in the primary key so the key becomes (id, column).
+        :param table: fact Table
+        :param partitioned: define the partitioned variant
+        :return: Table in a scratch MetaData holding every Trading table
+        """
+        metadata = MetaData()
+        for other in Base.metadata.sorted_tables:
+            other.to_metadata(metadata)
+
+        definition = metadata.tables[table.key]
+        for column in definition.c:
+            if table.c[column.name].type is PRICE:
+                column.type = PRICE_TYPES[self.price_precision]
+
+        if partitioned:
+            partition_column = PARTITION_COLUMNS[self.partitioning]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', SAWarning)
+                definition.append_constraint(PrimaryKeyConstraint(definition.c.id, definition.c[partition_column]))
+            definition.dialect_options['postgresql']['partition_by'] = f'RANGE ("{partition_column}")'
+
+        return definition
+
+    def create_fact_table(self, connection, table, partitioned: bool) -> None:
+        """
+        Create a fact table with the storage profile, as a partitioned parent when fact_partitioning is set.
+        :param connection: open connection
+        :param table: fact Table
+        :param partitioned: create the partitioned variant
+        :return:
+        """
+        self.fact_table_definition(table, partitioned).create(connection)
+        self.logger.debug(f"create_fact_table -> {table.name} prices {self.price_precision}"
+                          f"{f', partitioned by {PARTITION_COLUMNS[self.partitioning]}' if partitioned else ''}")
+
+    def migrate_storage_types(self, connection, inspector, table) -> None:
+        """
+        Rewrite the columns of an existing Postgres fact table that differ from the storage profile.
+        String ids are recomputed from the natural key as the packed BIGINT id.
+        The table storage is measured before and after the rewrite.
+        :param connection: open connection
+        :param inspector: inspector bound to connection
+        :param table: fact Table
+        :return:
+        """
+        preparer = connection.dialect.identifier_preparer
+        definition = self.fact_table_definition(table, False)
+        current = {column['name']: column['type'].compile(dialect=connection.dialect)
+                   for column in inspector.get_columns(table.name, schema=table.schema)}
+
+        changes = []
+        for column in definition.c:
+            target = column.type.compile(dialect=connection.dialect)
+            if column.name in current and current[column.name] != target:
+                using = preparer.quote(column.name)
+                if column.name == 'id' and 'INT' not in current['id']:
+                    variant = next(name for name in VARIANT_COLUMNS if name in definition.c)
+                    using = pack_fact_keys_sql(*[preparer.quote(name) for name in
+                                                 ('InstrumentKey', 'GranularityKey', variant, 'DateTimeKey')])
+                changes.append(f"ALTER COLUMN {preparer.quote(column.name)} TYPE {target} USING {using}")
+
+        if changes:
+            before = self.storage_report(connection, table)
+            connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} {', '.join(changes)}"))
+            after = self.storage_report(connection, table)
+            self.logger.info(f"migrate_storage_types -> {table.name} {len(changes)} columns rewritten, "
+                             f"before {before}, after {after}")
+
+    def storage_report(self, connection, table) -> dict:
+        """
+        Postgres storage of a fact table, partitions included.
+        :param connection: open connection
+        :param table: fact Table
+        :return: dict of rows, table_bytes, index_bytes and bytes_per_row sampled with pg_column_size
+        """
+        target = connection.dialect.identifier_preparer.format_table(table)
+        # pg_partition_tree is empty for a plain table, the table itself is added to the tree
+        sizes = connection.execute(text("SELECT SUM(pg_relation_size(relid)), SUM(pg_indexes_size(relid)), "
+                                        "SUM(GREATEST(reltuples, 0)) "
+                                        "FROM (SELECT relid FROM pg_partition_tree(CAST(:target AS regclass)) "
+                                        "UNION SELECT CAST(:target AS regclass)) tree "
+                                        "JOIN pg_class ON pg_class.oid = tree.relid"), {'target': target}).first()
+        width = connection.execute(text(f"SELECT AVG(pg_column_size(sample.*)) FROM (SELECT * FROM {target} LIMIT 100000) sample")).scalar()
+
+        return {'rows': int(sizes[2] or 0), 'table_bytes': int(sizes[0] or 0), 'index_bytes': int(sizes[1] or 0),
+                'bytes_per_row': round(float(width or 0), 1)}
+
+    def migrate_fact_table(self, connection, inspector, table) -> None:
+        """
+        Add the natural key unique index and secondary indexes an older fact table is missing.
+        Rows duplicating a natural key are only removed with [system] remove_duplicate_facts, otherwise they are
+        reported and the unique index is not added.
+        :param connection: open connection
+        :param inspector: inspector bound to connection
+        :param table: fact Table
+        :return:
+        """
+        existing = {index['name'] for index in inspector.get_indexes(table.name, schema=table.schema)}
+        existing |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name, schema=table.schema)}
+
+        # Indexes are built on a scratch copy of the table so the model metadata is left untouched
+        scratch = table.to_metadata(MetaData())
+
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint) and constraint.name not in existing:
+                columns = list(constraint.columns.keys())
+                duplicates = self.count_duplicates(connection, table, columns)
+                if duplicates and not self.remove_duplicate_facts:
+                    self.ErrorsDetected = True
+                    self.ErrorList.append(self.error_details(
+                        f"{__class__}: migrate_fact_table -> {table.name} holds {duplicates} rows duplicating {columns}, "
+                        f"{constraint.name} not added, set [system] remove_duplicate_facts to delete them"))
+                    continue
+
+                removed = self.remove_duplicates(connection, table, columns) if duplicates else 0
+                Index(constraint.name, *[scratch.c[name] for name in columns], unique=True).create(connection)
+                self.logger.debug(f"migrate_fact_table -> {table.name} added {constraint.name}, {removed} duplicates removed")
+
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                self.logger.debug(f"migrate_fact_table -> {table.name} added {index.name}")
+
+    def count_duplicates(self, connection, table, columns: list) -> int:
+        """
+        :return: number of rows that duplicate the natural key of another row
+        """
+        preparer = connection.dialect.identifier_preparer
+        group = ', '.join(preparer.quote(name) for name in columns)
+        return connection.execute(text(f"SELECT COALESCE(SUM(copies - 1), 0) FROM (SELECT COUNT(*) AS copies "
+                                       f"FROM {preparer.format_table(table)} GROUP BY {group} HAVING COUNT(*) > 1) duplicated")).scalar()
+
+    def remove_duplicates(self, connection, table, columns: list) -> int:
+        """
+        Delete every row duplicating a natural key except the first one in SURVIVOR_ORDER.
+        The count and a sample of the affected natural keys are logged.
+        :param connection: open connection
+        :param table: fact Table
+        :param columns: natural key columns
+        :return: number of rows removed
+        """
+        preparer = connection.dialect.identifier_preparer
+        target = preparer.format_table(table)
+        group = ', '.join(preparer.quote(name) for name in columns)
+        order = ', '.join(f"{preparer.quote(name)} {direction} NULLS LAST" for name, direction in SURVIVOR_ORDER if name in table.c)
+        ranked = (f"SELECT id, {group}, ROW_NUMBER() OVER (PARTITION BY {group} ORDER BY {order}) AS position "
+                  f"FROM {target}")
+
+        sample = connection.execute(text(f"SELECT DISTINCT {group} FROM ({ranked}) ranked WHERE position > 1 "
+                                         f"LIMIT {DUPLICATE_SAMPLE_ROWS}")).all()
+        removed = connection.execute(text(f"DELETE FROM {target} WHERE id IN "
+                                          f"(SELECT id FROM ({ranked}) ranked WHERE position > 1)")).rowcount
+
+        self.logger.warning(f"remove_duplicates -> {table.name} removed {removed} rows duplicating {columns}, "
+                            f"kept the first by {[name for name, _ in SURVIVOR_ORDER if name in table.c]}, "
+                            f"keys include {[tuple(row) for row in sample]}")
+        return removed
+
+    def is_partitioned(self, connection, table) -> bool:
+        if connection.dialect.name != 'postgresql':
+            return False
+
+        return connection.execute(text("SELECT 1 FROM pg_partitioned_table p "
+                                       "JOIN pg_class c ON c.oid = p.partrelid "
+                                       "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                                       "WHERE n.nspname = :schema AND c.relname = :name"),
+                                  {'schema': table.schema, 'name': table.name}).first() is not None
+
+    def ensure_partitions(self, connection, table) -> None:
+        """
+        Create the range partitions that do not exist yet plus a DEFAULT partition.
+        DateTimeKey gets one partition per year from start_date to next year,
+        InstrumentKey one per fact_partition_instruments keys up to the largest stored instrument.
+        :param connection: open connection
+        :param table: partitioned fact Table
+        :return:
+        """
+        preparer = connection.dialect.identifier_preparer
+        column = PARTITION_COLUMNS[self.partitioning]
+
+        if column == 'DateTimeKey':
+            years = range(pd.Timestamp(self.start_date).year, pd.Timestamp.now('UTC').year + 2)
+            bounds = [(f"y{year}", year * 10 ** 10, (year + 1) * 10 ** 10) for year in years]
+        else:
+            largest = connection.execute(text('SELECT MAX("InstrumentKey") FROM "Trading"."Dimension_Instruments"')).scalar() or 0
+            width = self.partition_instruments
+            bounds = [(f"i{start}", start, start + width) for start in range(0, largest + width, width)]
+
+        for suffix, lower, upper in bounds:
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {preparer.quote_schema(table.schema)}.{preparer.quote(f'{table.name}_{suffix}')} "
+                                    f"PARTITION OF {preparer.format_table(table)} FOR VALUES FROM ({lower}) TO ({upper})"))
+
+        connection.execute(text(f"CREATE TABLE IF NOT EXISTS {preparer.quote_schema(table.schema)}.{preparer.quote(f'{table.name}_default')} "
+                                f"PARTITION OF {preparer.format_table(table)} DEFAULT"))
+
+
+if __name__ == '__main__':
+    from CORE.Config_Manager import ConfigManager
+    from Logger import log_maker
+
+    logs = log_maker('SchemaBootstrap', '../../configs.ini')
+    cm = ConfigManager(logs, '../../configs.ini')
+    SchemaBootstrap(cm.create_config(), PostgreSQLInterface(cm.create_config(), logs), logs).bootstrap()
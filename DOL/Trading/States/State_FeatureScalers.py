@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+
+from sqlalchemy import Column, Float, ForeignKey
+from sqlalchemy.orm import relationship
+
+from ..Base import Base
+from ..Storage_Types import DATETIME_KEY, DIMENSION_KEY
+
+
+@dataclass
+class State_FeatureScalers(Base):
+    __tablename__ = 'State_FeatureScalers'
+    __bind_key__ = 'Trading'
+    __table_args__ = {'schema': 'Trading'}
+
+    # Scaler fitted on the first build of a series, later bars are normalised with it unchanged
+    InstrumentKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Instruments.InstrumentKey'), primary_key=True)
+    Instrument = relationship("Dimension_Instruments")
+
+    GranularityKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Granularity.GranularityKey'), primary_key=True)
+    Granularity = relationship("Dimension_Granularity")
+
+    PriceTypeKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_PriceType.PriceTypeKey'), primary_key=True)
+    Price = relationship("Dimension_PriceType")
+
+    FeatureKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Features.FeatureKey'), primary_key=True)
+    Feature = relationship("Dimension_Features")
+
+    # Column of the feature in Facts_NormalisedFeatures.Features
+    Position: int = Column(DIMENSION_KEY, nullable=False)
+
+    # Normalised value = (value - Location) / Scale, mean / std for zscore, min / range for minmax
+    Location: float = Column(Float, nullable=False)
+    Scale: float = Column(Float, nullable=False)
+
+    # Last bar materialised into Facts_NormalisedFeatures
+    DateTimeKey: int = Column(DATETIME_KEY, nullable=False)
@@ -0,0 +1,28 @@
+from dataclasses import dataclass
+
+from sqlalchemy import Column, ForeignKey, Text
+from sqlalchemy.orm import relationship
+
+from ..Base import Base
+from ..Storage_Types import DATETIME_KEY, DIMENSION_KEY
+
+
+@dataclass
+class State_Indicators(Base):
+    __tablename__ = 'State_Indicators'
+    __bind_key__ = 'Trading'
+    __table_args__ = {'schema': 'Trading'}
+
+    # One checkpoint per streamed indicator parameter set, keyed by the IndicatorKey of its first line
+    InstrumentKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Instruments.InstrumentKey'), primary_key=True)
+    Instrument = relationship("Dimension_Instruments")
+
+    GranularityKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Granularity.GranularityKey'), primary_key=True)
+    Granularity = relationship("Dimension_Granularity")
+
+    IndicatorKey: int = Column(DIMENSION_KEY, ForeignKey('Trading.Dimension_Indicators.IndicatorKey'), primary_key=True)
+    Indicator = relationship("Dimension_Indicators")
+
+    # Last Facts_CleanInstrument bar folded into the state
+    DateTimeKey: int = Column(DATETIME_KEY, nullable=False)
+    State: str = Column(Text, nullable=False)
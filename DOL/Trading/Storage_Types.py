@@ -0,0 +1,13 @@
+from sqlalchemy import BigInteger, DOUBLE_PRECISION, Integer, LargeBinary, REAL, SmallInteger
+
+# Compact storage profile shared by the Facts_* tables
+FACT_ID = BigInteger            # Packed natural key, see DAL.Trading.Fact_Batches.pack_fact_keys
+DATETIME_KEY = BigInteger       # YYYYMMDDHHMMSS
+CALENDAR_KEY = Integer          # DateKey YYYYMMDD / TimeKey HHMMSS, the type of the Dimension_Date / Dimension_Time keys
+DIMENSION_KEY = SmallInteger    # Granularity, Instrument (13 bit), PriceType, Indicator and Feature (11 bit) keys
+VOLUME = BigInteger
+FEATURE_ROW = LargeBinary       # float32 little endian normalised features of one bar, see DAL.Trading.Normalised_Features
+
+# [system] fact_price_precision -> price column type, applied by Schema_Bootstrap when a fact table is created
+PRICE_TYPES: dict = {'double': DOUBLE_PRECISION(), 'real': REAL()}
+PRICE = PRICE_TYPES['double']
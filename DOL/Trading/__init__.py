@@ -10,6 +10,7 @@ from .Dimensions.Dimension_TargetDataType import Dimension_TargetDataType
 from .Dimensions.Dimension_Instruments import Dimension_Instruments
 from .Dimensions.Dimension_Indicators import Dimension_Indicators
 from .Dimensions.Dimension_PriceType import Dimension_PriceType
+from .Dimensions.Dimension_Features import Dimension_Features
 
 # Facts tables
 from .Facts.Facts_CleanInstruments import Facts_CleanInstrument
@@ -17,3 +18,6 @@ from .Facts.Facts_Instruments import Facts_Instruments
 from .Facts.Facts_NormalisedFeatures import Facts_NormalisedFeatures
 from .Facts.Facts_Indicators import Facts_Indicators
 
+# State tables
+from .States.State_Indicators import State_Indicators
+from .States.State_FeatureScalers import State_FeatureScalers
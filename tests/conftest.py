@@ -0,0 +1,96 @@
+import configparser
+import logging
+import os
+
+import numpy as np
+import pytest
+from sqlalchemy import Column, MetaData, Table, UniqueConstraint, event, text
+
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DAL.Trading.Fact_Batches import FactBatch, pack_fact_keys
+from DOL.Trading.Facts.Facts_Instruments import Facts_Instruments
+
+# Throwaway Postgres database, the Postgres cases are skipped without it
+POSTGRES_DSN = os.environ.get('TEST_POSTGRES_DSN')
+
+
+def standalone_table(table: Table) -> Table:
+    """
+    Copy of a fact table with its natural key but without the foreign keys, so no dimension rows are needed.
+    """
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+               for column in table.columns]
+    constraints = [UniqueConstraint(*constraint.columns.keys(), name=constraint.name)
+                   for constraint in table.constraints if isinstance(constraint, UniqueConstraint)]
+    return Table(table.name, MetaData(), *columns, *constraints, schema=table.schema)
+
+
+def table_without_natural_key(table: Table) -> Table:
+    """
+    Copy of a fact table as an older schema created it, without the natural key or foreign keys.
+    """
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+               for column in table.columns]
+    return Table(table.name, MetaData(), *columns, schema=table.schema)
+
+
+def make_interface(db_string: str) -> PostgreSQLInterface:
+    config = configparser.ConfigParser()
+    config['system'] = {'db_string': db_string, 'hide_progress_bar': 'True', 'echo_transactions': 'False'}
+    return PostgreSQLInterface(config, logging.getLogger('test_postgres_interface'))
+
+
+def instrument_batch(close: list, volume: list = None) -> FactBatch:
+    """
+    :param close: Close of consecutive daily bars from 2024-01-01, NaN allowed in Open
+    :return: Facts_Instruments batch of instrument 1, granularity 1, price type 1
+    """
+    size = len(close)
+    datetime_keys = np.array([20240101000000 + day * 1000000 for day in range(size)], dtype=np.int64)
+    keys = np.ones(size, dtype=np.int64)
+    columns = {
+        'id': pack_fact_keys(keys, keys, keys, datetime_keys),
+        'DateTimeKey': datetime_keys,
+        'DateKey': datetime_keys // 1000000,
+        'TimeKey': datetime_keys % 1000000,
+        'GranularityKey': keys,
+        'InstrumentKey': keys,
+        'PriceTypeKey': keys,
+        'Open': np.full(size, np.nan),
+        'High': np.array(close, dtype=np.float64),
+        'Low': np.array(close, dtype=np.float64),
+        'Close': np.array(close, dtype=np.float64),
+        'Volume': np.array(volume if volume is not None else [10] * size, dtype=np.int64),
+    }
+    return FactBatch(Facts_Instruments, columns)
+
+
+@pytest.fixture
+def tables() -> list:
+    """
+    Tables the interface fixture creates in the Trading schema, a module testing other tables overrides it.
+    """
+    return [standalone_table(Facts_Instruments.__table__)]
+
+
+@pytest.fixture(params=['sqlite', pytest.param('postgresql', marks=pytest.mark.skipif(
+    not POSTGRES_DSN, reason='TEST_POSTGRES_DSN is not set'))])
+def interface(request, tables):
+    if request.param == 'sqlite':
+        # In-memory stand-in, SingletonThreadPool keeps one connection so the attached schema persists
+        interface = make_interface('sqlite://')
+        event.listen(interface.engine, 'connect',
+                     lambda connection, record: connection.execute("ATTACH DATABASE ':memory:' AS Trading"))
+    else:
+        interface = make_interface(POSTGRES_DSN)
+        with interface.engine.begin() as connection:
+            connection.execute(text('CREATE SCHEMA IF NOT EXISTS "Trading"'))
+
+    for table in tables:
+        table.drop(interface.engine, checkfirst=True)
+        table.create(interface.engine)
+    yield interface
+
+    for table in reversed(tables):
+        table.drop(interface.engine, checkfirst=True)
+    interface.close_database_connection()
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from DAL.Trading.Calendar import date_dimension, datetime64_to_keys, datetime_keys_to_datetime64, time_dimension, \
+    tradable_mask
+
+
+def test_date_dimension_matches_pandas_calendar_attributes():
+    # Leap years, a century and ISO weeks that belong to the neighbouring year
+    start, end = '1999-12-01', '2025-01-31'
+    dates = pd.date_range(start, end, freq='D')
+
+    frame = date_dimension(start, end)
+
+    assert frame.shape[0] == dates.size
+    expected = {
+        'DateKey': dates.year * 10000 + dates.month * 100 + dates.day,
+        'Year': dates.year,
+        'Quarter': dates.quarter,
+        'Month': dates.month,
+        'Week': dates.isocalendar().week,
+        'DayOfMonth': dates.day,
+        'Day': dates.dayofweek,
+        'DayOfYear': dates.dayofyear,
+        'IsYearStart': dates.is_year_start,
+        'IsYearEnd': dates.is_year_end,
+        'IsQuarterStart': dates.is_quarter_start,
+        'IsQuarterEnd': dates.is_quarter_end,
+        'IsMonthStart': dates.is_month_start,
+        'IsMonthEnd': dates.is_month_end,
+        'IsLeapYear': dates.is_leap_year,
+        'IsWeekend': dates.dayofweek >= 5,
+    }
+    for name, values in expected.items():
+        np.testing.assert_array_equal(frame[name].to_numpy(), np.asarray(values, dtype=np.int64), err_msg=name)
+    assert list(frame['DateString']) == list(dates.strftime('%Y-%m-%d'))
+
+
+def test_time_dimension_matches_pandas_time_attributes():
+    times = pd.date_range('2024-01-01', periods=86400, freq='s')
+
+    frame = time_dimension()
+
+    np.testing.assert_array_equal(frame['Hour'].to_numpy(), times.hour)
+    np.testing.assert_array_equal(frame['Minute'].to_numpy(), times.minute)
+    np.testing.assert_array_equal(frame['Second'].to_numpy(), times.second)
+    np.testing.assert_array_equal(frame['TimeKey'].to_numpy(), times.hour * 10000 + times.minute * 100 + times.second)
+    assert list(frame['TimeString'][[0, 3661, 86399]]) == ['00:00:00', '01:01:01', '23:59:59']
+    assert list(frame['TimeOfDay'][[0, 6 * 3600, 12 * 3600, 86399]]) == ['Night', 'Morning', 'Afternoon', 'Evening']
+    # The Sydney session wraps around midnight
+    assert list(frame['IsSydneySession'][[21 * 3600 + 3599, 22 * 3600, 0, 6 * 3600 + 3599, 7 * 3600]]) == [0, 1, 1, 1, 0]
+
+
+def test_tradable_mask_across_the_weekend():
+    hours = pd.date_range('2024-01-05', '2024-01-08 23:00', freq='h')
+
+    mask = tradable_mask(hours.to_numpy())
+
+    # Closed from the New York close on Friday 22:00 to the Sydney open on Sunday 22:00
+    closed = (hours >= pd.Timestamp('2024-01-05 22:00')) & (hours < pd.Timestamp('2024-01-07 22:00'))
+    np.testing.assert_array_equal(mask, ~closed)
+
+    edges = np.array(['2024-01-05T21:59:59', '2024-01-05T22:00:00', '2024-01-07T21:59:59', '2024-01-07T22:00:00'],
+                     dtype='datetime64[s]')
+    assert list(tradable_mask(edges)) == [True, False, False, True]
+
+
+def test_datetime_keys_round_trip():
+    values = pd.date_range('1999-12-31 23:59:58', periods=5000, freq='17min').to_numpy().astype('datetime64[s]')
+
+    datetime_keys, date_keys, time_keys = datetime64_to_keys(values)
+
+    assert list(datetime_keys[:2]) == [19991231235958, 20000101001658]
+    np.testing.assert_array_equal(datetime_keys, date_keys * 1_000_000 + time_keys)
+    np.testing.assert_array_equal(datetime_keys_to_datetime64(datetime_keys), values)
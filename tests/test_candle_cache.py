@@ -0,0 +1,101 @@
+import configparser
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from CORE.Candle_Cache import CandleCache
+
+START, END = pd.Timestamp('2020-01-01'), pd.Timestamp('2020-03-31')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    config = configparser.ConfigParser()
+    config['system'] = {'candle_cache_path': str(tmp_path), 'candle_cache_max_mb': '64', 'candle_cache_fresh_minutes': '60'}
+    return CandleCache(config, logging.getLogger('test_candle_cache'))
+
+
+class Broker:
+    """
+    Daily candles from 2020, answers with the frames listed in answers first, then with the real candles.
+    """
+    def __init__(self, answers: list = None):
+        self.answers = list(answers or [])
+        self.calls = []
+
+    def __call__(self, start: pd.Timestamp, end: pd.Timestamp):
+        self.calls.append((start, end))
+        if self.answers:
+            return self.answers.pop(0)
+
+        index = pd.date_range(start.ceil('D'), end, freq='D', name='DateTime')
+        close = index.dayofyear.to_numpy(dtype=np.float64)
+        return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1}, index=index)
+
+
+def get(cache: CandleCache, broker: Broker, start: pd.Timestamp = START, end: pd.Timestamp = END):
+    return cache.get_candles('EUR_USD', 'D', 'M', start, end, broker)
+
+
+def test_fetched_months_are_served_from_cache(cache):
+    broker = Broker()
+    first = get(cache, broker)
+    second = get(cache, broker)
+
+    assert len(broker.calls) == 1
+    assert first.shape[0] == 91
+    pd.testing.assert_frame_equal(first, second, check_freq=False)
+    # March is only covered up to END, it stays incomplete and is served while fresh
+    assert [entry['complete'] for _, entry in sorted(cache.manifest.items())] == [True, True, False]
+
+
+def test_failed_fetch_is_not_cached(cache):
+    broker = Broker(answers=[False])
+
+    assert get(cache, broker) is False
+    assert cache.ErrorsDetected
+    assert cache.manifest == {}
+
+
+def test_empty_fetch_is_not_marked_complete(cache):
+    broker = Broker(answers=[pd.DataFrame()])
+
+    assert get(cache, broker).empty
+    assert cache.manifest == {}
+
+    # The range is asked for again and cached once the broker answers
+    assert get(cache, broker).shape[0] == 91
+    assert len(broker.calls) == 2
+
+
+def test_least_recently_used_partitions_are_evicted(cache):
+    broker = Broker()
+    get(cache, broker)
+    keys = sorted(cache.manifest)
+
+    # January is read again, so February is the least recently used partition
+    cache.manifest[keys[0]]['accessed'] += 10
+    cache.manifest[keys[2]]['accessed'] += 20
+    cache.max_bytes = cache.manifest[keys[0]]['bytes'] + cache.manifest[keys[2]]['bytes']
+    cache.evict()
+
+    assert sorted(cache.manifest) == [keys[0], keys[2]]
+    assert not os.path.exists(os.path.join(cache.cache_path, f"{keys[1]}.parquet"))
+
+
+def test_corrupt_partition_is_evicted_and_fetched_again(cache):
+    broker = Broker()
+    expected = get(cache, broker)
+    february = cache.partition_key('EUR_USD', 'D', 'M', pd.Period('2020-02', freq='M'))
+    with open(os.path.join(cache.cache_path, f"{february}.parquet"), 'r+b') as partition_file:
+        partition_file.seek(16)
+        partition_file.write(b'corrupt')
+
+    frame = get(cache, broker)
+
+    assert broker.calls[-1] == (pd.Timestamp('2020-02-01'), pd.Timestamp('2020-02-29 23:59:59'))
+    pd.testing.assert_frame_equal(frame, expected, check_freq=False)
+    assert not cache.ErrorsDetected
@@ -0,0 +1,91 @@
+import configparser
+
+import numpy as np
+import pytest
+from sqlalchemy import insert
+
+from DAL.Trading.Dataset_Export import DATASET_FIELDS, DatasetExport, load_dataset
+from DAL.Trading.Dimension_Cache import DimensionCache
+from DAL.Trading.Fact_Batches import FactBatch, pack_fact_keys
+from DOL.Trading.Dimensions.Dimension_Granularity import Dimension_Granularity
+from DOL.Trading.Dimensions.Dimension_Instruments import Dimension_Instruments
+from DOL.Trading.Dimensions.Dimension_PriceType import Dimension_PriceType
+from DOL.Trading.Facts.Facts_InstrumentsDataAligned import Facts_InstrumentsDataAligned
+from tests.conftest import standalone_table
+
+DATETIME_KEYS = [20240101000000, 20240102000000, 20240103000000]
+
+
+@pytest.fixture
+def tables() -> list:
+    return [standalone_table(model.__table__) for model in
+            (Dimension_Granularity, Dimension_Instruments, Dimension_PriceType, Facts_InstrumentsDataAligned)]
+
+
+@pytest.fixture
+def exporter(interface, tmp_path, monkeypatch):
+    with interface.engine.begin() as connection:
+        connection.execute(insert(Dimension_Granularity.__table__), [{'GranularityKey': 1, 'OandaAlias': 'D'}])
+        connection.execute(insert(Dimension_PriceType.__table__), [{'PriceTypeKey': 1, 'Name': 'Mid', 'Alias': 'M'}])
+        connection.execute(insert(Dimension_Instruments.__table__),
+                           [{'InstrumentKey': key, 'Name': name, 'InstrumentTypeKey': 1}
+                            for key, name in ((1, 'EUR_USD'), (2, 'GBP_USD'), (3, 'USD_JPY'))])
+
+    # Instrument 2 misses the second bar
+    load_aligned(interface, [1, 1, 1, 2, 2], DATETIME_KEYS + [DATETIME_KEYS[0], DATETIME_KEYS[2]])
+
+    monkeypatch.setattr(DimensionCache, 'shared_cache', None)
+    config = configparser.ConfigParser()
+    config['system'] = {'dataset_export_path': str(tmp_path)}
+    return DatasetExport(config, interface, interface.logger, 'D')
+
+
+def load_aligned(interface, instrument_keys: list, datetime_keys: list) -> None:
+    """
+    Store aligned daily bars whose Close is InstrumentKey + day / 10.
+    """
+    instruments = np.array(instrument_keys, dtype=np.int64)
+    datetime_keys = np.array(datetime_keys, dtype=np.int64)
+    ones = np.ones(instruments.size, dtype=np.int64)
+    close = instruments + (datetime_keys // 1000000 % 100) / 10.0
+    columns = {'id': pack_fact_keys(instruments, ones, ones, datetime_keys), 'DateTimeKey': datetime_keys,
+               'DateKey': datetime_keys // 1000000, 'TimeKey': datetime_keys % 1000000, 'GranularityKey': ones,
+               'InstrumentKey': instruments, 'PriceTypeKey': ones, 'Open': close, 'High': close, 'Low': close,
+               'Close': close, 'Volume': instruments * 10}
+    assert interface.copy_fact_batch(FactBatch(Facts_InstrumentsDataAligned, columns), use_staging=False) == instruments.size
+
+
+def test_export_reads_back_through_load_dataset(exporter):
+    path = exporter.export()
+
+    dataset = load_dataset(path)
+    assert not exporter.ErrorsDetected
+    assert dataset['shape'] == [3, 2, len(DATASET_FIELDS)]
+    assert list(dataset['datetime_keys']) == DATETIME_KEYS
+    assert dataset['instruments'] == {'EUR_USD': 0, 'GBP_USD': 1}
+
+    close = dataset['values'][:, :, dataset['fields']['Close']]
+    np.testing.assert_allclose(close[:, 0], [1.1, 1.2, 1.3], rtol=1e-6)
+    np.testing.assert_allclose(close[[0, 2], 1], [2.1, 2.3], rtol=1e-6)
+    # The bar missing from the aligned table stays NaN
+    assert np.isnan(dataset['values'][1, 1]).all()
+
+
+def test_rows_aligned_between_the_passes_are_left_out(exporter, interface):
+    stream_aligned = exporter.stream_aligned
+    passes = []
+
+    def stream_after_a_late_load(*args):
+        passes.append(args)
+        if len(passes) == 2:
+            # A new instrument past the end of the axis, a new bar inside it and one after its end
+            load_aligned(interface, [3, 1, 2], [DATETIME_KEYS[0], 20240102120000, 20240104000000])
+        return stream_aligned(*args)
+
+    exporter.stream_aligned = stream_after_a_late_load
+    dataset = load_dataset(exporter.export())
+
+    assert not exporter.ErrorsDetected
+    assert dataset['shape'] == [3, 2, len(DATASET_FIELDS)]
+    assert list(dataset['datetime_keys']) == DATETIME_KEYS
+    assert np.isnan(dataset['values'][1, 1]).all()
@@ -0,0 +1,64 @@
+import logging
+import pickle
+
+import pandas as pd
+
+from DAL.Trading.Dimension_Cache import DimensionCache
+
+
+class CountingInterface:
+    """
+    Stand-in for PostgreSQLInterface.read_model serving dimension frames by table name and counting the reads.
+    """
+    def __init__(self, frames: dict):
+        self.frames = frames
+        self.reads = 0
+
+    def read_model(self, model) -> pd.DataFrame:
+        self.reads += 1
+        return self.frames[model.__tablename__].copy()
+
+
+def granularities(*aliases: str) -> dict:
+    return {'Dimension_Granularity': pd.DataFrame({'GranularityKey': list(range(1, len(aliases) + 1)),
+                                                   'OandaAlias': list(aliases)})}
+
+
+def make_cache(interface) -> DimensionCache:
+    return DimensionCache(interface, logging.getLogger('test_dimension_cache'))
+
+
+def test_miss_is_cached_until_the_dimension_is_read_again():
+    interface = CountingInterface(granularities('M1', 'D'))
+    cache = make_cache(interface)
+
+    assert cache.get_key('granularity', 'D') == 2
+    assert cache.get_key('granularity', 'H4') is None
+    assert cache.get_key('granularity', 'H4') is None
+    # First load plus one refresh for the unknown value
+    assert interface.reads == 2
+
+    interface.frames.update(granularities('M1', 'D', 'H4'))
+    cache.invalidate('granularity')
+    assert cache.get_key('granularity', 'H4') == 3
+    assert not cache.ErrorsDetected
+
+
+def test_lookup_without_an_interface_is_an_error():
+    cache = make_cache(None)
+
+    assert cache.get_key('granularity', 'D') is None
+    assert cache.ErrorsDetected
+
+
+def test_worker_copy_serves_loaded_keys_and_reports_unknown_ones():
+    cache = make_cache(CountingInterface(granularities('M1', 'D')))
+    cache.get_key('granularity', 'D')
+    worker = pickle.loads(pickle.dumps(cache))
+
+    assert worker.postgres_interface is None
+    assert worker.get_key('granularity', 'M1') == 1
+    assert not worker.ErrorsDetected
+
+    assert worker.get_key('granularity', 'H4') is None
+    assert worker.ErrorsDetected
@@ -0,0 +1,78 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from DAL.Trading.Fact_Batches import GRANULARITY_KEY_BITS, INSTRUMENT_KEY_BITS, VARIANT_KEY_BITS, pack_fact_keys, \
+    pack_fact_keys_sql, unpack_fact_keys
+
+
+@pytest.fixture
+def keys() -> dict:
+    """
+    Random natural keys over the whole range of every id field, the extremes included.
+    """
+    rng = np.random.default_rng(0)
+    size = 1000
+    datetime_keys = (rng.integers(1900, 2156, size) * 10_000_000_000 + rng.integers(1, 13, size) * 100_000_000
+                     + rng.integers(1, 32, size) * 1_000_000 + rng.integers(0, 24, size) * 10_000
+                     + rng.integers(0, 60, size) * 100 + rng.integers(0, 60, size))
+    keys = {
+        'InstrumentKey': rng.integers(0, 1 << INSTRUMENT_KEY_BITS, size),
+        'GranularityKey': rng.integers(0, 1 << GRANULARITY_KEY_BITS, size),
+        'PriceTypeKey': rng.integers(0, 1 << VARIANT_KEY_BITS, size),
+        'DateTimeKey': datetime_keys,
+    }
+    keys['InstrumentKey'][:2] = [0, (1 << INSTRUMENT_KEY_BITS) - 1]
+    keys['DateTimeKey'][:2] = [19000101000000, 21551231235959]
+    return keys
+
+
+def pack(keys: dict) -> np.ndarray:
+    return pack_fact_keys(keys['InstrumentKey'], keys['GranularityKey'], keys['PriceTypeKey'], keys['DateTimeKey'])
+
+
+def test_packed_ids_round_trip(keys):
+    ids = pack(keys)
+
+    assert ids.dtype == np.int64 and (ids >= 0).all()
+    unpacked = unpack_fact_keys(ids)
+    for name, values in keys.items():
+        np.testing.assert_array_equal(unpacked[name], values, err_msg=name)
+
+
+def test_packed_ids_sort_like_the_natural_key(keys):
+    order = np.lexsort((keys['DateTimeKey'], keys['PriceTypeKey'], keys['GranularityKey'], keys['InstrumentKey']))
+
+    np.testing.assert_array_equal(np.argsort(pack(keys), kind='stable'), order)
+
+
+@pytest.mark.parametrize('name, value', [('InstrumentKey', 1 << INSTRUMENT_KEY_BITS), ('InstrumentKey', -1),
+                                         ('GranularityKey', 1 << GRANULARITY_KEY_BITS),
+                                         ('PriceTypeKey', 1 << VARIANT_KEY_BITS)])
+def test_key_out_of_range_is_rejected(keys, name, value):
+    keys[name][5] = value
+
+    with pytest.raises(ValueError, match=name):
+        pack(keys)
+
+
+@pytest.mark.parametrize('datetime_key', [18991231235959, 21560101000000])
+def test_year_out_of_range_is_rejected(keys, datetime_key):
+    keys['DateTimeKey'][5] = datetime_key
+
+    with pytest.raises(ValueError, match='1900-2155'):
+        pack(keys)
+
+
+def test_sql_expression_matches_numpy_on_sqlite(keys):
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE facts ("InstrumentKey" INTEGER, "GranularityKey" INTEGER, "PriceTypeKey" INTEGER, "DateTimeKey" INTEGER)')
+    connection.executemany('INSERT INTO facts VALUES (?, ?, ?, ?)',
+                           zip(*[values.tolist() for values in keys.values()]))
+
+    expression = pack_fact_keys_sql('"InstrumentKey"', '"GranularityKey"', '"PriceTypeKey"', '"DateTimeKey"')
+    ids = [row[0] for row in connection.execute(f'SELECT {expression} FROM facts ORDER BY rowid')]
+    connection.close()
+
+    np.testing.assert_array_equal(np.array(ids, dtype=np.int64), pack(keys))
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from DAL.Trading.Gap_Fill import GAP_FILL_KERNELS, fill_gaps
+
+# Tuesday 2024-01-02 00:00 UTC, mid week so every hourly bar of the day is tradable
+TUESDAY: int = 1704153600
+HOUR: int = 3600
+
+
+def hourly_series(hours: np.ndarray) -> tuple:
+    """
+    :return: (seconds, columns) of hourly bars whose prices follow 1 + hour ** 2 / 100
+    """
+    close = 1.0 + hours.astype(np.float64) ** 2 / 100
+    columns = {'Open': close.copy(), 'High': close + 0.01, 'Low': close - 0.01, 'Close': close.copy(),
+               'Volume': np.full(hours.size, 5.0)}
+    return TUESDAY + hours * HOUR, columns
+
+
+@pytest.fixture
+def gapped() -> tuple:
+    """
+    Twelve hourly bars with the bars of hours 4, 5 and 6 missing.
+    """
+    return hourly_series(np.delete(np.arange(12), [4, 5, 6]))
+
+
+@pytest.mark.parametrize('method, expected', [
+    ('interpolate_lin', 1.09 + (1.49 - 1.09) * np.array([1, 2, 3]) / 4),
+    ('ffill', np.full(3, 1.09)),
+    # A cubic through a quadratic series is the series itself
+    ('interpolate_poly', 1.0 + np.array([4.0, 5.0, 6.0]) ** 2 / 100),
+])
+def test_each_method_fills_the_missing_bars(gapped, method, expected):
+    seconds, columns = gapped
+
+    filled_seconds, filled, source, report = fill_gaps(seconds, columns, 'H1', method)
+
+    np.testing.assert_array_equal(filled_seconds, TUESDAY + np.arange(12) * HOUR)
+    np.testing.assert_allclose(filled['Close'][4:7], expected, rtol=1e-9)
+    np.testing.assert_array_equal(source, [0, 1, 2, 3, -1, -1, -1, 4, 5, 6, 7, 8])
+    # Generated bars have no traded volume and keep High / Low around Open and Close
+    assert (filled['Volume'][4:7] == 0).all()
+    assert (filled['High'][4:7] >= filled['Close'][4:7]).all() and (filled['Low'][4:7] <= filled['Close'][4:7]).all()
+    assert (report.gaps, report.filled_gaps, report.filled_bars, report.longest_gap) == (1, 1, 3, 3)
+
+
+@pytest.mark.parametrize('method', list(GAP_FILL_KERNELS))
+def test_nan_prices_of_observed_bars_are_filled(method):
+    seconds, columns = hourly_series(np.arange(10))
+    columns['Close'][5] = np.nan
+
+    _, filled, _, report = fill_gaps(seconds, columns, 'H1', method)
+
+    assert report.missing_values == 1 and report.dropped_bars == 0
+    assert filled['Close'][4] <= filled['Close'][5] <= filled['Close'][6]
+
+
+def test_gaps_longer_than_max_gap_bars_stay_open(gapped):
+    seconds, columns = gapped
+
+    filled_seconds, _, _, report = fill_gaps(seconds, columns, 'H1', 'interpolate_lin', max_gap_bars=2)
+
+    np.testing.assert_array_equal(filled_seconds, seconds)
+    assert (report.skipped_gaps, report.skipped_bars, report.filled_bars) == (1, 3, 0)
+
+
+def test_weekend_bars_are_never_generated():
+    # Friday 20:00 and 21:00, then Sunday 22:00 and 23:00 once Sydney opens
+    friday = TUESDAY + 3 * 86400
+    seconds = np.array([friday + 20 * HOUR, friday + 21 * HOUR, friday + 70 * HOUR, friday + 71 * HOUR])
+    columns = {'Close': np.array([1.0, 1.1, 1.2, 1.3]), 'Volume': np.ones(4)}
+
+    filled_seconds, _, _, report = fill_gaps(seconds, columns, 'H1', 'ffill')
+
+    np.testing.assert_array_equal(filled_seconds, seconds)
+    assert (report.gaps, report.closed_bars) == (0, 48)
+
+
+@pytest.mark.parametrize('method', list(GAP_FILL_KERNELS))
+def test_empty_and_single_bar_series_pass_through(method):
+    empty_seconds, empty, empty_source, empty_report = fill_gaps(np.array([], dtype=np.int64),
+                                                                 {'Close': np.array([]), 'Volume': np.array([])}, 'H1', method)
+    assert empty_seconds.size == 0 and empty['Close'].size == 0 and empty_source.size == 0
+    assert empty_report.bars == 0
+
+    seconds, columns = hourly_series(np.array([3]))
+    single_seconds, single, source, report = fill_gaps(seconds, columns, 'H1', method)
+    np.testing.assert_array_equal(single_seconds, seconds)
+    assert single['Close'][0] == columns['Close'][0] and list(source) == [0]
+    assert (report.bars, report.gaps) == (1, 0)
+
+
+def test_duplicate_bars_keep_the_first_row():
+    seconds, columns = hourly_series(np.array([0, 1, 1, 2]))
+    columns['Close'][2] = 9.0
+
+    filled_seconds, filled, source, report = fill_gaps(seconds, columns, 'H1', 'ffill')
+
+    np.testing.assert_array_equal(filled_seconds, TUESDAY + np.arange(3) * HOUR)
+    assert list(source) == [0, 1, 3] and 9.0 not in filled['Close']
+    assert report.bars == 3
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from DAL.Trading.Granularity_Detection import detect_granularity
+
+
+def to_seconds(index: pd.DatetimeIndex) -> np.ndarray:
+    return index.to_numpy().astype('datetime64[s]').astype(np.int64)
+
+
+def bar_seconds(start: str, periods: int, freq: str) -> np.ndarray:
+    return to_seconds(pd.date_range(start, periods=periods, freq=freq))
+
+
+def test_regular_series():
+    detection = detect_granularity(bar_seconds('2024-01-02', 500, '5min'))
+
+    assert (detection.granularity, detection.step, detection.confidence, detection.samples) == ('M5', 300, 1.0, 499)
+    assert detection.matches('M5', min_confidence=1.0)
+    assert not detection.matches('M1')
+
+
+def test_series_with_gaps_keeps_its_granularity_at_a_lower_confidence():
+    seconds = bar_seconds('2024-01-02', 500, 'h')
+    kept = np.random.default_rng(0).random(seconds.size) > 0.2
+
+    detection = detect_granularity(seconds[kept])
+
+    assert detection.granularity == 'H1'
+    assert 0.5 < detection.confidence < 1.0
+    assert detection.matches('H1', min_confidence=0.5)
+    assert not detection.matches('H1', min_confidence=0.95)
+
+
+def test_unsorted_and_repeated_bars_are_measured_in_order():
+    seconds = bar_seconds('2024-01-02', 100, '15min')
+    shuffled = np.random.default_rng(0).permutation(np.concatenate([seconds, seconds[:10]]))
+
+    detection = detect_granularity(shuffled)
+
+    assert (detection.granularity, detection.confidence, detection.samples) == ('M15', 1.0, 99)
+
+
+def test_daily_and_monthly_bars_allow_for_their_calendar():
+    # Daily bars opening at the New York close move by an hour with daylight saving
+    daily = pd.date_range('2024-03-01 22:00', periods=30, freq='D', tz='America/New_York').tz_convert('UTC').tz_localize(None)
+    monthly = bar_seconds('2020-01-01', 24, 'MS')
+
+    for seconds, granularity in ((to_seconds(daily), 'D'), (monthly, 'M')):
+        detection = detect_granularity(seconds)
+
+        assert (detection.granularity, detection.confidence) == (granularity, 1.0)
+
+
+def test_ambiguous_series_is_not_recognised():
+    # Irregular ticks whose most common distance is no bar length
+    ticks = np.cumsum(np.random.default_rng(0).choice([7, 7, 7, 11, 13], 200))
+
+    detection = detect_granularity(ticks)
+
+    assert detection.granularity is None and detection.step == 7
+    assert not detection.matches('S5')
+    # Too few distances to judge, a short frame only fails when it clearly holds another granularity
+    assert detection.matches('S5', min_samples=1000)
+
+
+def test_too_short_series_has_no_granularity():
+    for seconds in (np.array([], dtype=np.int64), bar_seconds('2024-01-02', 1, 'h')):
+        detection = detect_granularity(seconds)
+
+        assert (detection.granularity, detection.samples) == (None, 0)
+        assert detection.matches('H1', min_samples=1)
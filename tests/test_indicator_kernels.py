@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from DAL.Trading.Indicator_Kernels import INDICATOR_KERNELS, RECURRENCE_BLOCK, ewm, rolling_mean, rolling_std
+from DAL.Trading.Indicator_Streams import INDICATOR_STREAMS, Ema, RingWindow
+
+# Every [indicators] bucket with each of its parameter sets
+STREAM_CASES = [(name, parameters) for name, (_, _, parameter_sets) in INDICATOR_KERNELS.items() for parameters in parameter_sets]
+
+
+@pytest.fixture
+def series() -> np.ndarray:
+    """
+    Three columns over several recurrence blocks: warm up NaN in front, a gap inside one column,
+    a single NaN inside another.
+    """
+    bars = 4 * RECURRENCE_BLOCK + 5
+    x = np.random.default_rng(0).normal(1.0, 0.1, (bars, 3))
+    x[:3] = np.nan
+    x[40:47, 0] = np.nan
+    x[90, 1] = np.nan
+    return x
+
+
+@pytest.fixture
+def ohlcv() -> np.ndarray:
+    """
+    Random walk bars, long enough to fill the 200 bar moving average with a few hundred bars to spare.
+    """
+    rng = np.random.default_rng(1)
+    bars = 600
+    close = 1.1 + np.cumsum(rng.normal(0, 1e-3, bars))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 1e-3, (bars, 2)))
+    volume = rng.integers(1, 500, bars).astype(np.float64)
+    return np.column_stack([open_, np.maximum(open_, close) + spread[:, 0], np.minimum(open_, close) - spread[:, 1], close, volume])
+
+
+def run_stream(stream, ohlcv: np.ndarray) -> dict:
+    """
+    :return: dict of line -> (bars, 5) np.ndarray of the stream fed one bar at a time
+    """
+    rows = [stream.update(bar) for bar in ohlcv]
+    return {line: np.array([row[line] for row in rows]) for line in rows[0]}
+
+
+def test_ewm_skips_nan_rows_like_pandas(series):
+    expected = pd.DataFrame(series).ewm(alpha=0.2, adjust=False, ignore_na=True).mean().to_numpy()
+
+    np.testing.assert_allclose(ewm(series, 0.2), expected, rtol=1e-12)
+
+
+def test_ewm_without_gaps_matches_pandas(series):
+    x = np.nan_to_num(series[3:], nan=1.0)
+
+    np.testing.assert_allclose(ewm(x, 0.2), pd.DataFrame(x).ewm(alpha=0.2, adjust=False).mean().to_numpy(), rtol=1e-12)
+
+
+def test_rolling_mean_only_drops_windows_holding_a_nan(series):
+    expected = pd.DataFrame(series).rolling(10).mean().to_numpy()
+
+    np.testing.assert_allclose(rolling_mean(series, 10), expected, rtol=1e-12)
+
+
+def test_rolling_std_matches_pandas_across_restarts(series, monkeypatch):
+    # Restart the cumulative sums every few windows so the chunk boundaries are crossed
+    monkeypatch.setattr('DAL.Trading.Indicator_Kernels.ROLLING_CHUNK', 16)
+    drifting = series + np.linspace(0.0, 50.0, series.shape[0])[:, None]
+    expected = pd.DataFrame(drifting).rolling(10).std(ddof=0).to_numpy()
+
+    np.testing.assert_allclose(rolling_std(drifting, 10), expected, rtol=1e-9)
+
+
+def test_rolling_std_of_a_constant_window_is_zero():
+    x = np.full((30, 2), 1.1)
+
+    assert (rolling_std(x, 10)[9:] == 0.0).all()
+
+
+def test_streams_follow_the_kernels_over_nan_rows(series):
+    ema, window = Ema(0.2, 3), RingWindow(10, 3)
+    smoothed, means = [], []
+    for row in series:
+        smoothed.append(ema.update(row))
+        window.push(row)
+        means.append(window.mean())
+
+    np.testing.assert_allclose(np.array(smoothed), ewm(series, 0.2), rtol=1e-12)
+    np.testing.assert_allclose(np.array(means), rolling_mean(series, 10), rtol=1e-9)
+
+
+@pytest.mark.parametrize('name, parameters', STREAM_CASES)
+def test_stream_matches_the_batch_kernel(name, parameters, ohlcv):
+    kernel = INDICATOR_KERNELS[name][0]
+    expected = kernel(ohlcv, *parameters)
+    streamed = run_stream(INDICATOR_STREAMS[name](*parameters), ohlcv)
+
+    assert streamed.keys() == expected.keys()
+    for line, values in expected.items():
+        np.testing.assert_allclose(streamed[line], values, rtol=1e-9, atol=1e-9, err_msg=f"{name} {parameters} {line}")
+
+
+@pytest.mark.parametrize('name, parameters', STREAM_CASES)
+def test_stream_resumes_from_a_checkpoint(name, parameters, ohlcv):
+    middle = ohlcv.shape[0] // 2 + 7
+    uninterrupted = run_stream(INDICATOR_STREAMS[name](*parameters), ohlcv)
+
+    first = INDICATOR_STREAMS[name](*parameters)
+    run_stream(first, ohlcv[:middle])
+    resumed = INDICATOR_STREAMS[name](*parameters).loads(first.dumps())
+    continued = run_stream(resumed, ohlcv[middle:])
+
+    for line, values in uninterrupted.items():
+        np.testing.assert_array_equal(continued[line], values[middle:], err_msg=f"{name} {parameters} {line}")
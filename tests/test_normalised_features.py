@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from DAL.Trading.Fact_Batches import FactBatch, pack_fact_keys
+from DAL.Trading.Normalised_Features import pack_feature_rows, unpack_feature_rows
+from DOL.Trading.Facts.Facts_NormalisedFeatures import Facts_NormalisedFeatures
+from tests.conftest import standalone_table
+
+
+@pytest.fixture
+def tables() -> list:
+    return [standalone_table(Facts_NormalisedFeatures.__table__)]
+
+
+def feature_values(bars: int, width: int) -> np.ndarray:
+    values = np.random.default_rng(0).normal(size=(bars, width)).astype(np.float32)
+    # Warm up bars of an indicator feature
+    values[:2, 1] = np.nan
+    return values
+
+
+def test_feature_rows_round_trip():
+    values = feature_values(5, 4)
+
+    rows = pack_feature_rows(values)
+
+    assert rows.shape == (5,) and all(len(row) == 16 for row in rows)
+    np.testing.assert_array_equal(unpack_feature_rows(rows, 4), values)
+
+
+def test_copy_fact_batch_stores_one_feature_row_per_bar(interface):
+    values = feature_values(3, 4)
+    datetime_keys = np.array([20240101000000, 20240102000000, 20240103000000], dtype=np.int64)
+    keys = np.ones(3, dtype=np.int64)
+    columns = {'id': pack_fact_keys(keys, keys, keys, datetime_keys), 'DateTimeKey': datetime_keys,
+               'DateKey': datetime_keys // 1000000, 'TimeKey': datetime_keys % 1000000, 'GranularityKey': keys,
+               'InstrumentKey': keys, 'PriceTypeKey': keys, 'Features': pack_feature_rows(values)}
+
+    assert interface.copy_fact_batch(FactBatch(Facts_NormalisedFeatures, columns)) == 3
+
+    table = Facts_NormalisedFeatures.__table__
+    with interface.engine.connect() as connection:
+        rows = connection.execute(select(table.c.Features).order_by(table.c.DateTimeKey)).scalars().all()
+    np.testing.assert_array_equal(unpack_feature_rows(rows, 4), values)
@@ -0,0 +1,182 @@
+import asyncio
+import configparser
+import logging
+import time
+
+import pandas as pd
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from CORE.Oanda_Candle_Fetcher import OandaCandleFetcher, TokenBucket
+
+START, END = pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-10')
+
+
+def candle(day: pd.Timestamp, close: float, complete: bool = True) -> dict:
+    return {'complete': complete, 'volume': 1, 'time': f"{day.isoformat()}.000000000Z",
+            'mid': {'o': '1.0', 'h': '2.0', 'l': '0.5', 'c': str(close)}}
+
+
+class MockOanda:
+    """
+    Local candles endpoint of the v20 REST API serving daily bars for any from / to range.
+    Each page repeats the first bar of the next page with Close -1, the bar ending at END is incomplete.
+    Statuses listed in failures are answered first, one per request, keyed by the 'from' of the request.
+    """
+    def __init__(self, failures: dict = None, delays: dict = None, retry_after: str = None):
+        self.failures = failures or {}
+        self.delays = delays or {}
+        self.retry_after = retry_after
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def candles(self, request: web.Request) -> web.Response:
+        start = request.query['from']
+        self.requests.append((start, time.monotonic()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Later chunks answer first, so pages arrive out of order
+            await asyncio.sleep(self.delays.get(start, 0))
+        finally:
+            self.in_flight -= 1
+
+        failures = self.failures.get(start, [])
+        if failures:
+            headers = {'Retry-After': self.retry_after} if self.retry_after else {}
+            return web.Response(status=failures.pop(0), headers=headers)
+
+        days = pd.date_range(start.rstrip('Z'), request.query['to'].rstrip('Z'), freq='D')
+        page = [candle(day, day.day) for day in days]
+        page.append(candle(days[-1] + pd.Timedelta(days=1), -1.0, complete=days[-1] < END))
+        return web.json_response({'candles': page})
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v3/instruments/{instrument}/candles', self.candles)
+        return app
+
+    def starts(self) -> list:
+        return [start for start, _ in self.requests]
+
+
+@pytest.fixture
+def config() -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config['oanda'] = {'account_type': 'fxTrade Practice', 'access_token': 'token', 'max_candles_per_request': '3',
+                       'max_concurrent_requests': '2', 'requests_per_second': '1000', 'request_retries': '2',
+                       'request_backoff_seconds': '0'}
+    config['system'] = {'start_date': '2024-01-01'}
+    OandaCandleFetcher.rate_limiter = None
+    yield config
+    OandaCandleFetcher.rate_limiter = None
+
+
+def make_fetcher(config: configparser.ConfigParser, **oanda) -> OandaCandleFetcher:
+    config['oanda'].update({key: str(value) for key, value in oanda.items()})
+    return OandaCandleFetcher(config, logging.getLogger('test_oanda_candle_fetcher'))
+
+
+async def fetch(fetcher: OandaCandleFetcher, mock: MockOanda, start=START, end=END) -> pd.DataFrame:
+    """
+    Fetch start to end through the fetcher's own session from mock served on a local port.
+    """
+    async with TestServer(mock.application()) as server:
+        fetcher.api_url = str(server.make_url('')).rstrip('/')
+        async with fetcher.open_session() as session:
+            return await fetcher.fetch_candles(session, 'EUR_USD', 'D', 'M', start, end)
+
+
+def request_start(day: pd.Timestamp) -> str:
+    return day.strftime('%Y-%m-%dT%H:%M:%S.000000000Z')
+
+
+def test_chunk_range_splits_on_max_candles(config):
+    chunks = make_fetcher(config).chunk_range('D', START, END)
+
+    assert [(start.day, end.day) for start, end in chunks] == [(1, 3), (4, 6), (7, 9), (10, 10)]
+
+
+def test_pages_are_ordered_bounded_and_deduplicated(config):
+    starts = [request_start(START + pd.Timedelta(days=day)) for day in (0, 3, 6, 9)]
+    mock = MockOanda(delays={start: 0.02 * (len(starts) - index) for index, start in enumerate(starts)})
+
+    frame = asyncio.run(fetch(make_fetcher(config), mock))
+
+    assert list(frame.index) == list(pd.date_range(START, END, freq='D'))
+    # The bar repeated on a page boundary keeps the value of the page that owns it
+    assert list(frame['Close']) == [float(day) for day in range(1, 11)]
+    assert sorted(mock.starts()) == starts
+    assert mock.max_in_flight == 2
+
+
+def test_throttled_pages_wait_for_retry_after(config):
+    second = request_start(START + pd.Timedelta(days=3))
+    mock = MockOanda(failures={second: [429, 429]}, retry_after='0.1')
+
+    frame = asyncio.run(fetch(make_fetcher(config), mock))
+
+    assert frame.shape[0] == 10
+    retries = [at for start, at in mock.requests if start == second]
+    assert len(retries) == 3
+    assert retries[1] - retries[0] >= 0.1 and retries[2] - retries[1] >= 0.1
+
+
+def test_failed_pages_back_off_exponentially(config):
+    first = request_start(START)
+    mock = MockOanda(failures={first: [503, 502]})
+
+    frame = asyncio.run(fetch(make_fetcher(config, request_backoff_seconds=0.05), mock))
+
+    assert frame.shape[0] == 10
+    retries = [at for start, at in mock.requests if start == first]
+    # backoff * 2 ** attempt plus up to backoff of jitter
+    assert 0.05 <= retries[1] - retries[0] < 0.5
+    assert 0.1 <= retries[2] - retries[1] < 0.5
+
+
+def test_failed_chunk_returns_false_and_records_error(config):
+    fetcher = make_fetcher(config)
+    first = request_start(START)
+    mock = MockOanda(failures={first: [503, 503, 503]})
+
+    async def run() -> pd.DataFrame:
+        async with TestServer(mock.application()) as server:
+            fetcher.api_url = str(server.make_url('')).rstrip('/')
+            # The blocking entry point runs its own event loop, keep the server's loop serving meanwhile
+            return await asyncio.to_thread(fetcher.get_historical_candles, 'EUR_USD', 'D', 'M', START, END)
+
+    assert asyncio.run(run()) is False
+    assert fetcher.ErrorsDetected
+    assert mock.starts().count(first) == 3
+
+
+def test_requests_are_held_to_requests_per_second(config):
+    # One bar per request, 30 requests against a bucket holding 20 tokens refilled at 20 per second
+    fetcher = make_fetcher(config, max_candles_per_request=1, max_concurrent_requests=10, requests_per_second=20)
+    mock = MockOanda()
+
+    frame = asyncio.run(fetch(fetcher, mock, START, START + pd.Timedelta(days=29)))
+
+    assert frame.shape[0] == 30
+    times = sorted(at for _, at in mock.requests)
+    assert len(times) == 30
+    assert times[-1] - times[0] >= 0.45
+    assert all(times[index] - times[0] >= (index - 20) / 20 - 0.02 for index in range(20, 30))
+
+
+def test_token_bucket_is_shared_across_event_loops():
+    bucket = TokenBucket(rate=100, capacity=5)
+
+    async def drain(count: int) -> None:
+        for _ in range(count):
+            await bucket.acquire()
+
+    began = time.monotonic()
+    asyncio.run(drain(5))
+    asyncio.run(drain(10))
+
+    # The burst is spent by the first loop, the second loop waits for the refill
+    assert time.monotonic() - began >= 0.09
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from CORE.Postgres_Interface import PostgreSQLInterface
+from DOL.Trading.Facts.Facts_Instruments import Facts_Instruments
+from tests.conftest import instrument_batch
+
+
+def stored_rows(interface: PostgreSQLInterface) -> list:
+    table = Facts_Instruments.__table__
+    with interface.engine.connect() as connection:
+        return connection.execute(select(table.c.DateTimeKey, table.c.Open, table.c.Close, table.c.Volume)
+                                  .order_by(table.c.DateTimeKey)).all()
+
+
+def test_copy_fact_batch_loads_every_row(interface):
+    written = interface.copy_fact_batch(instrument_batch([1.0, 2.0, 3.0]))
+
+    assert written == 3
+    assert not interface.ErrorsDetected
+    rows = stored_rows(interface)
+    assert [row.Close for row in rows] == [1.0, 2.0, 3.0]
+    # NaN prices are stored as NULL
+    assert all(row.Open is None for row in rows)
+    assert interface.load_statistics['Facts_Instruments']['rows'] == 3
+
+
+def test_copy_fact_batch_reload_keeps_stored_rows(interface):
+    interface.copy_fact_batch(instrument_batch([1.0, 2.0]))
+    written = interface.copy_fact_batch(instrument_batch([5.0, 6.0, 7.0]), on_conflict='nothing')
+
+    assert written == 1
+    assert [row.Close for row in stored_rows(interface)] == [1.0, 2.0, 7.0]
+
+
+def test_copy_fact_batch_update_overwrites_on_natural_key(interface):
+    interface.copy_fact_batch(instrument_batch([1.0, 2.0]))
+    interface.copy_fact_batch(instrument_batch([5.0, 6.0, 7.0], volume=[1, 2, 3]), on_conflict='update')
+
+    rows = stored_rows(interface)
+    assert [row.Close for row in rows] == [5.0, 6.0, 7.0]
+    assert [row.Volume for row in rows] == [1, 2, 3]
+
+
+def test_copy_fact_batch_failure_is_reported(interface):
+    Facts_Instruments.__table__.drop(interface.engine)
+
+    assert interface.copy_fact_batch(instrument_batch([1.0])) is False
+    assert interface.ErrorsDetected
+    assert 'Failed to load Facts_Instruments' in interface.ErrorList[-1][1]
+
+
+def test_copy_fact_batch_replace_is_one_transaction(interface):
+    interface.copy_fact_batch(instrument_batch([1.0, 2.0, 3.0]))
+    failing = instrument_batch([5.0, 6.0])
+    failing.columns['Close'][1] = np.nan
+
+    # Close is NOT NULL, the failed load rolls the delete back with it. SQLite INSERT OR IGNORE would skip the row
+    assert interface.copy_fact_batch(failing, on_conflict='update', replace=True) is False
+    assert [row.Close for row in stored_rows(interface)] == [1.0, 2.0, 3.0]
+
+    interface.ErrorsDetected = False
+    assert interface.copy_fact_batch(instrument_batch([5.0, 6.0]), replace=True) == 2
+    assert [row.Close for row in stored_rows(interface)] == [5.0, 6.0]
+
+
+def test_stream_model_dtype_follows_the_column_definition(interface):
+    interface.copy_fact_batch(instrument_batch([1.0, 2.0, 3.0]))
+
+    batches = list(interface.stream_model(Facts_Instruments, columns=['DateTimeKey', 'Open', 'Volume'], batch_size=2))
+
+    assert len(batches) == 2
+    for batch in batches:
+        # Volume is a nullable integer, float64 even when a batch holds no NULL
+        assert (batch['DateTimeKey'].dtype, batch['Open'].dtype, batch['Volume'].dtype) == (np.int64, np.float64, np.float64)
+
+
+def test_stream_model_raises_a_failed_read(interface):
+    Facts_Instruments.__table__.drop(interface.engine)
+
+    with pytest.raises(SQLAlchemyError):
+        list(interface.stream_model(Facts_Instruments))
+    assert interface.ErrorsDetected
@@ -0,0 +1,81 @@
+import configparser
+
+import pytest
+from sqlalchemy import inspect, select, text
+
+from DOL.Trading.Facts.Facts_Instruments import Facts_Instruments
+from DOL.Trading.Schema_Bootstrap import SchemaBootstrap
+from tests.conftest import instrument_batch, table_without_natural_key
+
+
+@pytest.fixture
+def tables() -> list:
+    return [table_without_natural_key(Facts_Instruments.__table__)]
+
+
+@pytest.fixture(autouse=True)
+def duplicated_bars(interface) -> None:
+    """
+    Every bar loaded twice, the second copy with a larger Volume and a smaller id.
+    """
+    first = instrument_batch([1.0, 2.0], volume=[5, 5])
+    second = instrument_batch([1.5, 2.5], volume=[9, 9])
+    second.columns['id'] = second.columns['id'] - 1
+    interface.copy_fact_batch(first, use_staging=False)
+    interface.copy_fact_batch(second, use_staging=False)
+
+
+def make_bootstrap(interface, remove_duplicate_facts: bool = False) -> SchemaBootstrap:
+    config = configparser.ConfigParser()
+    config['system'] = {'start_date': '2024-01-01', 'remove_duplicate_facts': str(remove_duplicate_facts)}
+    return SchemaBootstrap(config, interface, interface.logger)
+
+
+def migrate(interface, remove_duplicate_facts: bool) -> SchemaBootstrap:
+    bootstrap = make_bootstrap(interface, remove_duplicate_facts)
+    with interface.engine.begin() as connection:
+        bootstrap.migrate_fact_table(connection, inspect(connection), Facts_Instruments.__table__)
+    return bootstrap
+
+
+def stored(interface) -> list:
+    table = Facts_Instruments.__table__
+    with interface.engine.connect() as connection:
+        return connection.execute(select(table.c.Close, table.c.Volume).order_by(table.c.DateTimeKey)).all()
+
+
+def natural_key_indexed(interface) -> bool:
+    table = Facts_Instruments.__table__
+    with interface.engine.connect() as connection:
+        return any(index['name'] == 'uq_Facts_Instruments_natural_key'
+                   for index in inspect(connection).get_indexes(table.name, schema=table.schema))
+
+
+def test_duplicates_are_reported_and_kept_by_default(interface):
+    bootstrap = migrate(interface, remove_duplicate_facts=False)
+
+    assert bootstrap.ErrorsDetected
+    assert 'holds 2 rows duplicating' in bootstrap.ErrorList[-1][1]
+    assert len(stored(interface)) == 4
+    assert not natural_key_indexed(interface)
+
+
+def test_opt_in_removal_keeps_the_most_complete_bar(interface):
+    bootstrap = migrate(interface, remove_duplicate_facts=True)
+
+    assert not bootstrap.ErrorsDetected
+    assert [tuple(row) for row in stored(interface)] == [(1.5, 9), (2.5, 9)]
+    assert natural_key_indexed(interface)
+
+
+def test_storage_report_measures_a_plain_table(interface):
+    if interface.engine.dialect.name != 'postgresql':
+        pytest.skip('storage_report reads the Postgres size functions')
+
+    bootstrap = make_bootstrap(interface)
+    with interface.engine.begin() as connection:
+        connection.execute(text('ANALYZE "Trading"."Facts_Instruments"'))
+        report = bootstrap.storage_report(connection, Facts_Instruments.__table__)
+
+    assert report['rows'] == 4
+    assert report['table_bytes'] > 0 and report['index_bytes'] > 0 and report['bytes_per_row'] > 0
@@ -0,0 +1,28 @@
+import configparser
+import logging
+
+import numpy as np
+
+from CORE.Sqlite_Interface import SqliteInterface
+
+
+def test_stream_table_dtype_follows_the_declaration(tmp_path):
+    config = configparser.ConfigParser()
+    config['system'] = {}
+    interface = SqliteInterface(config, logging.getLogger('test_sqlite_interface'))
+    db_name = str(tmp_path / 'staging.db')
+
+    con = interface.connect(db_name)
+    con.execute('CREATE TABLE bars (id INTEGER PRIMARY KEY, n INTEGER NOT NULL, volume INTEGER, close REAL, "Date" TIMESTAMP)')
+    con.executemany('INSERT INTO bars VALUES (?, ?, ?, ?, ?)', [(1, 1, 5, 1.0, '2020-01-01 00:00:00'),
+                                                               (2, 2, None, None, None),
+                                                               (3, 3, 7, 2.0, '2020-01-02 00:00:00')])
+
+    # One row per batch, the batch holding the NULLs has the same dtype as the others
+    batches = list(interface.stream_table(db_name, 'bars', batch_size=1))
+
+    assert len({batch.dtype for batch in batches}) == 1
+    assert [batches[0].dtype[name] for name in batches[0].dtype.names] == \
+           [np.dtype(np.int64), np.dtype(np.int64), np.dtype(np.float64), np.dtype(np.float64), np.dtype('datetime64[s]')]
+    assert np.isnan(batches[1].volume[0]) and np.isnat(batches[1].Date[0])
+    interface.close_all_connections()